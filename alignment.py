@@ -1,8 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 import attr
+import shutil
+import itertools
+import collections
+import multiprocessing.pool
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
 
 from command import *
+from utils import atomic_open
+from checkpoint import Checkpoint, checkpoint_key, file_digest
 
 
 @attr.s
@@ -41,17 +53,129 @@ class AlignmentRecord(object):
 		cols = record.strip().split('\t')
 		return cls(*cols)
 
+	@classmethod
+	def from_columns(cls, cols):
+		return cls(*cols)
+
+
+#column names and types of alignment tabular output
+ALIGNMENT_COLUMNS = [
+	('query', str),
+	('subject', str),
+	('identity', float),
+	('matches', int),
+	('mismatch', int),
+	('gapopen', int),
+	('qstart', int),
+	('qend', int),
+	('sstart', int),
+	('send', int),
+	('evalue', float),
+	('score', float)
+]
+
+def lazy_column(idx, convert):
+	'''
+	create a property to convert column value when accessed
+	@para idx int, column index
+	@para convert, function to convert string to correct data type
+	'''
+	return property(lambda self: convert(self.cols[idx]))
+
+class LazyAlignmentRecord(object):
+	'''
+	alignment result record only keeps the splitted columns, numeric
+	column is converted when it is accessed, compare equal with the
+	AlignmentRecord of same line
+	@para cols list, 12 columns of alignment tabular line
+	'''
+	__slots__ = ['cols']
+
+	def __init__(self, cols):
+		self.cols = cols
+
+	def __repr__(self):
+		return "LazyAlignmentRecord(%s)" % ", ".join(
+			"%s=%r" % (name, getattr(self, name)) for name, _ in ALIGNMENT_COLUMNS)
+
+	def __eq__(self, other):
+		return all(getattr(self, name) == getattr(other, name, None) for name, _ in ALIGNMENT_COLUMNS)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def as_record(self):
+		return AlignmentRecord.from_columns(self.cols)
+
+for _idx, (_name, _convert) in enumerate(ALIGNMENT_COLUMNS):
+	setattr(LazyAlignmentRecord, _name, lazy_column(_idx, _convert))
+
+def make_record_factory(fast=False, columns=None, symbols=None):
+	'''
+	create a function to make record from splitted columns
+	@para fast bool, use LazyAlignmentRecord instead of AlignmentRecord
+	@para columns list, only convert these columns to a namedtuple record,
+	query column is always included
+	@para symbols, utils.SymbolTable to convert subject to integer handle
+	@return function
+	'''
+	converters = dict(ALIGNMENT_COLUMNS)
+	if symbols is not None:
+		converters['subject'] = symbols.get_id
+
+	if columns:
+		names = [name for name, _ in ALIGNMENT_COLUMNS]
+		columns = ['query'] + [c for c in columns if c != 'query']
+		for column in columns:
+			if column not in names:
+				raise Exception("** Unknown alignment column %s **" % column)
+
+		record = collections.namedtuple('ProjectedAlignmentRecord', columns)
+		indexes = [(names.index(c), converters[c]) for c in columns]
+		return lambda cols: record._make([convert(cols[i]) for i, convert in indexes])
+
+	if fast:
+		if symbols is not None:
+			raise Exception("** subject handles can not be used with lazy records **")
+		return LazyAlignmentRecord
+
+	if symbols is not None:
+		return lambda cols: AlignmentRecord.from_columns([cols[0], symbols.get_id(cols[1])] + cols[2:])
+
+	return AlignmentRecord.from_columns
+
 
 @attr.s
 class AlignmentParaser(object):
 	'''
 	A generator for parsing alignment tabular result to
-	get each record in output tabular file
+	get each record in output tabular file, the hits of each query are
+	filtered before records are created, the query without any hits
+	passed filters is skipped
 	@para alignment_fh, alignment file handler
+	@para fast, create lightweight records with lazy converted columns
+	@para columns, only keep these columns in namedtuple records
+	@para max_hits, keep alignments of top number of subjects by bit score
+	@para max_evalue, maximum expected value
+	@para min_score, minimum bit score
+	@para min_identity, minimum identity percent
+	@para score_dropoff, keep alignments with bit score not lower than
+	best score * (1 - dropoff) of the query, e.g. 0.1
+	@para symbols, utils.SymbolTable, subject of records is converted to
+	integer handle of the table
 	'''
 	alignment_fh = attr.ib()
+	fast = attr.ib(default=False)
+	columns = attr.ib(default=None)
+	max_hits = attr.ib(default=None)
+	max_evalue = attr.ib(default=None)
+	min_score = attr.ib(default=None)
+	min_identity = attr.ib(default=None)
+	score_dropoff = attr.ib(default=None)
+	symbols = attr.ib(default=None)
+	make_record = attr.ib(init=False)
+	prev_cols = attr.ib(init=False, default=None)
 	query_name = attr.ib(init=False)
-	prev_record = attr.ib(init=False)
 
 	#@alignment_file.validator
 	#def check_alignment_file(self, attribute, value):
@@ -60,38 +184,192 @@ class AlignmentParaser(object):
 
 	#	if not os.path.getsize(value):
 	#		raise Exception("** No alignment record in file %s **" % value)
-	
+
+	@make_record.default
+	def get_record_factory(self):
+		return make_record_factory(self.fast, self.columns, self.symbols)
+
 	@query_name.default
 	def get_first_query(self):
 		for line in self.alignment_fh:
 			if line[0] == '#' or not line.strip():
 				continue
-			self.prev_record = AlignmentRecord.from_string(line)
-			return self.prev_record.query
+			self.prev_cols = line.strip().split('\t')
+			return self.prev_cols[0]
 
 	def __iter__(self):
 		return self
 
-	def next(self):
-		rows = [self.prev_record]
+	def iter_query(self):
+		'''
+		read the alignments of current query, the first line of next query
+		is kept for the next call
+		@return generator, splitted columns of alignments of current query
+		'''
+		cols = self.prev_cols
+		self.prev_cols = None
+		yield cols
 
 		for line in self.alignment_fh:
-			row = AlignmentRecord.from_string(line)
-			
-			if row.query != self.query_name and rows:
-				self.prev_record = row
-				self.query_name = row.query
-				return rows
-			
-			rows.append(row)
-
-		if rows and self.prev_record is not None:
-			self.prev_record = None
-			return rows
+			#comment and blank lines like get_first_query
+			if line[0] == '#' or not line.strip():
+				continue
+
+			cols = line.strip().split('\t')
+
+			if cols[0] != self.query_name:
+				self.prev_cols = cols
+				self.query_name = cols[0]
+				return
+
+			yield cols
+
+	def filter_hits(self, hits):
+		'''
+		filter alignments of a query by the best bit score of query
+		@para hits list, bit score and splitted columns of alignments passed
+		the row filters
+		@return list, passed alignment columns in original order
+		'''
+		if self.score_dropoff is not None and hits:
+			cutoff = max(score for score, cols in hits) * (1 - self.score_dropoff)
+			hits = [hit for hit in hits if hit[0] >= cutoff]
+
+		if self.max_hits is not None:
+			best = collections.OrderedDict()
+			for score, cols in hits:
+				if score > best.get(cols[1], float('-inf')):
+					best[cols[1]] = score
+
+			if len(best) > self.max_hits:
+				subjects = sorted(best, key=lambda subject: -best[subject])
+				subjects = set(subjects[:self.max_hits])
+				hits = [hit for hit in hits if hit[1][1] in subjects]
+
+		return [cols for score, cols in hits]
+
+	def next(self):
+		max_evalue = self.max_evalue
+		min_identity = self.min_identity
+		min_score = self.min_score
+		ranked = self.score_dropoff is not None or self.max_hits is not None
+
+		while self.prev_cols is not None:
+			#row filters are applied when the line is read, the filtered
+			#lines are not kept
+			rows = self.iter_query()
+			if max_evalue is not None:
+				rows = (cols for cols in rows if float(cols[10]) <= max_evalue)
+
+			if min_identity is not None:
+				rows = (cols for cols in rows if float(cols[2]) >= min_identity)
+
+			#bit score is parsed once for score filter and ranking
+			if ranked:
+				hits = ((float(cols[11]), cols) for cols in rows)
+				if min_score is not None:
+					hits = (hit for hit in hits if hit[0] >= min_score)
+				hits = self.filter_hits(list(hits))
+			elif min_score is not None:
+				hits = [cols for cols in rows if float(cols[11]) >= min_score]
+			else:
+				hits = list(rows)
+
+			if hits:
+				return [self.make_record(cols) for cols in hits]
 
 		raise StopIteration
 
 
+def iter_alignment_arrays(alignment_fh):
+	'''
+	read alignment tabular file to numpy structured array for each query,
+	the query and subject are object fields and others are numeric fields
+	@para alignment_fh, alignment file handler
+	@return generator, structured array of alignments of one query
+	'''
+	if np is None:
+		raise Exception("** numpy is required for reading alignment to array **")
+
+	dtype = np.dtype([(name, 'O' if convert is str else convert) for name, convert in ALIGNMENT_COLUMNS])
+	lines = (line for line in alignment_fh if line[0] != '#' and line.strip())
+	for query, group in itertools.groupby(lines, key=lambda line: line.split('\t', 1)[0]):
+		rows = [line.strip().split('\t') for line in group]
+		array = np.empty(len(rows), dtype=dtype)
+		for name, col in zip(dtype.names, zip(*rows)):
+			array[name] = np.array(col, dtype=dtype[name])
+		yield array
+
+
+def split_fasta(fasta, outdir, shards, by='count'):
+	'''
+	split query FASTA file into contiguous shards with nearly equal number
+	of sequences or residues, the sequence order is kept
+	@para fasta str, input FASTA file
+	@para outdir str, output directory of shard files
+	@para shards int, number of shards
+	@para by str, split by sequence count or residue count
+	@return list, shard FASTA files, empty shard is not created
+	'''
+	if by not in ('count', 'residues'):
+		raise Exception("** Unknown shard method %s **" % by)
+
+	#first pass to count the total size
+	total = 0
+	with open(fasta) as fh:
+		for line in fh:
+			if line[0] == '>':
+				total += by == 'count'
+			elif by == 'residues':
+				total += len(line.strip())
+
+	shard_files = []
+	size = 0
+	op = None
+	with open(fasta) as fh:
+		for line in fh:
+			if line[0] == '>' and (op is None or \
+				(size >= total * len(shard_files) / float(shards) and len(shard_files) < shards)):
+				if op is not None:
+					op.close()
+				shard_files.append(os.path.join(outdir, "shard_%03d.fa" % len(shard_files)))
+				op = open(shard_files[-1], 'w')
+
+			if line[0] == '>':
+				size += by == 'count'
+			elif by == 'residues':
+				size += len(line.strip())
+
+			if op is not None:
+				op.write(line)
+
+	if op is not None:
+		op.close()
+
+	return shard_files
+
+def run_checkpointed(aligner, key, resume=True):
+	'''
+	run alignment and mark it completed in the directory of output file,
+	the alignment is skipped if it has been completed with the same key
+	@para aligner, Aligner object
+	@para key str, checkpoint key of alignment
+	@para resume bool, skip the completed alignment
+	'''
+	checkpoint = Checkpoint(os.path.dirname(aligner.outfile), key)
+	name = os.path.basename(aligner.outfile)
+
+	if resume and checkpoint.is_done(name) and os.path.isfile(aligner.outfile):
+		return
+
+	if aligner.shards > 1:
+		aligner.execute_shards(key)
+	else:
+		aligner.execute()
+
+	checkpoint.mark_done(name)
+
+
 @attr.s
 class Aligner(object):
 	'''
@@ -102,6 +380,10 @@ class Aligner(object):
 	@para evalue, expected value 1e-5
 	@para seqtype, the query sequence type dna or protein
 	@para mode, only used by diamond and rapsearch, fast or sensitive
+	@para shards, number of query shards aligned in parallel
+	@para shard_by, split query by sequence count or residue count
+	@para workers, number of shards aligned at the same time, default all
+	@para resume, skip the alignment or shards completed by previous run
 	'''
 	query = attr.ib()
 	db = attr.ib()
@@ -110,9 +392,13 @@ class Aligner(object):
 	evalue = attr.ib(default=1e-5)
 	seqtype = attr.ib(default='dna')
 	mode = attr.ib(default='sensitive')
-	
+
 	outfile = attr.ib()
-	
+	shards = attr.ib(default=1)
+	shard_by = attr.ib(default='count')
+	workers = attr.ib(default=None)
+	resume = attr.ib(default=True)
+
 	@outfile.default
 	def get_output_file(self):
 		'''
@@ -122,29 +408,130 @@ class Aligner(object):
 		outname = "%s_aligned_to_%s.out" % (aligner, os.path.basename(self.db))
 		return os.path.join(self.outdir, outname)
 
+	def get_checkpoint_key(self):
+		'''
+		@return str, checkpoint key from query digest and alignment options
+		'''
+		return checkpoint_key(file_digest(self.query), self.__class__.__name__,
+			self.db, self.evalue, self.seqtype, self.mode)
+
+	def run(self):
+		'''
+		run alignment for whole query or for query shards in parallel, the
+		alignment completed by previous run with the same query and options
+		is skipped
+		'''
+		run_checkpointed(self, self.get_checkpoint_key(), self.resume)
+
+	def execute_shards(self, key):
+		'''
+		split query into shards and align shards by a worker pool, each
+		worker uses cpus/workers threads, the completed shard output is
+		kept, so a failed run can be retried without rerun completed shards,
+		finally the shard outputs are merged in query order
+		@para key str, checkpoint key of the whole alignment
+		'''
+		shard_dir = "%s.shards" % self.outfile
+		if not os.path.isdir(shard_dir):
+			os.makedirs(shard_dir)
+
+		shard_files = split_fasta(self.query, shard_dir, self.shards, self.shard_by)
+		workers = min(self.workers or len(shard_files), len(shard_files)) or 1
+		threads = max(1, self.cpus // workers)
+
+		aligners = [self.__class__(
+			query = shard_file,
+			db = self.db,
+			outdir = shard_dir,
+			cpus = threads,
+			evalue = self.evalue,
+			seqtype = self.seqtype,
+			mode = self.mode,
+			outfile = "%s.out" % shard_file
+		) for shard_file in shard_files]
+
+		key = checkpoint_key(key, self.shards, self.shard_by)
+		pool = multiprocessing.pool.ThreadPool(workers)
+		results = [pool.apply_async(run_checkpointed, (aligner, key, self.resume)) for aligner in aligners]
+		pool.close()
+		pool.join()
+
+		failed = []
+		for aligner, result in zip(aligners, results):
+			try:
+				result.get()
+			except Exception as e:
+				failed.append("%s: %s" % (aligner.query, e))
+
+		if failed:
+			raise Exception("** %d alignment shards failed **\n%s" % (len(failed), "\n".join(failed)))
+
+		with atomic_open(self.outfile) as out:
+			for aligner in aligners:
+				with open(aligner.outfile) as fh:
+					shutil.copyfileobj(fh, out)
+
+	def stream(self, keep_output=False):
+		'''
+		run alignment in background and yield tabular lines from pipe as
+		soon as they are produced, so that annotation can be performed at
+		the same time with alignment
+		@para keep_output bool, also write the alignments to outfile
+		@return generator, alignment tabular lines
+		'''
+		if self.shards > 1:
+			raise Exception("** Streaming alignment can not be used with shards **")
+
+		lines = self.execute(stream=True)
+
+		if not keep_output:
+			for line in lines:
+				yield line
+			return
+
+		with open(self.outfile, 'w') as out:
+			for line in lines:
+				out.write(line)
+				yield line
+
 
 @attr.s
 class BlastAligner(Aligner):
 	'''
 	Align sequence to protein database using blast
 	'''
-	def execute(self):
+	def execute(self, stream=False):
+		'''
+		@para stream bool, write alignments to stdout and return iterator
+		of output lines while blast is running
+		'''
 		aligner = blastx
+		program = 'blastx'
 		if self.seqtype == 'protein':
 			aligner = blastp
+			program = 'blastp'
 
-		aligner(
+		args = [
 			"-num_threads", self.cpus,
 			"-word_size", 3,
 			"-max_hsps", 20,
-			"-num_alignments", 20,
+			"-num_alignments", 20
+		]
+
+		options = dict(
 			outfmt = 6,
 			db = self.db,
 			query = self.query,
-			out = self.outfile,
 			evalue = self.evalue
 		)
 
+		#sh keeps all output of iterated command in memory, pipe is read
+		#by subprocess so that blast is blocked until lines are consumed
+		if stream:
+			return iter_pipe_lines(make_args([program] + args, options, '-'))
+
+		return aligner(*args, out=self.outfile, **options)
+
 	@staticmethod
 	def make_blast_db(infile, outfile):
 		'''
@@ -160,24 +547,34 @@ class DiamondAligner(Aligner):
 	'''
 	Align sequence to protein database using diamond
 	'''
-	def execute(self):
+	def execute(self, stream=False):
+		'''
+		@para stream bool, write alignments to stdout and return iterator
+		of output lines while diamond is running
+		'''
 		aligner = diamond.blastx
+		program = 'blastx'
 		if self.seqtype == 'protein':
 			aligner = diamond.blastp
-		
+			program = 'blastp'
+
 		flag = self.mode == 'sensitive'
-	
-		aligner(
+
+		options = dict(
 			outfmt = 6,
 			db = self.db,
 			query = self.query,
-			out = self.outfile,
 			evalue = self.evalue,
 			threads = self.cpus,
 			sensitive = not flag,
 			more_sensitive = flag
 		)
 
+		if stream:
+			return iter_pipe_lines(make_args(['diamond', program], options))
+
+		return aligner(out=self.outfile, **options)
+
 	@staticmethod
 	def make_diamond_db(infile, outfile):
 		'''
@@ -193,7 +590,10 @@ class RAPSearchAligner(Aligner):
 	'''
 	Align sequence to protein database using rapsearch2	
 	'''
-	def execute(self):
+	def execute(self, stream=False):
+		if stream:
+			raise Exception("** rapsearch can not write alignments to pipe **")
+
 		types = {'dna': 'n', 'protein': 'a'}
 		modes = {'fast': 't', 'sensitive': 'f'}
 		rapsearch(
@@ -220,7 +620,7 @@ class RAPSearchAligner(Aligner):
 
 
 @attr.s
-class Alignment(Aligner):
+class Alignment(object):
 	'''
 	@para aligner, the alignment tool to be used
 	@para query, input FASTA file with multiple sequences
@@ -230,6 +630,10 @@ class Alignment(Aligner):
 	@para evalue, expected value 1e-5
 	@para seqtype, the query sequence type dna or protein
 	@para mode, only used by diamond and rapsearch, fast or sensitive
+	@para shards, number of query shards aligned in parallel
+	@para shard_by, split query by sequence count or residue count
+	@para workers, number of shards aligned at the same time, default all
+	@para resume, skip the alignment or shards completed by previous run
 	'''
 	aligner = attr.ib()
 	query = attr.ib()
@@ -239,6 +643,10 @@ class Alignment(Aligner):
 	evalue = attr.ib(default=1e-5)
 	seqtype = attr.ib(default='dna')
 	mode = attr.ib(default='sensitive')
+	shards = attr.ib(default=1)
+	shard_by = attr.ib(default='count')
+	workers = attr.ib(default=None)
+	resume = attr.ib(default=True)
 
 	aligners = attr.ib(
 		default = dict(
@@ -267,7 +675,11 @@ class Alignment(Aligner):
 			cpus = self.cpus,
 			evalue = self.evalue,
 			seqtype = self.seqtype,
-			mode = self.mode
+			mode = self.mode,
+			shards = self.shards,
+			shard_by = self.shard_by,
+			workers = self.workers,
+			resume = self.resume
 		)
 
 
@@ -1,23 +1,39 @@
 #!/usr/bin/evn python
 # -*- coding: utf-8 -*-
 import os
+import abc
 import attr
+import shutil
+import contextlib
+import collections
 
-from mapping import GOTermMapper
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+import config
+from obo import load_ontology
+from mapping import GOTermMapper, merge_cache_stats
+from propagation import TermPropagator, gather_rows, group_keys, split_keys
+from alignment import AlignmentParaser
+from utils import EvidencePolicy, SymbolTable, atomic_open, evidence_ranks, evidence_weights, parallel_map
+from output import AnnotationFormatter, open_writers, output_paths
+from checkpoint import Checkpoint, checkpoint_key
 
 @attr.s
 class Annotator(object):
 	'''
-	Gene ontology annotation according to alignment file and
-	extract go terms for gene from go association database
+	Abstract base of GO annotation methods, the subclass assigns GO terms
+	to a batch of queries from the hits and GO terms of subjects, GO terms
+	of subjects are searched by GoAnnotation or by go_mapper
 	'''
-	alignment_file = attr.ib()
-	go_mapper = attr.ib(init=False)
+	__metaclass__ = abc.ABCMeta
+
+	#alignment columns required by annotate_groups
+	columns = ['subject']
 
-	@alignment_file.validator
-	def check_alignment_file(self):
-		if not os.path.exists(self.alignment_file):
-			raise Exception("** Alignment file %s is not exists**" % self.alignment_file)
+	go_mapper = attr.ib()
 
 	@go_mapper.default
 	def get_go_mapping(self):
@@ -30,52 +46,597 @@ class Annotator(object):
 		'''
 		return self.go_mapper.get_go_terms_by_acc(acc)
 
+	def get_go_terms_for_many(self, accs):
+		'''
+		extract GO terms for many associated genes in one batch
+		@accs, accession numbers of genes
+		@return dict, accession as key and GO terms as value
+		'''
+		return self.go_mapper.get_go_terms_for_many(accs)
+
+	@abc.abstractmethod
+	def annotate_groups(self, groups, acc_terms, term_index=None):
+		'''
+		assign GO terms to a batch of queries
+		@para groups list, alignments of each query
+		@para acc_terms dict, subject accession as key and GO terms as value
+		@para term_index dict, term handle to DAG term id when GO terms of
+		subjects are database term ids, None for GO term accessions
+		@return list, (GO term, score) tuples of each query
+		'''
+
 
 @attr.s
-class Blast2goAnnotator(Annotator):
+class ScoringAnnotator(Annotator):
 	'''
-	Implementation of Blast2go annotation method
+	Base of annotators that score candidate GO terms of a batch of queries
+	together with numpy arrays, query and term are packed into one integer
+	key query * n + term id
+	@para obo_file str, go-basic.obo file
+	@para relations list, relation types used to reach ancestors, None for is_a
 	'''
-	pass
+	obo_file = attr.ib(default=attr.Factory(lambda: config.GO_OBO))
+	relations = attr.ib(default=None)
+	propagator = attr.ib(init=False)
+
+	@propagator.default
+	def get_propagator(self):
+		if np is None:
+			raise Exception("** numpy is required for %s **" % self.__class__.__name__)
+		return TermPropagator(load_ontology(self.obo_file), self.get_relations())
+
+	def get_relations(self):
+		'''
+		@return list, relation types of propagator
+		'''
+		return self.relations
+
+	def encode_hits(self, groups, acc_terms, column, term_index=None):
+		'''
+		convert hits and GO terms of subjects to arrays
+		@para groups list, alignments of each query
+		@para acc_terms dict, subject accession as key and GO terms as value
+		@para column str, alignment column used to score hit
+		@para term_index dict, term handle to DAG term id, None for GO terms
+		@return tuple, query, subject and column value of each hit and the
+		CSR arrays of term id and evidence id of each subject
+		'''
+		index = self.propagator.dag.index if term_index is None else term_index
+		subjects = {}
+		ptr = [0]
+		terms = []
+		evidences = []
+		for acc, pairs in acc_terms.iteritems():
+			subjects[acc] = len(subjects)
+			for term, evidence in pairs:
+				if term in index:
+					terms.append(index[term])
+					evidences.append(int(evidence or 0))
+			ptr.append(len(terms))
+
+		queries = []
+		hits = []
+		values = []
+		for q, alignments in enumerate(groups):
+			for alignment in alignments:
+				queries.append(q)
+				hits.append(subjects[alignment.subject])
+				values.append(getattr(alignment, column))
 
+		return (np.array(queries, dtype=np.int64), np.array(hits, dtype=np.int64),
+			np.array(values, dtype=np.float64), np.array(ptr, dtype=np.int64),
+			np.array(terms, dtype=np.int32), np.array(evidences, dtype=np.int64))
+
+	def select_lowest(self, keys, scores, size, closed=True):
+		'''
+		keep the most specific terms of each query and their scores
+		@para keys array, sorted unique keys of passed terms
+		@para scores array, score of each key
+		@para size int, number of queries
+		@para closed bool, passed terms contain all their ancestors
+		@return list, (GO term, score) tuples of each query
+		'''
+		n = self.propagator.n
+		ptr, idx = self.propagator.reduce_ids(*split_keys(keys, n, size), closed=closed)
+		scores = scores[np.searchsorted(keys, np.repeat(np.arange(size, dtype=np.int64), np.diff(ptr)) * n + idx)]
+
+		names = self.propagator.decode(ptr, idx)
+		bounds = ptr.tolist()
+		scores = scores.tolist()
+		return [zip(names[q], scores[bounds[q]:bounds[q+1]]) for q in xrange(size)]
 
 
 @attr.s
-class GotchaAnnotator(Annotator):
+class Blast2goAnnotator(ScoringAnnotator):
 	'''
-	Implementation of Gotcha annotation method
+	Implementation of Blast2go annotation rule, the direct score of a
+	term is the maximum hit similarity multiplied by evidence code weight,
+	the annotation rule of a term and its ancestors is
+	AR = max direct score + go_weight * (number of direct terms - 1)
+	and the lowest terms with AR >= threshold are assigned to query
+	@para threshold float, annotation cutoff
+	@para go_weight float, weight of each additional direct term
+	@para ec_weights dict, evidence id as key and weight as value
 	'''
-	pass
+	columns = ['subject', 'identity']
+
+	threshold = attr.ib(default=55)
+	go_weight = attr.ib(default=5)
+	ec_weights = attr.ib(default=attr.Factory(lambda: dict(evidence_weights)))
+
+	def score_terms(self, keys, scores):
+		'''
+		abstraction of direct terms to their ancestors
+		@para keys array, sorted unique query * n + direct term keys
+		@para scores array, direct score of each key
+		@return tuple, sorted unique keys of all candidate terms and AR
+		'''
+		n = self.propagator.n
+		lengths, ancestors = gather_rows(self.propagator.ancestor_ptr,
+			self.propagator.ancestor_idx, keys % n)
+		all_keys = np.concatenate([keys, np.repeat(keys // n, lengths) * n + ancestors])
+		all_scores = np.concatenate([scores, np.repeat(scores, lengths)])
+
+		order, uniq, starts, counts = group_keys(all_keys)
+		best = np.maximum.reduceat(all_scores[order], starts) if len(starts) else all_scores
+		return uniq, best + self.go_weight * (counts - 1)
 
+	def annotate_groups(self, groups, acc_terms, term_index=None):
+		n = self.propagator.n
+		queries, hits, similarity, ptr, terms, evidences = self.encode_hits(groups, acc_terms, 'identity', term_index)
+
+		weights = np.zeros(max(self.ec_weights.keys() + [int(evidences.max()) if len(evidences) else 0]) + 1)
+		for evidence, weight in self.ec_weights.iteritems():
+			weights[evidence] = weight
+
+		#every (hit, term) pair of batch in one array
+		lengths, hit_terms = gather_rows(ptr, terms, hits)
+		_, hit_evidences = gather_rows(ptr, evidences, hits)
+		keys = np.repeat(queries, lengths) * n + hit_terms
+		scores = np.repeat(similarity, lengths) * weights[hit_evidences]
+
+		#direct score is the maximum of the pairs with same query and term
+		order, keys, starts, _ = group_keys(keys)
+		scores = np.maximum.reduceat(scores[order], starts) if len(starts) else scores
+
+		#the lowest terms passed threshold, AR of ancestor is not less than
+		#AR of its descendants, so the passed terms are closed to ancestors
+		keys, rules = self.score_terms(keys, scores)
+		passed = rules >= self.threshold
+		return self.select_lowest(keys[passed], rules[passed], len(groups))
+
+
+@attr.s
+class GotchaAnnotator(ScoringAnnotator):
+	'''
+	Implementation of Gotcha annotation method, each hit scores
+	max(-log10(evalue) - 2, 0) to all GO terms of subject and their
+	ancestors, the R-score of a term is the sum of hit scores, C-score
+	is R-score normalized by the R-score of the root of term, the lowest
+	terms with C-score >= cutoff are assigned to query
+	@para cutoff float, minimum C-score
+	@para max_score float, hit score of zero evalue
+	'''
+	columns = ['subject', 'evalue']
+
+	cutoff = attr.ib(default=0.5)
+	max_score = attr.ib(default=300)
+	roots = attr.ib(init=False)
+
+	def get_relations(self):
+		'''
+		C-score is normalized by the R-score of is_a root, is_a is always
+		propagated so that the root is in the closure of each term
+		@return list, relation types of propagator
+		'''
+		return sorted(set(self.relations or []) | set(['is_a']))
+
+	@roots.default
+	def get_roots(self):
+		'''
+		@return array, root term id of each term by is_a closure
+		'''
+		dag = self.propagator.dag
+		n = self.propagator.n
+		roots = np.arange(n, dtype=np.int32)
+		lengths, ancestors = gather_rows(dag.ancestor_ptr, dag.ancestor_idx, roots)
+		owners = np.repeat(roots, lengths)
+		is_root = np.diff(dag.select_edges(['is_a'])[0])[ancestors] == 0
+		roots[owners[is_root]] = ancestors[is_root]
+		return roots
+
+	def annotate_groups(self, groups, acc_terms, term_index=None):
+		n = self.propagator.n
+		queries, hits, evalues, ptr, terms, _ = self.encode_hits(groups, acc_terms, 'evalue', term_index)
+
+		with np.errstate(divide='ignore'):
+			scores = np.clip(-np.log10(evalues) - 2, 0, self.max_score)
+
+		#the closure of GO terms of each subject, a hit is counted once by
+		#each term even if several annotated terms have the same ancestor
+		ptr, terms = self.propagator.propagate_ids(ptr, terms)
+		lengths, hit_terms = gather_rows(ptr, terms, hits)
+
+		#R-score is the sum of hit scores of each query and term
+		keys = np.repeat(queries, lengths) * n + hit_terms
+		order, keys, starts, _ = group_keys(keys)
+		scores = np.add.reduceat(np.repeat(scores, lengths)[order], starts) if len(starts) else scores
+
+		#C-score normalized by the R-score of root, root is always in the
+		#closure of its descendants
+		root_keys = keys // n * n + self.roots[keys % n]
+		found = np.searchsorted(keys, root_keys)
+		if not np.array_equal(keys[np.minimum(found, len(keys)-1)], root_keys):
+			raise Exception("** root of GO term is not in the closure of query **")
+		root_scores = scores[found]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			cscores = np.where(root_scores > 0, scores / root_scores, 0)
+
+		#C-score of ancestor may be less than its descendant normalized by
+		#another root, so the passed terms are reduced by whole closure
+		passed = (cscores >= self.cutoff) & (scores > 0)
+		return self.select_lowest(keys[passed], cscores[passed], len(groups), closed=False)
+
+
+def iter_batches(items, size):
+	'''
+	group items from iterator to lists with specified size
+	@para items, iterable items
+	@para size int, number of items in each batch
+	@return generator, list of items
+	'''
+	batch = []
+	for item in items:
+		batch.append(item)
+		if len(batch) >= size:
+			yield batch
+			batch = []
 
+	if batch:
+		yield batch
 
 
 class GoAnnotation:
 	'''
 	Assign GO terms to query sequence by subject accession number
 	and output to annotation file
-	@para align_out, diamond output file with tab format
-	@para annotate_out, GO term annotation output file 
+	@para align_out, diamond output file with tab format or iterable lines
+	of alignment tabular output, e.g. streaming from aligner
+	@para annotate_out, GO term annotation output file
+	@para batch_size, number of queries whose subjects are mapped to GO
+	terms by one batch lookup
+	@para cache_size, maximum number of subjects in GO term lookup cache
+	@para cache_policy, cache eviction policy lru or arc
+	@para filters, dict of hit filters for AlignmentParaser like max_hits,
+	max_evalue, min_score, min_identity and score_dropoff
+	@para checkpoint_key, key made from inputs and options, each batch is
+	written to a part file with completion marker, so that rerun with the
+	same key skips completed batches, None to disable checkpoint
+	@para resume, skip the batches completed by previous run
+	@para term_mode, raw for mapped terms, propagated for terms with all
+	ancestors or reduced for the most specific terms
+	@para obo_file, go-basic.obo file used by propagated and reduced mode
+	@para relations, relation types to propagate through, None for is_a
+	@para annotator, Annotator object like Blast2goAnnotator to assign
+	GO terms by scoring, None to output all mapped terms
+	@para workers, number of processes to annotate batches, each process
+	opens its own read only GO database, batches are written in order
+	@para evidence_policy, utils.EvidencePolicy used by GO term lookup,
+	None to keep all evidences
+	@para formats, output formats wide, long, gaf or wego, all formats are
+	made in one pass, see output.AnnotationFormatter
+	@para compression, compress output files by gzip or zstd, None for
+	plain text
+	@para gaf_info, dict of GAF columns like db, taxon and object_type
+
+	The subjects of alignments are interned as integer handles by parser
+	and GO terms are kept as database term ids, they are converted back to
+	strings only when output lines are made. The symbol table of subjects
+	is cleared after each batch, so that handles are the positions of the
+	distinct subjects of batch and the table does not grow with the run
 	'''
 	mapping = None
 
-	def __init__(self, align_out, annotate_out):
+	def __init__(self, align_out, annotate_out, batch_size=1000,
+		cache_size=100000, cache_policy='lru', filters=None,
+		checkpoint_key=None, resume=True, term_mode='raw', obo_file=None,
+		relations=None, annotator=None, workers=1, evidence_policy=None,
+		formats=('wide',), compression=None, gaf_info=None):
 		self.align_out = align_out
 		self.annotate_out = annotate_out
+		self.batch_size = batch_size
+		self.cache_size = cache_size
+		self.cache_policy = cache_policy
+		self.filters = filters or {}
+		self.checkpoint_key = checkpoint_key
+		self.resume = resume
+		self.term_mode = term_mode
+		self.annotator = annotator
+		self.workers = workers
+		self.evidence_policy = evidence_policy or EvidencePolicy()
+		self.columns = annotator.columns if annotator else ['subject']
+		self.subjects = SymbolTable()
+		self.worker_caches = {}
+		self.term_indexes = {}
+		self.compression = compression
+		self.outputs = output_paths(annotate_out, formats, compression)
+
+		if term_mode == 'raw':
+			self.propagator = None
+		elif term_mode in ('propagated', 'reduced'):
+			self.propagator = TermPropagator(load_ontology(obo_file), relations)
+		else:
+			raise Exception("** GO term mode %s is not supported **" % term_mode)
+
+		#GO aspects of gaf format are from the loaded ontology
+		dag = None
+		if 'gaf' in formats:
+			if self.propagator is not None:
+				dag = self.propagator.dag
+			elif annotator is not None:
+				dag = annotator.propagator.dag
+			else:
+				dag = load_ontology(obo_file)
+		self.formatter = AnnotationFormatter(formats, dag, **(gaf_info or {}))
 
-		if self.mapping is None
-			self.mapping = GOTermAssignment()
+		#database connection can not be shared with worker processes
+		if self.mapping is None and self.workers <= 1:
+			self.mapping = GOTermMapper(
+				cache_size = cache_size,
+				cache_policy = cache_policy,
+				evidence_policy = self.evidence_policy,
+				term_ids = True
+			)
 
 		self.annotate()
 
-	def annotate(self):
-		op = open(self.annotate_out, 'w')
-		for alignments in BlastTabularParaser(self.align_out):
-			terms = []
+	def get_term_index(self, dag):
+		'''
+		@para dag, obo.DAG object
+		@return dict, database term id as key and DAG term id as value
+		'''
+		if id(dag) not in self.term_indexes:
+			self.term_indexes[id(dag)] = {tid: dag.index[term]
+				for tid, term in self.mapping.terms.iteritems() if term in dag.index}
+		return self.term_indexes[id(dag)]
+
+	def get_evidences(self, groups, acc_terms, dag=None):
+		'''
+		the best ranked evidence of mapped GO terms of each query, smaller
+		evidence id is selected when ranks are the same
+		@para groups list, alignments of each query
+		@para acc_terms dict, subject as key and (term id, evidence) as value
+		@para dag, obo.DAG object, terms are named by primary GO term id of
+		DAG, None for GO term accession in database
+		@return list, dict of GO term and evidence id of each query
+		'''
+		if dag is None:
+			names = self.mapping.terms
+		else:
+			index = self.get_term_index(dag)
+			names = {tid: dag.ids[i] for tid, i in index.iteritems()}
+
+		evidences = []
+		for alignments in groups:
+			best = {}
 			for alignment in alignments:
-				terms.extend(self.mapping.getGoTerms(alignment.subject))
-			op.write("%s\t%s\n" % (alignment.query, "\t".join(terms)))
-		op.close()
+				for term, evidence in acc_terms[alignment.subject]:
+					if term not in best or (evidence_ranks.get(evidence, 0), -evidence) > \
+						(evidence_ranks.get(best[term], 0), -best[term]):
+						best[term] = evidence
+			evidences.append({names[term]: evidence for term, evidence in best.iteritems() if term in names})
+		return evidences
+
+	def format_batch(self, groups):
+		'''
+		map subjects of a batch of queries to GO terms, the symbol table of
+		subjects is cleared when the batch is formatted
+		@para groups list, alignments of each query, subjects are handles
+		@return dict, output format as key and output lines of batch as value
+		'''
+		#the table only has the subjects of batch
+		names = self.subjects.names
+		found = self.mapping.get_go_terms_for_many(names)
+		acc_terms = {subject: found[name] for subject, name in enumerate(names)}
+		self.subjects.clear()
+
+		#annotator outputs GO term accessions, otherwise terms are term ids
+		index = None
+		scores = None
+		if self.annotator is not None:
+			dag = self.annotator.propagator.dag
+			annotated = self.annotator.annotate_groups(groups, acc_terms, self.get_term_index(dag))
+			term_sets = [[term for term, score in terms] for terms in annotated]
+			if self.formatter.detailed:
+				scores = [dict(terms) for terms in annotated]
+		else:
+			dag = self.propagator.dag if self.propagator is not None else None
+			term_sets = []
+			for alignments in groups:
+				terms = []
+				seen = set()
+				for alignment in alignments:
+					for term, evidence in acc_terms[alignment.subject]:
+						if term not in seen:
+							seen.add(term)
+							terms.append(term)
+				term_sets.append(terms)
+
+			if self.propagator is not None:
+				index = self.get_term_index(self.propagator.dag)
+			else:
+				names = self.mapping.terms
+				term_sets = [[names[term] for term in terms] for terms in term_sets]
+
+		#all queries of batch are propagated or reduced together
+		if self.term_mode == 'propagated':
+			term_sets = self.propagator.propagate(term_sets, index)
+		elif self.term_mode == 'reduced':
+			term_sets = self.propagator.reduce(term_sets, index)
+
+		evidences = None
+		if self.formatter.detailed:
+			evidences = self.get_evidences(groups, acc_terms, dag)
+
+		return self.formatter.format([(alignments[0].query, terms,
+			evidences and evidences[i], scores and scores[i])
+			for i, (alignments, terms) in enumerate(zip(groups, term_sets))])
+
+	def iter_formatted(self, batches):
+		'''
+		format batches in this process or in worker processes
+		@para batches, iterable batches of query alignments
+		@return generator, output lines of each format of each batch in
+		input order
+		'''
+		if self.workers <= 1:
+			for groups in batches:
+				yield self.format_batch(groups)
+			return
+
+		#records are sent to workers as tuples, the latest cache counters
+		#of each worker are kept to report cache statistics of all workers
+		packed = ([[tuple(alignment) for alignment in alignments] for alignments in groups] for groups in batches)
+		results = parallel_map(format_packed_batch, packed, self.workers, self.workers*4,
+			init_annotation_worker, (self,))
+		for formatted, pid, counters in results:
+			self.worker_caches[pid] = counters
+			yield formatted
+
+	def annotate(self):
+		if self.checkpoint_key is not None:
+			outdir = os.path.dirname(os.path.abspath(self.annotate_out))
+			checkpoint = Checkpoint(outdir, self.checkpoint_key)
+			name = os.path.basename(self.annotate_out)
+
+			if self.resume and checkpoint.is_done(name) and all(os.path.isfile(path)
+				for path in self.outputs.values()):
+				return
 
+		opened = isinstance(self.align_out, basestring)
+		if opened:
+			fh = open(self.align_out)
+		else:
+			fh = iter(self.align_out)
 
-		
\ No newline at end of file
+		#subjects are interned by worker processes for parallel annotation
+		symbols = self.subjects if self.workers <= 1 else None
+		parser = AlignmentParaser(fh, columns=self.columns, symbols=symbols, **self.filters)
+		batches = iter_batches(parser, self.batch_size)
+
+		if self.checkpoint_key is None:
+			with self.open_outputs() as writers:
+				for formatted in self.iter_formatted(batches):
+					for fmt, lines in formatted.iteritems():
+						writers[fmt].write(lines)
+		else:
+			self.annotate_checkpointed(batches)
+			checkpoint.mark_done(name)
+
+		if opened:
+			fh.close()
+
+		if self.mapping is not None:
+			print self.mapping.cache_stats()
+		elif self.worker_caches:
+			print merge_cache_stats(self.worker_caches.values())
+
+	@contextlib.contextmanager
+	def open_outputs(self):
+		'''
+		open buffered writers of all output formats with format headers
+		@return dict, output format as key and output.OutputWriter as value
+		'''
+		with open_writers(self.outputs, self.compression) as writers:
+			for fmt, writer in writers.iteritems():
+				writer.write(self.formatter.header(fmt))
+			yield writers
+
+	def annotate_checkpointed(self, batches):
+		'''
+		write each batch to part files of all formats atomically and mark it
+		completed, the completed part is skipped, then merge parts to output
+		files, the part files are plain text and compressed when merged
+		@para batches, iterable batches of query alignments
+		'''
+		part_dir = "%s.parts" % self.annotate_out
+		if not os.path.isdir(part_dir):
+			os.makedirs(part_dir)
+
+		#the queries of each part are changed with batch size
+		checkpoint = Checkpoint(part_dir, checkpoint_key(self.checkpoint_key,
+			self.batch_size, sorted(self.outputs)))
+		parts = []
+		todo = collections.deque()
+
+		def part_file(name, fmt):
+			return os.path.join(part_dir, "%s.%s" % (name, fmt))
+
+		def pending_batches():
+			for i, groups in enumerate(batches):
+				name = "part_%06d" % i
+				parts.append(name)
+
+				#subjects of skipped batch are interned by parser and must
+				#not be looked up with the next batch
+				if self.resume and checkpoint.is_done(name) and all(os.path.isfile(part_file(name, fmt))
+					for fmt in self.outputs):
+					self.subjects.clear()
+					continue
+
+				todo.append(name)
+				yield groups
+
+		#formatted batches are returned in the same order with todo parts
+		for formatted in self.iter_formatted(pending_batches()):
+			name = todo.popleft()
+			for fmt, lines in formatted.iteritems():
+				with atomic_open(part_file(name, fmt)) as op:
+					op.write(lines)
+			checkpoint.mark_done(name)
+
+		#all output files are merged and compressed at the same time
+		with self.open_outputs() as writers:
+			for name in parts:
+				for fmt, writer in writers.iteritems():
+					with open(part_file(name, fmt)) as fh:
+						for block in iter(lambda: fh.read(writer.buffer_size), ''):
+							writer.write(block)
+
+		shutil.rmtree(part_dir)
+
+
+#GoAnnotation object of annotation worker process
+worker_annotation = None
+
+def init_annotation_worker(annotation):
+	'''
+	initialize annotation worker process, the GoAnnotation object is
+	inherited from parent process and the worker opens its own read only
+	GO database or GO index
+	@para annotation, GoAnnotation object
+	'''
+	global worker_annotation
+	annotation.mapping = GOTermMapper(
+		cache_size = annotation.cache_size,
+		cache_policy = annotation.cache_policy,
+		readonly = True,
+		evidence_policy = annotation.evidence_policy,
+		term_ids = True
+	)
+	annotation.record = collections.namedtuple('AnnotationRecord', ['query'] + annotation.columns)
+	worker_annotation = annotation
+
+def format_packed_batch(groups):
+	'''
+	format a batch of query alignments in worker process, subjects are
+	interned in the symbol table of worker
+	@para groups list, alignments of each query as tuples
+	@return tuple, output lines of each format of batch, process id and
+	lookup cache counters of worker
+	'''
+	record = worker_annotation.record._make
+	get_id = worker_annotation.subjects.get_id
+	formatted = worker_annotation.format_batch([[record((a[0], get_id(a[1])) + a[2:]) for a in alignments]
+		for alignments in groups])
+	return formatted, os.getpid(), worker_annotation.mapping.cache_counters()
@@ -0,0 +1,700 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import collections
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+try:
+	import apsw
+except ImportError:
+	apsw = None
+
+import config
+import makedb
+from obo import DAG, OBOParser, load_ontology
+from alignment import AlignmentParaser
+from annotation import GoAnnotation, Blast2goAnnotator, GotchaAnnotator
+from makedb import table_sql, meta_sql, index_sql
+from mapping import GOTermMapper
+from goarrow import export_go_tables, column_values
+from utils import SymbolTable, evidence_codes, evidence_ranks
+
+Hit = collections.namedtuple('Hit', ['query', 'subject', 'identity', 'evalue'])
+
+def get_parent(rand, i):
+	k = i // 3
+	return rand.randint(max(0, k // 4 - 5), k // 4) * 3 + i % 3
+
+def make_obo(obo_file, terms=40000, seed=1):
+	'''
+	write a synthetic ontology like go-basic.obo, each term has one to
+	three is_a parents and some part_of relationships in the same namespace
+	@para obo_file str, output obo file
+	@para terms int, number of terms
+	@para seed int, random seed
+	'''
+	rand = random.Random(seed)
+	namespaces = ['biological_process', 'molecular_function', 'cellular_component']
+	with open(obo_file, 'w') as fh:
+		fh.write("format-version: 1.2\n\n")
+		for i in xrange(terms):
+			fh.write("[Term]\nid: GO:%07d\nname: term %d\nnamespace: %s\n" % (i, i, namespaces[i % 3]))
+			if i >= 3:
+				#parents are in the same namespace with smaller id, the
+				#ontology grows about four times each level like GO
+				for _ in xrange(rand.randint(1, 3)):
+					parent = get_parent(rand, i)
+					fh.write("is_a: GO:%07d ! term %d\n" % (parent, parent))
+
+				if rand.random() < 0.2:
+					parent = get_parent(rand, i)
+					fh.write("relationship: part_of GO:%07d ! term %d\n" % (parent, parent))
+			fh.write("\n")
+		fh.write("[Typedef]\nid: part_of\nname: part of\n")
+
+def make_hits(terms, queries=10000, subjects=50000, hits=10, annotations=5, seed=1):
+	'''
+	make synthetic alignment groups and GO terms of subjects
+	@para terms list, GO term ids
+	@para queries int, number of queries
+	@para subjects int, number of subjects
+	@para hits int, maximum number of hits of each query
+	@para annotations int, maximum number of GO terms of each subject
+	@return tuple, alignments of each query and GO terms of subjects
+	'''
+	rand = random.Random(seed)
+	acc_terms = {}
+	for i in xrange(subjects):
+		acc_terms["S%d" % i] = [(rand.choice(terms), rand.randint(1, 22))
+			for _ in xrange(rand.randint(0, annotations))]
+
+	groups = []
+	for q in xrange(queries):
+		groups.append([Hit("Q%d" % q, "S%d" % rand.randrange(subjects),
+			rand.uniform(30, 100), 10 ** -rand.uniform(0, 100))
+			for _ in xrange(rand.randint(1, hits))])
+
+	return groups, acc_terms
+
+def bench_annotators(args):
+	obo_file = os.path.join(args.outdir, 'bench.obo')
+	make_obo(obo_file, args.terms)
+
+	annotators = dict(
+		blast2go = Blast2goAnnotator(go_mapper=None, obo_file=obo_file),
+		gotcha = GotchaAnnotator(go_mapper=None, obo_file=obo_file)
+	)
+	groups, acc_terms = make_hits(annotators['gotcha'].propagator.dag.ids,
+		args.queries, args.subjects, args.hits)
+	num_hits = sum(len(alignments) for alignments in groups)
+
+	print "method\tqueries\thits\tseconds\thits/s\tterms"
+	for method in args.methods:
+		annotator = annotators[method]
+		assigned = 0
+		start = time.time()
+		for i in xrange(0, len(groups), args.batch_size):
+			batch = groups[i:i+args.batch_size]
+
+			#GO terms of subjects in batch like GoAnnotation
+			subjects = set(hit.subject for hits in batch for hit in hits)
+			batch_terms = {subject: acc_terms[subject] for subject in subjects}
+			for terms in annotator.annotate_groups(batch, batch_terms):
+				assigned += len(terms)
+		elapsed = time.time() - start
+		print "%s\t%s\t%s\t%.2f\t%.0f\t%s" % (method, len(groups), num_hits,
+			elapsed, num_hits / elapsed, assigned)
+
+def make_go_db(db_file, terms=40000, products=200000, annotations=8, seed=1):
+	'''
+	write a synthetic GO association database like makedb, each gene product
+	has an uniprot like dbxref key and some of them have NCBI accessions
+	@para db_file str, output sqlite database
+	@para terms int, number of GO terms
+	@para products int, number of gene products
+	@para annotations int, maximum number of associations of each product
+	@para seed int, random seed
+	@return list, accessions that can be searched
+	'''
+	rand = random.Random(seed)
+	conn = sqlite3.connect(db_file)
+	conn.executescript(table_sql)
+	conn.executemany("INSERT INTO term VALUES (?,?)", [(i, "GO:%07d" % i) for i in xrange(terms)])
+	conn.executemany("INSERT INTO dbxref VALUES (?,?)", [(i, "P%07d" % i) for i in xrange(products)])
+	conn.executemany("INSERT INTO gene_product VALUES (?,?)", [(i, i) for i in xrange(products)])
+
+	evidences = sorted(evidence_ranks)
+	rows = []
+	for i in xrange(products):
+		for _ in xrange(rand.randint(0, annotations)):
+			evidence = rand.choice(evidences)
+			rows.append((len(rows), rand.randrange(terms), i, evidence, evidence_ranks[evidence]))
+	conn.executemany("INSERT INTO association VALUES (?,?,?,?,?)", rows)
+
+	accs = ["XP_%07d" % i for i in xrange(0, products, 2)]
+	conn.executemany("INSERT INTO acc2uniprot VALUES (?,?)", [(acc, "P%s" % acc[3:]) for acc in accs])
+	for name, sql in index_sql:
+		conn.execute(sql)
+	conn.commit()
+	conn.close()
+
+	return ["P%07d" % i for i in xrange(products)] + accs
+
+def bench_mappers(args):
+	db_file = os.path.join(args.outdir, 'bench_go.db')
+	for path in [db_file] + [os.path.join(args.outdir, 'bench_go.%s' % b) for b in ('parquet', 'arrow')]:
+		if os.path.isdir(path):
+			shutil.rmtree(path)
+		elif os.path.exists(path):
+			os.remove(path)
+
+	accs = make_go_db(db_file, args.terms, args.products)
+	for backend in args.backends:
+		if backend != 'sqlite':
+			export_go_tables(db_file, os.path.join(args.outdir, 'bench_go.%s' % backend), backend)
+
+	rand = random.Random(1)
+	queries = [rand.choice(accs) for _ in xrange(args.queries)] + ['Q%d' % i for i in xrange(args.queries // 10)]
+	rand.shuffle(queries)
+
+	print "backend\taccessions\tload_s\tlookup_s\taccessions/s\tterms\tterm_freq_s"
+	for backend in args.backends:
+		start = time.time()
+		dbfile = db_file if backend == 'sqlite' else os.path.join(args.outdir, 'bench_go.%s' % backend)
+		mapper = GOTermMapper(cache_size=0, dbfile=dbfile)
+		loaded = time.time() - start
+
+		#batch lookups like GoAnnotation
+		found = 0
+		start = time.time()
+		for i in xrange(0, len(queries), args.batch_size):
+			for terms in mapper.get_go_terms_for_many(queries[i:i+args.batch_size]).itervalues():
+				found += len(terms)
+		elapsed = time.time() - start
+
+		#term frequencies of all associations
+		start = time.time()
+		if backend == 'sqlite':
+			freqs = dict(mapper.db.iter("SELECT term_id, COUNT(*) FROM association GROUP BY term_id"))
+		else:
+			freqs = np.bincount(column_values(mapper.arrow.tables['association'], 'term_id'))
+		counted = time.time() - start
+
+		print "%s\t%s\t%.2f\t%.2f\t%.0f\t%s\t%.3f" % (backend, len(queries), loaded,
+			elapsed, len(queries) / elapsed, found, counted)
+
+#synthetic data size of benchmark suite
+scales = dict(
+	small = dict(terms=5000, products=20000, annotations=8, queries=2000, hits=10),
+	medium = dict(terms=40000, products=200000, annotations=8, queries=20000, hits=10),
+	large = dict(terms=47000, products=2000000, annotations=8, queries=200000, hits=25)
+)
+
+def write_inserts(fp, table, rows, size=1000):
+	'''
+	write rows as multiple values INSERT INTO statements like mysqldump
+	@para fp, output file handler
+	@para table str, table name
+	@para rows list, formatted values of each row
+	@para size int, number of rows of each statement
+	'''
+	for i in xrange(0, len(rows), size):
+		fp.write("INSERT INTO `%s` VALUES %s;\n" % (table, ",".join(rows[i:i+size])))
+
+def make_go_dump(dump_file, terms=40000, products=200000, annotations=8, seed=1):
+	'''
+	write a synthetic GO association mysql dump like go_monthly-assocdb-data,
+	tables are in the same column layout that makedb reads, term names have
+	commas and escaped quotes to exercise the values parser
+	@para dump_file str, output gzip file
+	@para terms int, number of GO terms
+	@para products int, number of gene products
+	@para annotations int, maximum number of associations of each product
+	@para seed int, random seed
+	@return int, number of associations
+	'''
+	rand = random.Random(seed)
+	codes = [code for code, eid, rank in evidence_codes]
+	namespaces = ['biological_process', 'molecular_function', 'cellular_component']
+
+	associations = []
+	for i in xrange(products):
+		for _ in xrange(rand.randint(0, annotations)):
+			associations.append((len(associations), rand.randrange(terms), i))
+
+	fp = gzip.open(dump_file, 'wb')
+	fp.write("-- synthetic GO association database dump\n")
+
+	#tables are dumped in name order, association is ahead of evidence
+	write_inserts(fp, 'association', ["(%d,%d,%d,0,NULL,20200101,1)" % row for row in associations])
+	write_inserts(fp, 'dbxref', ["(%d,'UniProtKB','P%07d','')" % (i, i) for i in xrange(products)])
+	write_inserts(fp, 'evidence', ["(%d,'%s',%d,0,'')" % (aid, rand.choice(codes), aid)
+		for aid, term, product in associations])
+	write_inserts(fp, 'gene_product', ["(%d,'G%d',%d,1)" % (i, i, i) for i in xrange(products)])
+	write_inserts(fp, 'term', ["(%d,'term %d, \\'synthetic\\'','%s','GO:%07d',0,0)" % (
+		i, i, namespaces[i % 3], i) for i in xrange(terms)])
+	fp.close()
+
+	return len(associations)
+
+def make_idmapping(idmapping_file, products=200000, seed=1):
+	'''
+	write a synthetic uniprot idmapping.dat file, half of products have
+	RefSeq accessions and some lines have the id types makedb ignores
+	@para idmapping_file str, output gzip file
+	@para products int, number of uniprot products
+	@para seed int, random seed
+	'''
+	rand = random.Random(seed)
+	fp = gzip.open(idmapping_file, 'wb')
+	for i in xrange(products):
+		uniprot = "P%07d" % i
+		fp.write("%s\tUniProtKB-ID\tPROT%d_SYNTH\n" % (uniprot, i))
+		if i % 2 == 0:
+			fp.write("%s\tRefSeq\tXP_%07d\n" % (uniprot, i))
+		if rand.random() < 0.3:
+			fp.write("%s\tGI\t%d\n" % (uniprot, i))
+			fp.write("%s\tEMBL-CDS\tCAA%07d\n" % (uniprot, i))
+	fp.close()
+
+def make_pir_idmapping(pir_file, products=200000, seed=1):
+	'''
+	write a synthetic PIR idmapping.tb file with 22 columns, the RefSeq
+	accessions of half of products are also in uniprot idmapping file and
+	the GeneID of two neighbouring products is the same, the last column
+	is not empty, otherwise the trailing tabs are stripped by makedb and
+	the line is skipped
+	@para pir_file str, output gzip file
+	@para products int, number of uniprot products
+	@para seed int, random seed
+	'''
+	rand = random.Random(seed)
+	fp = gzip.open(pir_file, 'wb')
+	for i in xrange(products):
+		cols = [''] * 22
+		cols[0] = "P%07d" % i
+		cols[1] = "PROT%d_SYNTH" % i
+		cols[2] = "%d" % (i // 2 + 1)
+		cols[3] = "NP_%07d" % i
+		if i % 2 == 0:
+			cols[3] = "XP_%07d" % i
+		if rand.random() < 0.5:
+			cols[16] = "ENSP%011d" % i
+		cols[21] = "%d" % (20000000 + i)
+		fp.write("%s\n" % "\t".join(cols))
+	fp.close()
+
+def make_diamond_output(out_file, queries=20000, products=200000, hits=10, seed=1):
+	'''
+	write a synthetic DIAMOND tabular output, hits of each query are sorted
+	by bit score, subjects are uniprot, RefSeq and unknown accessions
+	@para out_file str, output file
+	@para queries int, number of queries
+	@para products int, number of uniprot products
+	@para hits int, maximum number of hits of each query
+	@para seed int, random seed
+	'''
+	rand = random.Random(seed)
+	with open(out_file, 'w') as fh:
+		for q in xrange(queries):
+			scores = sorted((rand.uniform(30, 800) for _ in xrange(rand.randint(1, hits))), reverse=True)
+			for score in scores:
+				p = rand.randrange(products)
+				subject = rand.choice(["P%07d" % p, "XP_%07d" % (p - p % 2), "UNK%d" % p])
+				length = rand.randint(50, 500)
+				fh.write("Q%d\t%s\t%.1f\t%d\t%d\t%d\t1\t%d\t1\t%d\t%.2e\t%.1f\n" % (q, subject,
+					rand.uniform(30, 100), length, rand.randint(0, length // 3), rand.randint(0, 5),
+					length, length, 10 ** -(score / 10), score))
+
+def timed(results, name, func, repeat=1):
+	'''
+	run benchmark and record the best elapsed time of repeats
+	@para results list, result of each benchmark
+	@para name str, benchmark name
+	@para func, function returns number of processed items, other values
+	are not recorded
+	@para repeat int, number of runs
+	'''
+	best = None
+	for _ in xrange(repeat):
+		start = time.time()
+		items = func()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+
+	result = collections.OrderedDict([('name', name), ('seconds', round(best, 4))])
+	if isinstance(items, (int, long)):
+		result['items'] = items
+		result['items_per_second'] = round(items / best, 1) if best > 0 else None
+	results.append(result)
+	print "%s\t%.3f\t%s" % (name, best, result.get('items', ''))
+
+def count_lookups(func, accs, batch_size=None):
+	'''
+	@para func, single or batch GO term lookup function
+	@para accs list, accessions to be searched
+	@para batch_size int, accessions of each batch lookup, None for single
+	@return int, number of searched accessions
+	'''
+	if batch_size is None:
+		for acc in accs:
+			func(acc)
+	else:
+		for i in xrange(0, len(accs), batch_size):
+			func(accs[i:i+batch_size])
+	return len(accs)
+
+def count_records(alignment_file, **kwargs):
+	'''
+	@para alignment_file str, alignment tabular file
+	@para kwargs, AlignmentParaser options
+	@return int, number of parsed records
+	'''
+	records = 0
+	with open(alignment_file) as fh:
+		for alignments in AlignmentParaser(fh, **kwargs):
+			records += len(alignments)
+	return records
+
+def parse_obo(obo_file):
+	'''
+	@para obo_file str, obo file
+	@return DAG object that is not built
+	'''
+	dag = DAG()
+	for term in OBOParser(obo_file):
+		dag.add_term(term)
+	return dag
+
+def bench_makedb(results, files, db_file, jobs=1, batch_size=100000):
+	'''
+	time each step of makedb full build in the same order
+	@para results list, result of each benchmark
+	@para files dict, synthetic input files
+	@para db_file str, GO association database to be made
+	@para jobs int, number of parsing processes
+	@para batch_size int, rows of each executemany
+	'''
+	conn = apsw.Connection(db_file)
+	cur = conn.cursor()
+	makedb.optimize_database(cur, 'bulk', threads=jobs)
+	cur.execute("BEGIN;")
+	cur.execute(table_sql)
+	cur.execute(meta_sql)
+
+	steps = [
+		('load_go_associations', lambda: makedb.load_go_associations(conn, files['go'], jobs, batch_size)),
+		('load_uniprot_idmapping', lambda: makedb.load_uniprot_idmapping(cur, files['idmapping'])),
+		('bulk_merge_pir_idmapping', lambda: makedb.bulk_merge_pir_idmapping(cur, files['pir'], batch_size)),
+		('build_indexes', lambda: makedb.build_indexes(cur)),
+		('save_row_hashes', lambda: makedb.save_row_hashes(conn, cur))
+	]
+	for name, func in steps:
+		timed(results, "makedb.%s" % name, func)
+
+	cur.execute("COMMIT;")
+	cur.close()
+	conn.close()
+
+def bench_acc2go(results, db_file):
+	'''
+	time the optional acc2go table of makedb
+	'''
+	conn = apsw.Connection(db_file)
+	cur = conn.cursor()
+	makedb.optimize_database(cur, 'bulk')
+	cur.execute("BEGIN;")
+	timed(results, "makedb.build_acc2go", lambda: makedb.build_acc2go(cur))
+	cur.execute("COMMIT;")
+	cur.close()
+	conn.close()
+
+def bench_lookups(results, name, db_file, accs, batch_size, repeat=1):
+	'''
+	time single and batch GO term lookups without cache
+	'''
+	mapper = GOTermMapper(cache_size=0, dbfile=db_file)
+	timed(results, "mapper.%s.single" % name,
+		lambda: count_lookups(mapper.get_go_terms_by_acc, accs), repeat)
+	timed(results, "mapper.%s.batch" % name,
+		lambda: count_lookups(mapper.get_go_terms_for_many, accs, batch_size), repeat)
+
+def bench_suite(args):
+	'''
+	generate synthetic inputs of selected scale, time the hot paths from
+	database making to end to end annotation and write results to json
+	'''
+	if apsw is None:
+		raise Exception("** apsw is required for benchmarking makedb **")
+
+	if not os.path.isdir(args.outdir):
+		os.makedirs(args.outdir)
+
+	scale = scales[args.scale]
+	files = dict(
+		go = os.path.join(args.outdir, 'go_assocdb.sql.gz'),
+		idmapping = os.path.join(args.outdir, 'idmapping.dat.gz'),
+		pir = os.path.join(args.outdir, 'idmapping.tb.gz'),
+		obo = os.path.join(args.outdir, 'go-basic.obo'),
+		alignment = os.path.join(args.outdir, 'diamond.out'),
+		db = os.path.join(args.outdir, 'go.db')
+	)
+	for path in [files['db'], "%s.cache" % files['obo']]:
+		if os.path.exists(path):
+			os.remove(path)
+
+	start = time.time()
+	associations = make_go_dump(files['go'], scale['terms'], scale['products'],
+		scale['annotations'], args.seed)
+	make_idmapping(files['idmapping'], scale['products'], args.seed)
+	make_pir_idmapping(files['pir'], scale['products'], args.seed)
+	make_obo(files['obo'], scale['terms'], args.seed)
+	make_diamond_output(files['alignment'], scale['queries'], scale['products'],
+		scale['hits'], args.seed)
+	generated = time.time() - start
+
+	results = []
+	print "benchmark\tseconds\titems"
+
+	#sql values parser of makedb
+	values = [line.partition('` VALUES ')[2] for line in makedb.iter_insert_lines(files['go'])]
+	timed(results, "makedb.parse_values",
+		lambda: sum(len(makedb.parse_values(vals)) for vals in values), args.repeat)
+
+	bench_makedb(results, files, files['db'], args.jobs)
+
+	#subjects of alignments are searched like annotation
+	rand = random.Random(args.seed)
+	with open(files['alignment']) as fh:
+		subjects = list(set(line.split('\t', 2)[1] for line in fh))
+	accs = [rand.choice(subjects) for _ in xrange(min(args.lookups, len(subjects) * 2))]
+
+	bench_lookups(results, 'xref', files['db'], accs, args.batch_size, args.repeat)
+	bench_acc2go(results, files['db'])
+	bench_lookups(results, 'acc2go', files['db'], accs, args.batch_size, args.repeat)
+
+	timed(results, "alignment.parser",
+		lambda: count_records(files['alignment']), args.repeat)
+	timed(results, "alignment.parser.subject",
+		lambda: count_records(files['alignment'], columns=['subject'], symbols=SymbolTable()), args.repeat)
+
+	#ontology parsing, DAG layers and binary cache
+	timed(results, "obo.parse", lambda: len(parse_obo(files['obo'])), args.repeat)
+	dag = parse_obo(files['obo'])
+	timed(results, "obo.build", lambda: dag.build() or len(dag), args.repeat)
+	timed(results, "obo.calc_layers", lambda: dag.calc_layers() or len(dag), args.repeat)
+	dag.save("%s.cache" % files['obo'], files['obo'])
+	timed(results, "obo.load_cache", lambda: len(load_ontology(files['obo'])), args.repeat)
+
+	#end to end annotation from alignment file to output file
+	config.GO_DB = files['db']
+	for method in args.methods:
+		annotator = None
+		if method == 'blast2go':
+			annotator = Blast2goAnnotator(go_mapper=None, obo_file=files['obo'])
+		elif method == 'gotcha':
+			annotator = GotchaAnnotator(go_mapper=None, obo_file=files['obo'])
+
+		out_file = os.path.join(args.outdir, "annotation.%s.txt" % method)
+		timed(results, "annotation.%s" % method, lambda: GoAnnotation(files['alignment'], out_file,
+			term_mode='propagated' if method == 'propagated' else 'raw', obo_file=files['obo'],
+			annotator=annotator, workers=args.workers) and scale['queries'])
+
+	report = collections.OrderedDict([
+		('benchmark', 'topaz'),
+		('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+		('python', sys.version.split()[0]),
+		('platform', platform.platform()),
+		('scale', args.scale),
+		('params', collections.OrderedDict(sorted(scale.items()))),
+		('associations', associations),
+		('seed', args.seed),
+		('repeat', args.repeat),
+		('jobs', args.jobs),
+		('workers', args.workers),
+		('generate_seconds', round(generated, 2)),
+		('results', results)
+	])
+
+	json_file = args.json or os.path.join(args.outdir, 'benchmark.json')
+	with open(json_file, 'w') as fh:
+		json.dump(report, fh, indent=2)
+	print "results are written to %s" % json_file
+
+def command_arguments():
+	parser = argparse.ArgumentParser(
+		prog = 'benchmark',
+		description = 'Benchmark topaz components with synthetic data'
+	)
+	subparsers = parser.add_subparsers(help="sub-command help")
+
+	annotator_parser = subparsers.add_parser('annotators',
+		help = "Compare throughput of GO annotation methods"
+	)
+	annotator_parser.set_defaults(func=bench_annotators)
+	annotator_parser.add_argument('-o', '--outdir',
+		help = 'directory for synthetic files (default: current directory)',
+		default = '.',
+		metavar = 'outdir'
+	)
+	annotator_parser.add_argument('-m', '--methods',
+		help = 'annotation methods to be compared (default: blast2go gotcha)',
+		nargs = '+',
+		choices = ['blast2go', 'gotcha'],
+		default = ['blast2go', 'gotcha'],
+		metavar = 'method'
+	)
+	annotator_parser.add_argument('--terms',
+		help = 'number of synthetic GO terms (default: 40000)',
+		type = int,
+		default = 40000,
+		metavar = 'terms'
+	)
+	annotator_parser.add_argument('--queries',
+		help = 'number of synthetic queries (default: 10000)',
+		type = int,
+		default = 10000,
+		metavar = 'queries'
+	)
+	annotator_parser.add_argument('--subjects',
+		help = 'number of synthetic subjects (default: 50000)',
+		type = int,
+		default = 50000,
+		metavar = 'subjects'
+	)
+	annotator_parser.add_argument('--hits',
+		help = 'maximum number of hits of each query (default: 10)',
+		type = int,
+		default = 10,
+		metavar = 'hits'
+	)
+	annotator_parser.add_argument('--batch-size',
+		help = 'number of queries annotated in each batch (default: 1000)',
+		type = int,
+		default = 1000,
+		metavar = 'size'
+	)
+
+	mapper_parser = subparsers.add_parser('mappers',
+		help = "Compare GO term lookup of sqlite and columnar backends"
+	)
+	mapper_parser.set_defaults(func=bench_mappers)
+	mapper_parser.add_argument('-o', '--outdir',
+		help = 'directory for synthetic database and tables (default: current directory)',
+		default = '.',
+		metavar = 'outdir'
+	)
+	mapper_parser.add_argument('-b', '--backends',
+		help = 'GO term lookup backends to be compared (default: sqlite parquet arrow)',
+		nargs = '+',
+		choices = ['sqlite', 'parquet', 'arrow'],
+		default = ['sqlite', 'parquet', 'arrow'],
+		metavar = 'backend'
+	)
+	mapper_parser.add_argument('--terms',
+		help = 'number of synthetic GO terms (default: 40000)',
+		type = int,
+		default = 40000,
+		metavar = 'terms'
+	)
+	mapper_parser.add_argument('--products',
+		help = 'number of synthetic gene products (default: 200000)',
+		type = int,
+		default = 200000,
+		metavar = 'products'
+	)
+	mapper_parser.add_argument('--queries',
+		help = 'number of accessions to be searched (default: 100000)',
+		type = int,
+		default = 100000,
+		metavar = 'queries'
+	)
+	mapper_parser.add_argument('--batch-size',
+		help = 'number of accessions searched in each batch (default: 1000)',
+		type = int,
+		default = 1000,
+		metavar = 'size'
+	)
+
+	suite_parser = subparsers.add_parser('suite',
+		help = "Time hot paths from makedb to annotation and write results as json"
+	)
+	suite_parser.set_defaults(func=bench_suite)
+	suite_parser.add_argument('-o', '--outdir',
+		help = 'directory for synthetic files and database (default: current directory)',
+		default = '.',
+		metavar = 'outdir'
+	)
+	suite_parser.add_argument('-s', '--scale',
+		help = 'size of synthetic data, small, medium or large (default: small)',
+		choices = ['small', 'medium', 'large'],
+		default = 'small',
+		metavar = 'scale'
+	)
+	suite_parser.add_argument('--json',
+		help = 'json result file (default: benchmark.json in outdir)',
+		metavar = 'json'
+	)
+	suite_parser.add_argument('--seed',
+		help = 'random seed of synthetic data (default: 1)',
+		type = int,
+		default = 1,
+		metavar = 'seed'
+	)
+	suite_parser.add_argument('--repeat',
+		help = 'number of runs of each micro benchmark, the best time is recorded (default: 3)',
+		type = int,
+		default = 3,
+		metavar = 'repeat'
+	)
+	suite_parser.add_argument('-j', '--jobs',
+		help = 'number of parsing processes of makedb (default: 1)',
+		type = int,
+		default = 1,
+		metavar = 'jobs'
+	)
+	suite_parser.add_argument('--workers',
+		help = 'number of annotation worker processes (default: 1)',
+		type = int,
+		default = 1,
+		metavar = 'workers'
+	)
+	suite_parser.add_argument('--lookups',
+		help = 'number of accessions searched by GO term mapper (default: 20000)',
+		type = int,
+		default = 20000,
+		metavar = 'lookups'
+	)
+	suite_parser.add_argument('--batch-size',
+		help = 'number of accessions searched in each batch lookup (default: 1000)',
+		type = int,
+		default = 1000,
+		metavar = 'size'
+	)
+	suite_parser.add_argument('-m', '--methods',
+		help = 'end to end annotation methods, raw, propagated, blast2go or gotcha (default: all)',
+		nargs = '+',
+		choices = ['raw', 'propagated', 'blast2go', 'gotcha'],
+		default = ['raw', 'propagated', 'blast2go', 'gotcha'],
+		metavar = 'method'
+	)
+
+	return parser.parse_args()
+
+if __name__ == '__main__':
+	options = command_arguments()
+	options.func(options)
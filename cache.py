@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+
+def format_stats(name, size, cached, hits, misses, evictions):
+	'''
+	@para name str, cache name
+	@para size, cached, hits, misses, evictions int, cache counters
+	@return str, report of cache statistics
+	'''
+	total = hits + misses
+	rate = hits * 100.0 / total if total else 0
+	return "%s size=%s cached=%s hits=%s misses=%s evictions=%s hit_rate=%.2f%%" % (
+		name, size, cached, hits, misses, evictions, rate)
+
+def merge_counters(counters):
+	'''
+	sum the counters of caches in worker processes
+	@para counters list, Cache.counters of each cache
+	@return tuple, summed counters like Cache.counters
+	'''
+	return tuple(sum(values) for values in zip(*counters))
+
+
+class Cache(object):
+	'''
+	Bounded in-process cache with hit, miss and eviction statistics,
+	None or empty values are stored as well for negative caching
+	@para size int, maximum number of cached keys
+	'''
+	def __init__(self, size):
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__(self):
+		return 0
+
+	def lookup(self, key):
+		'''
+		lookup key in cache and count hit or miss
+		@para key, cached key
+		@return tuple, (True, value) when hit or (False, None) when miss
+		'''
+		found, value = self.get(key)
+		if found:
+			self.hits += 1
+		else:
+			self.misses += 1
+		return found, value
+
+	def get(self, key):
+		return False, None
+
+	def store(self, key, value):
+		pass
+
+	def counters(self):
+		'''
+		@return tuple, size, number of cached keys, hits, misses and evictions
+		'''
+		return (self.size, len(self), self.hits, self.misses, self.evictions)
+
+	def stats(self):
+		'''
+		@return str, report of cache statistics
+		'''
+		return format_stats(self.__class__.__name__, *self.counters())
+
+
+class LRUCache(Cache):
+	'''
+	Least recently used eviction policy
+	@para size int, maximum number of cached keys
+	'''
+	def __init__(self, size):
+		Cache.__init__(self, size)
+		self.items = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self.items)
+
+	def get(self, key):
+		if key not in self.items:
+			return False, None
+
+		value = self.items.pop(key)
+		self.items[key] = value
+		return True, value
+
+	def store(self, key, value):
+		if key in self.items:
+			del self.items[key]
+
+		elif len(self.items) >= self.size:
+			self.items.popitem(last=False)
+			self.evictions += 1
+
+		self.items[key] = value
+
+
+class ARCCache(Cache):
+	'''
+	Adaptive replacement cache, keeps recently used keys in t1 and
+	frequently used keys in t2, the ghost lists b1 and b2 remember keys
+	evicted from t1 and t2 to adapt the target size p of t1
+	@para size int, maximum number of cached keys
+	'''
+	def __init__(self, size):
+		Cache.__init__(self, size)
+		self.p = 0
+		self.t1 = collections.OrderedDict()
+		self.t2 = collections.OrderedDict()
+		self.b1 = collections.OrderedDict()
+		self.b2 = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self.t1) + len(self.t2)
+
+	def get(self, key):
+		if key in self.t1:
+			value = self.t1.pop(key)
+
+		elif key in self.t2:
+			value = self.t2.pop(key)
+
+		else:
+			return False, None
+
+		self.t2[key] = value
+		return True, value
+
+	def replace(self, key):
+		'''
+		evict the least recently used key of t1 or t2 to ghost list
+		@para key, the key to be stored
+		'''
+		if len(self.t1) + len(self.t2) < self.size:
+			return
+
+		if self.t1 and (not self.t2 or len(self.t1) > self.p or \
+			(key in self.b2 and len(self.t1) == self.p)):
+			old, _ = self.t1.popitem(last=False)
+			self.b1[old] = None
+		else:
+			old, _ = self.t2.popitem(last=False)
+			self.b2[old] = None
+
+		self.evictions += 1
+
+	def store(self, key, value):
+		if key in self.t1 or key in self.t2:
+			self.get(key)
+			self.t2[key] = value
+
+		elif key in self.b1:
+			self.p = min(self.size, self.p + max(len(self.b2) // len(self.b1), 1))
+			self.replace(key)
+			del self.b1[key]
+			self.t2[key] = value
+
+		elif key in self.b2:
+			self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+			self.replace(key)
+			del self.b2[key]
+			self.t2[key] = value
+
+		else:
+			l1 = len(self.t1) + len(self.b1)
+			total = l1 + len(self.t2) + len(self.b2)
+
+			if l1 >= self.size:
+				if len(self.t1) < self.size:
+					self.b1.popitem(last=False)
+					self.replace(key)
+				else:
+					self.t1.popitem(last=False)
+					self.evictions += 1
+
+			elif total >= self.size:
+				if total >= 2 * self.size:
+					self.b2.popitem(last=False)
+				self.replace(key)
+
+			self.t1[key] = value
+
+
+#supported cache eviction policies
+cache_policies = dict(
+	lru = LRUCache,
+	arc = ARCCache
+)
+
+def make_cache(policy='lru', size=100000):
+	'''
+	create a cache with eviction policy, zero size disables caching
+	@para policy str, lru or arc
+	@para size int, maximum number of cached keys
+	@return Cache object
+	'''
+	if size <= 0:
+		return Cache(0)
+
+	if policy not in cache_policies:
+		raise Exception("** Cache policy %s is not supported **" % policy)
+
+	return cache_policies[policy](size)
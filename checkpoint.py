@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+
+from utils import atomic_open
+
+def file_digest(path, block_size=16*1024*1024):
+	'''
+	calculate sha1 digest of file content
+	@para path str, file path
+	@para block_size int, bytes read each time
+	@return str, hex digest
+	'''
+	sha1 = hashlib.sha1()
+	with open(path, 'rb') as fh:
+		for block in iter(lambda: fh.read(block_size), ''):
+			sha1.update(block)
+	return sha1.hexdigest()
+
+def path_identity(path):
+	'''
+	cheap identity of a large file or directory by the size and modified
+	time of files, the content is not read
+	@para path str, file or directory path
+	@return list, (relative name, size, modified time) of each file
+	'''
+	if os.path.isdir(path):
+		files = sorted(os.path.join(root, name) for root, dirs, names in os.walk(path) for name in names)
+	elif os.path.exists(path):
+		files = [path]
+	else:
+		return []
+
+	return [(os.path.relpath(f, path) if f != path else os.path.basename(f),
+		os.path.getsize(f), os.path.getmtime(f)) for f in files]
+
+def checkpoint_key(*parts):
+	'''
+	make a checkpoint key from input digests and options
+	@para parts, input file digests and option values
+	@return str, hex digest
+	'''
+	return hashlib.sha1(repr(parts)).hexdigest()
+
+
+class Checkpoint(object):
+	'''
+	Completion markers of finished works in a directory, each marker file
+	keeps the key made from input file digests and options, the marker
+	with different key is treated as not completed
+	@para workdir str, directory to store marker files
+	@para key str, checkpoint key
+	'''
+	def __init__(self, workdir, key):
+		self.workdir = workdir
+		self.key = key
+
+	def marker(self, name):
+		return os.path.join(self.workdir, "%s.done" % name)
+
+	def is_done(self, name):
+		'''
+		@para name str, name of work
+		@return bool, the work is completed with the same key
+		'''
+		marker = self.marker(name)
+		if not os.path.isfile(marker):
+			return False
+
+		with open(marker) as fh:
+			return fh.read().strip() == self.key
+
+	def mark_done(self, name):
+		'''
+		@para name str, name of completed work
+		'''
+		with atomic_open(self.marker(name)) as fh:
+			fh.write(self.key)
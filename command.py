@@ -3,6 +3,7 @@
 import os
 import sh
 import attr
+import subprocess
 
 #diamond alignment tool
 diamond = sh.diamond.bake(
@@ -27,3 +28,48 @@ makeblastdb = sh.makeblastdb.bake(
 prerapsearch = sh.prerapsearch
 rapsearch = sh.rapsearch
 
+
+def make_args(command, options, prefix='--'):
+	'''
+	convert keyword options to command line arguments like baked sh
+	command, underscores of option name are replaced by dash, True is a
+	flag without value and False is omitted
+	@para command list, program and positional arguments
+	@para options dict, option name and value
+	@para prefix str, prefix of option name
+	@return list, command line arguments
+	'''
+	args = [str(arg) for arg in command]
+	for name, value in sorted(options.items()):
+		if value is None or value is False:
+			continue
+
+		args.append("%s%s" % (prefix, name.replace('_', '-')))
+		if value is not True:
+			args.append(str(value))
+	return args
+
+def iter_pipe_lines(args):
+	'''
+	run command with stdout connected to a pipe and yield output lines,
+	the command is blocked when the pipe is full, so that output is not
+	piled in memory when lines are consumed slower than produced
+	@para args list, command line arguments
+	@return generator, output lines
+	'''
+	proc = subprocess.Popen(args, stdout=subprocess.PIPE)
+	completed = False
+	try:
+		for line in iter(proc.stdout.readline, ''):
+			yield line
+		completed = True
+	finally:
+		proc.stdout.close()
+
+		#consumer stopped before the end of output
+		if not completed and proc.poll() is None:
+			proc.kill()
+		code = proc.wait()
+
+	if code != 0:
+		raise Exception("** %s exited with code %d **" % (args[0], code))
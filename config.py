@@ -23,6 +23,7 @@ config.read(cnf)
 
 DB_DIR =  config.get('Database', 'DB_DIR')
 GO_DB = os.path.join(DB_DIR, 'go.db')
+GO_OBO = os.path.join(DB_DIR, 'go-basic.obo')
 
 if __name__ == '__main__':
 	print config.get('Database', 'DB_DIR')
\ No newline at end of file
@@ -9,19 +9,24 @@ class GODatabase(object):
 	'''
 	Gene ontology association annotation database
 	@dbfile, database file path
+	@readonly, open database for query only, used by annotation workers
 	'''
 	dbfile = attr.ib()
+	readonly = attr.ib(default=False)
 	conn = attr.ib(init=False)
 	cursor = attr.ib(init=False)
 
 	@dbfile.validator
-	def check_db_file(self):
-		if not os.path.isfile(self.dbfile):
-			raise Exception('Datbase file %s is not exists' % self.dbfile)
+	def check_db_file(self, attribute, value):
+		if not os.path.isfile(value):
+			raise Exception('Datbase file %s is not exists' % value)
 
 	@conn.default
 	def connect_to_db(self):
-		return sqlite3.connect(self.dbfile)
+		conn = sqlite3.connect(self.dbfile)
+		if self.readonly:
+			conn.execute("PRAGMA query_only=ON")
+		return conn
 
 	@cursor.default
 	def get_cursor(self):
@@ -34,11 +39,11 @@ class GODatabase(object):
 	def submit(self):
 		self.conn.commit()
 
-	def iter(self, sql, args=None):
+	def iter(self, sql, args=()):
 		for row in self.cursor.execute(sql, args):
 			yield row
 
-	def get(self, sql, args=None):
+	def get(self, sql, args=()):
 		for row in self.cursor.execute(sql, args):
 			return row[0]
 
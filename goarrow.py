@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = None
+
+from db import GODatabase
+
+#exported tables, columns and the columns rows are ordered by, str columns
+#are dictionary encoded with a sorted dictionary shared by all record batches
+#of the table, the dictionary of key column is ordered case insensitively
+#like NOCASE, so that both dictionary and rows are binary searched in place
+columnar_tables = [
+	('term', [('id', 'int64'), ('acc', 'str')], ['id']),
+	('association', [('id', 'int64'), ('term_id', 'int32'), ('gene_product_id', 'int64'),
+		('evidence', 'int8'), ('rank', 'int8')], ['gene_product_id']),
+	('gene_product', [('id', 'int64'), ('dbxref_id', 'int64')], ['dbxref_id']),
+	('dbxref', [('id', 'int64'), ('xref_key', 'key')], ['xref_key']),
+	('acc2uniprot', [('acc', 'key'), ('uniprot', 'str')], ['acc', 'uniprot'])
+]
+
+#file extension of each columnar format
+columnar_formats = dict(parquet='parquet', arrow='arrow')
+
+def check_pyarrow():
+	if pa is None or np is None:
+		raise Exception("** pyarrow and numpy are required for parquet or arrow GO tables **")
+
+def is_go_arrow(path):
+	'''
+	check the path is a directory of GO tables exported by export_go_tables
+	@para path str, directory path
+	@return str, parquet or arrow format, None if not columnar GO tables
+	'''
+	if not os.path.isdir(path):
+		return None
+
+	for fmt, ext in columnar_formats.items():
+		if all(os.path.isfile(os.path.join(path, "%s.%s" % (table, ext)))
+			for table, _, _ in columnar_tables):
+			return fmt
+
+def make_dictionary(db, table, column, nocase=False):
+	'''
+	make a temporary table of distinct values of column ordered by binary
+	collation, the rowid - 1 of value is the dictionary code
+	@para db, GODatabase object
+	@para table str, table name
+	@para column str, column name
+	@para nocase bool, order values case insensitively, values only
+	different in case are ordered by binary collation
+	@return tuple, temporary table name and dictionary array
+	'''
+	name = "dict_%s_%s" % (table, column)
+	order = "1 COLLATE NOCASE, 1" if nocase else "1"
+	db.cursor.execute("DROP TABLE IF EXISTS temp.%s" % name)
+	db.cursor.execute("CREATE TEMP TABLE %s AS SELECT DISTINCT %s COLLATE BINARY AS value"
+		" FROM %s ORDER BY %s" % (name, column, table, order))
+	db.cursor.execute("CREATE UNIQUE INDEX temp.%s_value ON %s (value)" % (name, name))
+	values = [row[0] for row in db.iter("SELECT value FROM temp.%s ORDER BY rowid" % name)]
+	return name, pa.array(values, type=pa.string())
+
+def iter_record_batches(db, table, columns, order, batch_size=1000000):
+	'''
+	read table rows and convert them to record batches, str values are
+	replaced with dictionary codes by join in sqlite, an empty batch is
+	made for empty table to keep the dictionaries in schema
+	@para db, GODatabase object
+	@para table str, table name
+	@para columns list, (column, kind) of table
+	@para order list, columns that rows are ordered by, str columns are
+	ordered by dictionary code
+	@para batch_size int, rows of each record batch
+	@return generator, record batches
+	'''
+	dictionaries = {}
+	fields = {}
+	joins = []
+	for i, (column, kind) in enumerate(columns):
+		if kind in ('str', 'key'):
+			name, dictionary = make_dictionary(db, table, column, kind == 'key')
+			dictionaries[column] = dictionary
+			fields[column] = "d%d.rowid - 1" % i
+			joins.append(" CROSS JOIN temp.%s AS d%d ON (d%d.value=t.%s)" % (name, i, i, column))
+		else:
+			fields[column] = "t.%s" % column
+
+	sql = "SELECT %s FROM %s AS t%s ORDER BY %s" % (', '.join(fields[c] for c, _ in columns),
+		table, ''.join(joins), ', '.join(fields[c] for c in order))
+
+	def make_batch(rows):
+		arrays = []
+		for (column, kind), values in zip(columns, zip(*rows) or [()]*len(columns)):
+			if column in dictionaries:
+				codes = pa.array(np.array(values, dtype=np.int32))
+				arrays.append(pa.DictionaryArray.from_arrays(codes, dictionaries[column]))
+			else:
+				arrays.append(pa.array(np.array(values, dtype=kind)))
+		return pa.RecordBatch.from_arrays(arrays, [column for column, _ in columns])
+
+	rows = []
+	empty = True
+	for row in db.iter(sql):
+		rows.append(row)
+		if len(rows) >= batch_size:
+			yield make_batch(rows)
+			rows = []
+			empty = False
+
+	if rows or empty:
+		yield make_batch(rows)
+
+def export_go_tables(dbfile, outdir, fmt='parquet', batch_size=1000000):
+	'''
+	Export the tables of GO association database to dictionary encoded
+	parquet or arrow IPC files in a directory, one file for each table
+	@para dbfile str, GO association database made by makedb
+	@para outdir str, output directory
+	@para fmt str, parquet or arrow
+	@para batch_size int, rows of each record batch or parquet row group
+	'''
+	check_pyarrow()
+
+	if fmt not in columnar_formats:
+		raise Exception("** columnar format %s is not supported **" % fmt)
+
+	if os.path.exists(outdir):
+		raise Exception("** %s is exists **" % outdir)
+
+	db = GODatabase(dbfile)
+	columns = [row[1] for row in db.iter("PRAGMA table_info(association)")]
+	if 'rank' not in columns:
+		raise Exception("** No evidence rank in %s, please remake database with makedb **" % dbfile)
+
+	#write to a temporary directory and rename to avoid incomplete tables
+	tmp_dir = "%s.tmp" % outdir
+	if os.path.exists(tmp_dir):
+		shutil.rmtree(tmp_dir)
+	os.makedirs(tmp_dir)
+
+	#the schema of writer is taken from batch, which has dictionary values
+	for table, columns, order in columnar_tables:
+		batches = iter_record_batches(db, table, columns, order, batch_size)
+		batch = next(batches)
+		out_file = os.path.join(tmp_dir, "%s.%s" % (table, columnar_formats[fmt]))
+
+		if fmt == 'parquet':
+			writer = pq.ParquetWriter(out_file, batch.schema)
+			writer.write_table(pa.Table.from_batches([batch]))
+			for batch in batches:
+				writer.write_table(pa.Table.from_batches([batch]))
+			writer.close()
+
+		else:
+			sink = pa.OSFile(out_file, 'wb')
+			writer = pa.RecordBatchFileWriter(sink, batch.schema)
+			writer.write_batch(batch)
+			for batch in batches:
+				writer.write_batch(batch)
+			writer.close()
+			sink.close()
+
+	os.rename(tmp_dir, outdir)
+
+def column_values(table, column):
+	'''
+	@para table, pyarrow Table
+	@para column str, integer column name, codes are returned for
+	dictionary encoded column
+	@return array, numpy array of column
+	'''
+	chunks = [chunk.indices.to_numpy() if isinstance(chunk, pa.DictionaryArray) else chunk.to_numpy()
+		for chunk in table.column(column).chunks]
+	return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+
+def expand_ranges(starts, ends):
+	'''
+	concatenate the positions of ranges without python loop
+	@para starts array, start position of each range
+	@para ends array, end position of each range
+	@return tuple, length of each range and concatenated positions
+	'''
+	lengths = ends - starts
+	positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+	return lengths, positions
+
+def encode_key(value):
+	'''
+	@para value str, accession or dbxref key
+	@return str, lower case bytes like NOCASE
+	'''
+	if isinstance(value, unicode):
+		value = value.encode('utf-8')
+	return value.lower()
+
+
+class ChunkedColumn(object):
+	'''
+	Integer column or dictionary codes of column split to record batches,
+	the chunks are numpy views of arrow buffers, so that sorted column is
+	searched in memory mapped file without copy
+	@para column, pyarrow ChunkedArray
+	'''
+	def __init__(self, column):
+		self.chunks = [chunk.indices.to_numpy() if isinstance(chunk, pa.DictionaryArray)
+			else chunk.to_numpy() for chunk in column.chunks]
+		self.starts = np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+
+	def search(self, values, side='left'):
+		'''
+		binary search values in sorted column, the position in column is
+		the sum of positions in chunks
+		@para values array, values to search
+		@para side str, left or right like numpy searchsorted
+		@return array, positions of values
+		'''
+		positions = np.zeros(len(values), dtype=np.int64)
+		for chunk in self.chunks:
+			positions += np.searchsorted(chunk, values, side)
+		return positions
+
+	def take(self, positions):
+		'''
+		@para positions array, row positions
+		@return array, values of rows
+		'''
+		if len(self.chunks) == 1:
+			return self.chunks[0][positions]
+
+		if not self.chunks:
+			return np.zeros(0, dtype=np.int64)
+
+		chunks = np.searchsorted(self.starts, positions, 'right') - 1
+		values = np.zeros(len(positions), dtype=self.chunks[0].dtype)
+		for i in np.unique(chunks):
+			rows = chunks == i
+			values[rows] = self.chunks[i][positions[rows] - self.starts[i]]
+		return values
+
+
+class StringDictionary(object):
+	'''
+	Sorted dictionary of str column read from the offsets and data buffers
+	of arrow array in place instead of converted to python objects, keys
+	are binary searched for all queries at once by comparing fixed width
+	prefixes of values, the dictionary shared by record batches is used,
+	each parquet row group has a copy of the same dictionary
+	@para column, pyarrow ChunkedArray of dictionary encoded column
+	@para nocase bool, compare values in lower case like NOCASE, the
+	dictionary of key column is ordered case insensitively
+	'''
+	def __init__(self, column, nocase=False):
+		if column.num_chunks:
+			dictionary = column.chunks[0].dictionary
+		else:
+			dictionary = pa.array([], type=pa.string())
+
+		self.nocase = nocase
+		self.size = len(dictionary)
+		self.offsets = np.zeros(1, dtype=np.int32)
+		self.data = np.zeros(0, dtype=np.uint8)
+		buffers = dictionary.buffers()
+		if self.size:
+			self.offsets = np.frombuffer(buffers[1], dtype=np.int32)[dictionary.offset:]
+		if self.size and buffers[2] is not None:
+			self.data = np.frombuffer(buffers[2], dtype=np.uint8)
+
+	def __len__(self):
+		return self.size
+
+	def __getitem__(self, code):
+		return self.data[self.offsets[code]:self.offsets[code+1]].tostring()
+
+	def prefixes(self, codes, width):
+		'''
+		@para codes array, dictionary codes
+		@para width int, bytes of prefix
+		@return array, numpy bytes array of value prefixes
+		'''
+		starts = self.offsets[codes]
+		lengths = np.minimum(self.offsets[codes+1] - starts, width)
+		mask = np.arange(width) < lengths[:,None]
+		values = np.zeros((len(codes), width), dtype=np.uint8)
+		values[mask] = self.data[(starts[:,None] + np.arange(width))[mask]]
+
+		#only ascii letters are folded like NOCASE
+		if self.nocase:
+			values[(values >= 65) & (values <= 90)] += 32
+		return values.view('S%d' % width).ravel()
+
+	def find_many(self, keys):
+		'''
+		@para keys list, keys to search, lower case for nocase dictionary
+		@return tuple, arrays of start and end dictionary codes of keys
+		'''
+		if not keys or not self.size:
+			empty = np.zeros(len(keys), dtype=np.int64)
+			return empty, empty
+
+		#prefix one byte longer than keys is enough to compare with keys
+		keys = np.array(keys, dtype=bytes)
+		width = keys.dtype.itemsize + 1
+		starts = np.zeros(len(keys), dtype=np.int64)
+		ends = np.full(len(keys), self.size, dtype=np.int64)
+		while True:
+			active = np.flatnonzero(starts < ends)
+			if not len(active):
+				break
+
+			mid = (starts[active] + ends[active]) // 2
+			less = self.prefixes(mid, width) < keys[active]
+			starts[active[less]] = mid[less] + 1
+			ends[active[~less]] = mid[~less]
+
+		#values only different in case are adjacent in nocase dictionary
+		ends = starts.copy()
+		while True:
+			active = np.flatnonzero(ends < self.size)
+			active = active[self.prefixes(ends[active], width) == keys[active]]
+			if not len(active):
+				break
+			ends[active] += 1
+
+		return starts, ends
+
+
+class GOArrow(object):
+	'''
+	Columnar GO tables loaded by pyarrow, arrow IPC files are memory mapped,
+	batch lookups join accessions, dbxref, gene products and associations
+	by binary search of the sorted columns and dictionaries in arrow buffers
+	instead of sql, no index is built when loading, the memory used is the
+	mapped pages of arrow file, parquet files are decompressed to memory.
+	The loaded pyarrow tables are kept in tables for bulk analytics
+	@para path str, directory made by export_go_tables
+	'''
+	def __init__(self, path):
+		check_pyarrow()
+		self.path = path
+		self.format = is_go_arrow(path)
+		if self.format is None:
+			raise Exception("** %s is not a directory of GO tables **" % path)
+
+		self.tables = {table: self.read_table(table, columns) for table, columns, _ in columnar_tables}
+		self.columns = {}
+		self.dictionaries = {}
+		for table, columns, _ in columnar_tables:
+			for column, kind in columns:
+				name = "%s.%s" % (table, column)
+				self.columns[name] = ChunkedColumn(self.tables[table].column(column))
+				if kind in ('str', 'key'):
+					self.dictionaries[name] = StringDictionary(self.tables[table].column(column), kind == 'key')
+
+		#term id and GO accession
+		accs = self.dictionaries['term.acc']
+		codes = column_values(self.tables['term'], 'acc')
+		self.terms = {tid: accs[code] for tid, code in zip(column_values(self.tables['term'], 'id').tolist(), codes.tolist())}
+
+	def read_table(self, table, columns):
+		path = os.path.join(self.path, "%s.%s" % (table, columnar_formats[self.format]))
+		if self.format == 'parquet':
+			return pq.read_table(path, read_dictionary=[c for c, kind in columns if kind in ('str', 'key')])
+
+		return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+	def __len__(self):
+		return len(self.dictionaries['dbxref.xref_key'])
+
+	def search_rows(self, column, starts, ends=None):
+		'''
+		find rows of values in sorted column
+		@para column str, table and column name
+		@para starts array, values or start dictionary codes
+		@para ends array, end dictionary codes, None for single values
+		@return tuple, number of rows of each value and row positions
+		'''
+		column = self.columns[column]
+		ends = column.search(starts, 'right') if ends is None else column.search(ends)
+		return expand_ranges(column.search(starts), ends)
+
+	def lookup(self, queries, starts, ends, policy=None):
+		'''
+		join dbxref keys to associations and apply evidence policy
+		@para queries array, query numbers
+		@para starts array, start dictionary code of dbxref key of queries
+		@para ends array, end dictionary code of dbxref key of queries
+		@para policy, utils.EvidencePolicy object or None
+		@return tuple, query numbers, term ids and evidences of unique rows
+		'''
+		lengths, rows = self.search_rows('dbxref.xref_key', starts, ends)
+		queries = np.repeat(queries, lengths)
+		lengths, rows = self.search_rows('gene_product.dbxref_id', self.columns['dbxref.id'].take(rows))
+		queries = np.repeat(queries, lengths)
+		lengths, rows = self.search_rows('association.gene_product_id', self.columns['gene_product.id'].take(rows))
+		queries = np.repeat(queries, lengths)
+		terms = self.columns['association.term_id'].take(rows).astype(np.int64)
+		evidences = self.columns['association.evidence'].take(rows).astype(np.int64)
+		ranks = self.columns['association.rank'].take(rows)
+
+		if policy is not None and policy.is_active():
+			keep = (ranks >= policy.min_rank) & ~np.in1d(evidences, policy.exclude_ids)
+			queries, terms, evidences, ranks = queries[keep], terms[keep], evidences[keep], ranks[keep]
+
+			#the first row of each query and term ordered by rank is the best,
+			#and the smaller evidence id is selected when ranks are the same
+			if policy.best and len(queries):
+				n = int(terms.max()) + 1
+				order = np.lexsort((evidences, -ranks, queries * n + terms))
+				pairs = (queries * n + terms)[order]
+				order = order[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+				queries, terms, evidences = queries[order], terms[order], evidences[order]
+
+		if not len(queries):
+			return queries, terms, evidences
+
+		#unique query, term and evidence like sql DISTINCT
+		n = int(terms.max()) + 1
+		m = int(evidences.max()) + 1
+		keys = np.unique((queries * n + terms) * m + evidences)
+		return keys // m // n, keys // m % n, keys % m
+
+	def get_many(self, accs, policy=None, names=True):
+		'''
+		get GO terms of many accessions by batch, accessions not in dbxref
+		or without any GO term are converted to uniprot accession
+		@para accs list, NCBI, Ensembl or Uniprot etc. accession numbers
+		@para policy, utils.EvidencePolicy object or None
+		@para names bool, GO term accessions or term ids are returned
+		@return dict, accession as key and (term, evidence) list as value
+		'''
+		accs = list(set(accs))
+		results = {acc: [] for acc in accs}
+		if not accs:
+			return results
+
+		keys = [encode_key(acc) for acc in accs]
+		xref_keys = self.dictionaries['dbxref.xref_key']
+		found = self.lookup(np.arange(len(accs)), *xref_keys.find_many(keys), policy=policy)
+
+		#second, search GO terms by the minimum uniprot accession of missing
+		#accessions, rows of acc2uniprot are ordered by acc and uniprot
+		missing = np.ones(len(accs), dtype=bool)
+		missing[found[0]] = False
+		queries = np.flatnonzero(missing)
+		starts, ends = self.dictionaries['acc2uniprot.acc'].find_many([keys[q] for q in queries])
+		lengths, rows = self.search_rows('acc2uniprot.acc', starts, ends)
+		queries = np.repeat(queries, lengths)
+		codes = self.columns['acc2uniprot.uniprot'].take(rows)
+		order = np.lexsort((codes, queries))
+		first = order[np.concatenate([[True], queries[order][1:] != queries[order][:-1]])[:len(order)]]
+
+		uniprots = self.dictionaries['acc2uniprot.uniprot']
+		converted = self.lookup(queries[first], *xref_keys.find_many(
+			[uniprots[code].lower() for code in codes[first].tolist()]), policy=policy)
+
+		terms = self.terms
+		for q, tid, evidence in zip(*[np.concatenate(cols).tolist() for cols in zip(found, converted)]):
+			results[accs[q]].append((terms[tid] if names else tid, evidence))
+
+		return results
+
+	def get(self, acc, policy=None, names=True):
+		'''
+		@para acc str, accession number
+		@para policy, utils.EvidencePolicy object or None
+		@para names bool, GO term accessions or term ids are returned
+		@return list, (term, evidence) tuples
+		'''
+		return self.get_many([acc], policy, names)[acc]
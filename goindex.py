@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import struct
+import shutil
+import tempfile
+
+from db import GODatabase
+from utils import evidence_ranks
+
+#file header: magic, version, number of accessions, pairs and terms,
+#followed by the offsets of seven sections, all in little endian
+MAGIC = 'TOPAZGO\0'
+VERSION = 2
+HEADER = struct.Struct('<8sII10Q')
+SECTIONS = ['acc_offsets', 'acc_blob', 'pair_offsets', 'pairs',
+	'term_ids', 'term_offsets', 'term_blob']
+
+def is_go_index(index_file):
+	'''
+	check the file is memory mapped GO index or not
+	@para index_file str, file path
+	@return bool
+	'''
+	if not os.path.isfile(index_file):
+		return False
+
+	with open(index_file, 'rb') as fh:
+		return fh.read(len(MAGIC)) == MAGIC
+
+
+class SectionWriter(object):
+	'''
+	Write a section of GO index to temporary file, integers are buffered
+	in list and packed when the buffer is full
+	@para typecode, struct format code, Q for uint64 and I for uint32
+	'''
+	def __init__(self, typecode=None, buffer_size=1000000):
+		self.fh = tempfile.TemporaryFile()
+		self.typecode = typecode
+		self.buffer_size = buffer_size
+		self.buffer = [] if typecode else None
+
+	def append(self, value):
+		self.buffer.append(value)
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+
+	def write(self, data):
+		self.fh.write(data)
+
+	def flush(self):
+		if self.buffer:
+			self.fh.write(struct.pack('<%d%s' % (len(self.buffer), self.typecode), *self.buffer))
+			del self.buffer[:]
+
+	def copy_to(self, out):
+		'''
+		copy section to output file and pad to 8 bytes boundary
+		@para out, output file handler
+		@return int, the offset of section in output file
+		'''
+		if self.buffer is not None:
+			self.flush()
+
+		offset = out.tell()
+		self.fh.seek(0)
+		shutil.copyfileobj(self.fh, out, 16*1024*1024)
+		self.fh.close()
+		out.write('\0' * (-out.tell() % 8))
+		return offset
+
+
+def build_go_index(dbfile, index_file):
+	'''
+	Convert the acc2go table of GO association database to a compact index
+	file, accessions are lower case and sorted for binary search, GO terms
+	of each accession are packed (term_id, evidence) uint32 pairs ordered
+	by evidence rank from high to low
+	@para dbfile str, GO association database made by makedb with --acc2go
+	@para index_file str, output memory mapped GO index file
+	'''
+	db = GODatabase(dbfile)
+	sql = "SELECT 1 FROM sqlite_master WHERE type='table' AND name='acc2go'"
+	if db.get(sql) is None:
+		raise Exception("** No acc2go table in %s, please make database with --acc2go **" % dbfile)
+
+	sections = dict(
+		acc_offsets = SectionWriter('Q'),
+		acc_blob = SectionWriter(),
+		pair_offsets = SectionWriter('Q'),
+		pairs = SectionWriter('I'),
+		term_ids = SectionWriter('I'),
+		term_offsets = SectionWriter('Q'),
+		term_blob = SectionWriter()
+	)
+
+	#accessions ordered by NOCASE collation are ordered by lower case bytes
+	prev = None
+	num_accs = num_pairs = blob_size = 0
+	columns = [row[1] for row in db.iter("PRAGMA table_info(acc2go)")]
+	if 'rank' not in columns:
+		raise Exception("** No evidence rank in %s, please remake database with makedb **" % dbfile)
+
+	sql = "SELECT acc, term_id, evidence FROM acc2go ORDER BY acc, rank DESC, term_id, evidence"
+	for acc, term_id, evidence in db.iter(sql):
+		acc = acc.encode('utf-8').lower()
+		if acc != prev:
+			sections['acc_offsets'].append(blob_size)
+			sections['pair_offsets'].append(num_pairs)
+			sections['acc_blob'].write(acc)
+			blob_size += len(acc)
+			num_accs += 1
+			prev = acc
+
+		sections['pairs'].append(term_id)
+		sections['pairs'].append(int(evidence or 0))
+		num_pairs += 1
+
+	sections['acc_offsets'].append(blob_size)
+	sections['pair_offsets'].append(num_pairs)
+
+	num_terms = blob_size = 0
+	for term_id, acc in db.iter("SELECT id, acc FROM term ORDER BY id"):
+		acc = acc.encode('utf-8')
+		sections['term_ids'].append(term_id)
+		sections['term_offsets'].append(blob_size)
+		sections['term_blob'].write(acc)
+		blob_size += len(acc)
+		num_terms += 1
+	sections['term_offsets'].append(blob_size)
+
+	#write to a temporary file and rename to avoid incomplete index
+	tmp_file = "%s.tmp" % index_file
+	with open(tmp_file, 'wb') as out:
+		out.write('\0' * HEADER.size)
+		offsets = [sections[name].copy_to(out) for name in SECTIONS]
+		out.seek(0)
+		out.write(HEADER.pack(MAGIC, VERSION, 0, num_accs, num_pairs, num_terms, *offsets))
+	os.rename(tmp_file, index_file)
+
+
+class GOIndex(object):
+	'''
+	Read only memory mapped GO index, accessions are searched by binary
+	search in the mapped file, the file can be shared by many processes
+	through page cache
+	@para index_file str, GO index file made by build_go_index
+	'''
+	def __init__(self, index_file):
+		self.index_file = index_file
+		self.mm = None
+		self.fh = open(index_file, 'rb')
+		self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+		header = HEADER.unpack_from(self.mm, 0)
+		if header[0] != MAGIC:
+			raise Exception("** %s is not a GO index file **" % index_file)
+
+		if header[1] != VERSION:
+			raise Exception("** GO index version %s is not supported **" % header[1])
+
+		self.num_accs, self.num_pairs, self.num_terms = header[3:6]
+		self.offsets = dict(zip(SECTIONS, header[6:]))
+		self.terms = self.read_terms()
+
+	def __del__(self):
+		self.close()
+
+	def __len__(self):
+		return self.num_accs
+
+	def __contains__(self, acc):
+		return self.find(acc) is not None
+
+	def close(self):
+		if self.mm is not None:
+			self.mm.close()
+			self.fh.close()
+			self.mm = None
+
+	def read_terms(self):
+		'''
+		@return dict, term id as key and GO term accession as value
+		'''
+		ids = struct.unpack_from('<%dI' % self.num_terms, self.mm, self.offsets['term_ids'])
+		offsets = struct.unpack_from('<%dQ' % (self.num_terms+1), self.mm, self.offsets['term_offsets'])
+		blob = self.offsets['term_blob']
+		return {ids[i]: self.mm[blob+offsets[i]:blob+offsets[i+1]] for i in xrange(self.num_terms)}
+
+	def get_key(self, i):
+		start, end = struct.unpack_from('<QQ', self.mm, self.offsets['acc_offsets'] + 8*i)
+		blob = self.offsets['acc_blob']
+		return self.mm[blob+start:blob+end]
+
+	def find(self, acc):
+		'''
+		binary search accession case insensitively
+		@para acc str, accession number
+		@return int, index of accession or None if not found
+		'''
+		key = acc.lower()
+		lo, hi = 0, self.num_accs
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.get_key(mid) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+
+		if lo < self.num_accs and self.get_key(lo) == key:
+			return lo
+
+	def get(self, acc, policy=None):
+		'''
+		get the GO term id and evidence pairs of accession, pairs are ordered
+		by evidence rank, so that the scan stops at the first pair with lower
+		rank than minimum rank and the first pair of term is the best one
+		@para acc str, accession number
+		@para policy, utils.EvidencePolicy object or None
+		@return list, (term_id, evidence) tuples
+		'''
+		i = self.find(acc)
+		if i is None:
+			return []
+
+		start, end = struct.unpack_from('<QQ', self.mm, self.offsets['pair_offsets'] + 8*i)
+		vals = struct.unpack_from('<%dI' % (2*(end-start)), self.mm, self.offsets['pairs'] + 8*start)
+		pairs = zip(vals[::2], vals[1::2])
+		if policy is None or not policy.is_active():
+			return pairs
+
+		results = []
+		seen = set()
+		for term_id, evidence in pairs:
+			if evidence_ranks.get(evidence, 0) < policy.min_rank:
+				break
+
+			if evidence in policy.exclude_ids:
+				continue
+
+			if policy.best:
+				if term_id in seen:
+					continue
+				seen.add(term_id)
+
+			results.append((term_id, evidence))
+		return results
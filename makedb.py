@@ -5,85 +5,165 @@ import sys
 import csv
 import gzip
 import time
+import Queue
+import shutil
+import struct
+import hashlib
 import textwrap
 import argparse
+import threading
 
-import apsw
-
-#command line arguments
-parser = argparse.ArgumentParser(
-	prog = 'topazdb',
-	formatter_class=argparse.RawDescriptionHelpFormatter,
-	description =textwrap.dedent('''\
-		Create topaz gene ontology (GO) association database, require 3 files: 
-		1) go_monthly-assocdb-data.gz http://archive.geneontology.org/latest-full/
-		2) idmapping.tb.gz ftp://ftp.pir.georgetown.edu/databases/idmapping/
-		3) idmapping.dat.gz ftp://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/'''
+try:
+	import apsw
+except ImportError:
+	apsw = None
+
+from utils import EvidenceCode, evidence_ranks, parallel_map
+from checkpoint import checkpoint_key, file_digest
+from goarrow import export_go_tables
+
+def command_arguments():
+	'''
+	command line arguments
+	'''
+	parser = argparse.ArgumentParser(
+		prog = 'topazdb',
+		formatter_class=argparse.RawDescriptionHelpFormatter,
+		description =textwrap.dedent('''\
+			Create topaz gene ontology (GO) association database, require 3 files:
+			1) go_monthly-assocdb-data.gz http://archive.geneontology.org/latest-full/
+			2) idmapping.tb.gz ftp://ftp.pir.georgetown.edu/databases/idmapping/
+			3) idmapping.dat.gz ftp://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/'''
+		)
 	)
-)
-parser.add_argument('-g',
-	help = 'GO asociation annotation file',
-	required = True,
-	metavar = 'go_monthly-assocdb-data.gz'
-)
-parser.add_argument('-u',
-	help = 'uniprot idmapping file',
-	required = True,
-	metavar = 'idmapping.dat.gz'
-)
-parser.add_argument('-p',
-	help = 'PIR idmapping file',
-	required = True,
-	metavar = 'idmapping.tb.gz'
-)
-parser.add_argument('-o',
-	help = 'Output database file name (default: go-xx.db)',
-	default = 'go-%s.db' % time.strftime("%Y%m", time.localtime()),
-	metavar = 'go.db'
-)
+	parser.add_argument('-g',
+		help = 'GO asociation annotation file',
+		required = True,
+		metavar = 'go_monthly-assocdb-data.gz'
+	)
+	parser.add_argument('-u',
+		help = 'uniprot idmapping file',
+		required = True,
+		metavar = 'idmapping.dat.gz'
+	)
+	parser.add_argument('-p',
+		help = 'PIR idmapping file',
+		required = True,
+		metavar = 'idmapping.tb.gz'
+	)
+	parser.add_argument('-o',
+		help = 'Output database file name (default: go-xx.db)',
+		default = 'go-%s.db' % time.strftime("%Y%m", time.localtime()),
+		metavar = 'go.db'
+	)
+	parser.add_argument('-j', '--jobs',
+		help = 'number of processes for parsing GO association file (default: 1)',
+		type = int,
+		default = 1,
+		metavar = 'jobs'
+	)
+	parser.add_argument('--batch-size',
+		help = 'number of rows written in one batch by pipelined and bulk mode (default: 100000)',
+		type = int,
+		default = 100000,
+		metavar = 'rows'
+	)
+	parser.add_argument('--merge',
+		help = 'method for merging PIR idmapping, bulk uses set based sql and '
+				'probe checks each accession (default: bulk)',
+		choices = ['bulk', 'probe'],
+		default = 'bulk',
+		metavar = 'method'
+	)
+	parser.add_argument('--profile',
+		help = 'database build profile, bulk loads all tables without index, '
+				'uses large cache and builds index at the end (default: standard)',
+		choices = ['standard', 'bulk'],
+		default = 'standard',
+		metavar = 'profile'
+	)
+	parser.add_argument('--cache-size',
+		help = 'sqlite page cache size in MB for bulk profile (default: 2048)',
+		type = int,
+		default = 2048,
+		metavar = 'MB'
+	)
+	parser.add_argument('--mmap-size',
+		help = 'sqlite memory map size in MB for bulk profile (default: 4096)',
+		type = int,
+		default = 4096,
+		metavar = 'MB'
+	)
+	parser.add_argument('--acc2go',
+		action = 'store_true',
+		help = 'build the denormalized accession to GO term lookup table'
+	)
+	parser.add_argument('--columnar',
+		help = 'also export tables as dictionary encoded parquet or arrow IPC '
+				'files to directory named after database, e.g. go-xx.parquet',
+		choices = ['parquet', 'arrow'],
+		metavar = 'format'
+	)
+	parser.add_argument('--row-hashes',
+		action = 'store_true',
+		help = 'save row digests of tables so that the first --update only compares '
+				'changed chunks, otherwise the first update scans this database once'
+	)
+	parser.add_argument('--update',
+		help = 'previous database to be updated with the new input files, only '
+				'changed rows are written, -o can be the same file to update in place',
+		metavar = 'go-old.db'
+	)
+
+	options = parser.parse_args()
 
-options = parser.parse_args()
+	#check the input file
+	if not os.path.isfile(options.g):
+		raise Exception("** GO annotation file %s is not exists **" % options.g)
 
-#check the input file
-if not os.path.isfile(options.g):
-	raise Exception("** GO annotation file %s is not exists **" % options.g)
+	if not os.path.isfile(options.u):
+		raise Exception("** uniprot idmapping file %s is not exists **" % options.u)
 
-if not os.path.isfile(options.u):
-	raise Exception("** uniprot idmapping file %s is not exists **" % options.u)
+	if not os.path.isfile(options.p):
+		raise Exception("** PIR idmapping file %s is not exists **" % options.p)
 
-if not os.path.isfile(options.p):
-	raise Exception("** PIR idmapping file %s is not exists **" % options.p)
+	if options.update and not os.path.isfile(options.update):
+		raise Exception("** previous database %s is not exists **" % options.update)
 
-if os.path.exists(options.o):
-	raise Exception("** %s database file is exists **" % options.o)
+	if os.path.exists(options.o) and options.o != options.update:
+		raise Exception("** %s database file is exists **" % options.o)
 
+	if options.columnar and os.path.exists(columnar_dir(options)):
+		raise Exception("** %s columnar directory is exists **" % columnar_dir(options))
 
-#connect to sqlite3 database
-conn = apsw.Connection(options.o)
-cur = conn.cursor()
+	if options.jobs < 1:
+		raise Exception("** number of jobs should be at least 1 **")
 
-#optimize sqlite3 database speed
-#cur.execute("PRAGMA cache_size=8000")
-#cur.execute("PRAGMA PAGE_SIZE=4096")
-#cur.execute("PRAGMA journal_mode=OFF")
-cur.execute("PRAGMA synchronous=OFF")
-#cur.execute("PRAGMA count_changes=OFF")
-#cur.execute("PRAGMA temp_store=MEMORY")
+	#probe checks each accession by index which is deferred by bulk profile
+	if options.profile == 'bulk' and options.merge == 'probe':
+		raise Exception("** probe merge method can not be used with bulk profile **")
+
+	return options
+
+def columnar_dir(options):
+	'''
+	@return str, directory of exported parquet or arrow tables
+	'''
+	return "%s.%s" % (os.path.splitext(options.o)[0], options.columnar)
 
-#open transaction mode
-cur.execute("BEGIN;")
 
 #create tables
-sql = '''
+table_sql = '''
 CREATE TABLE term (
 	id INTEGER PRIMARY KEY,
 	acc TEXT
 );
 CREATE TABLE association (
-	id INTEGER PRIMARY KEY, 
+	id INTEGER PRIMARY KEY,
 	term_id INTEGER,
 	gene_product_id INTEGER,
-	evidence TEXT
+	evidence INTEGER,
+	rank INTEGER
 );
 CREATE TABLE gene_product (
 	id INTEGER PRIMARY KEY,
@@ -98,6 +178,31 @@ CREATE TABLE acc2uniprot (
 	uniprot TEXT
 );
 '''
+
+#version and input files of each build or update, row_hash keeps the digest
+#of each chunk of table rows for comparison by next update
+meta_sql = '''
+CREATE TABLE IF NOT EXISTS version (
+	version INTEGER PRIMARY KEY,
+	created TEXT,
+	mode TEXT
+);
+CREATE TABLE IF NOT EXISTS provenance (
+	version INTEGER,
+	name TEXT,
+	file TEXT,
+	digest TEXT,
+	inserted INTEGER,
+	deleted INTEGER,
+	changed INTEGER
+);
+CREATE TABLE IF NOT EXISTS row_hash (
+	name TEXT,
+	chunk INTEGER,
+	digest INTEGER,
+	PRIMARY KEY (name, chunk)
+) WITHOUT ROWID;
+'''
 #CREATE TABLE gene_product (
 #	id INTEGER PRIMARY KEY,
 #	symbol TEXT COLLATE NOCASE,
@@ -111,7 +216,6 @@ CREATE TABLE acc2uniprot (
 #	genus TEXT COLLATE NOCASE,
 #	species TEXT COLLATE NOCASE
 #);
-cur.execute(sql)
 
 
 def parse_values(vals):
@@ -137,12 +241,12 @@ def parse_values(vals):
 			if len(column) == 0:
 				row.append(column)
 				continue
-			
+
 			#start of the new row
 			if column[0] == '(':
 				if len(row) == 0:
 					row = [column[1:]]
-			
+
 				elif len(row) > 0:
 					#check the end of a row
 					if row[-1][-1] == ')' and '(' not in row[-1]:
@@ -160,130 +264,191 @@ def parse_values(vals):
 	return rows
 
 #GO annotation evidence code and the custom ID
-evidence_codes = dict(
-	#Experimental Evidence codes
-	EXP = 1,	#Inferred from Experiment
-	IDA = 2,	#Inferred from Direct Assay
-	IPI = 3,	#Inferred from Physical Interaction 
-	IMP = 4,	#Inferred from Mutant Phenotype
-	IGI = 5,	#Inferred from Genetic Interaction
-	IEP = 6,	#Inferred from Expression Pattern
-
-	#Computational Analysis evidence codes
-	
-	ISS = 7,	#Inferred from Sequence or structural Similarity
-	ISO = 8,	#Inferred from Sequence Orthology
-	ISA = 9,	#Inferred from Sequence Alignment
-	ISM = 10,	#Inferred from Sequence Model
-	IGC = 11,	#Inferred from Genomic Context
-	IBA = 12,	#Inferred from Biological aspect of Ancestor
-	IBD = 13,	#Inferred from Biological aspect of Descendant
-	IKR = 14,	#Inferred from Key Residues
-	IRD = 15,	#Inferred from Rapid Divergenc
-	RCA = 16,	#Inferred from Reviewed Computational Analysis
-
-	#Author Statement evidence codes
-	TAS = 17,	#Traceable Author Statement
-	NAS = 18,	#Non-traceable Author Statement
-
-	#Curatorial Statement codes
-	IC = 19,	#Inferred by Curator
-	ND = 20,	#No biological Data available
-
-	#Automatically-Assigned evidence code
-	IEA = 21,	#Inferred from Electronic Annotation
-
-	#Obsolete Evidence Codes
-	NR=22	#Not Recorded
+evidence_codes = EvidenceCode()
+
+#sql statement used to write the rows of each GO association table
+table_statements = dict(
+	term = "INSERT INTO term VALUES (?,?)",
+	association = "INSERT INTO association VALUES (?,?,?,?,?)",
+	dbxref = "INSERT INTO dbxref VALUES (?,?)",
+	gene_product = "INSERT INTO gene_product VALUES (?,?)",
+	evidence = "UPDATE association SET evidence=?, rank=? WHERE id=?"
+	#species = "INSERT INTO species VALUES (?,?,?,?)",
+	#gene_product_synonym = "UPDATE gene_product SET synonym=? WHERE id=?"
 )
 
+def get_table_name(line):
+	'''
+	get the table name from INSERT INTO statement
+	@para line str, INSERT INTO line in GO sql dump
+	@return str, table name
+	'''
+	return line.split('` VALUES ')[0].split()[-1].strip('`')
+
+def parse_insert(line):
+	'''
+	parse INSERT INTO statement and convert values to table rows
+	@para line str, INSERT INTO line in GO sql dump
+	@return tuple, table name and rows to be written
+	'''
+	table = get_table_name(line)
+	vals = parse_values(line.partition('` VALUES ')[2])
 
-#Parse GO association file to sqlite database
-fp = gzip.open(options.g, 'rb')
-for line in fp:
-	if not line.startswith("INSERT INTO"): continue
-	table = line.split('` VALUES ')[0].split()[-1].strip('`')
-	vals = line.partition('` VALUES ')[2]
-	vals = parse_values(vals)
-	
 	if table == 'term':
 		rows = [(int(val[0]), val[3].strip("'")) for val in vals]
-		cur.executemany("INSERT INTO term VALUES (?,?)", rows)
-	
-	if table == 'association':
-		rows = [(int(val[0]), int(val[1]), int(val[2]), 0) for val in vals]
-		cur.executemany("INSERT INTO association VALUES (?,?,?,?)", rows)
+
+	elif table == 'association':
+		rows = [(int(val[0]), int(val[1]), int(val[2]), 0, 0) for val in vals]
 
 	elif table == 'dbxref':
 		rows = [(int(val[0]), val[2].strip("'")) for val in vals]
-		cur.executemany("INSERT INTO dbxref VALUES (?,?)", rows)
 
 	elif table == 'gene_product':
 		rows = [(int(val[0]), int(val[2])) for val in vals]
-		cur.executemany("INSERT INTO gene_product VALUES (?,?)", rows)
 
 	#elif table == 'species':
 	#	rows = [(int(val[0]), int(val[1]), val[4].strip("'"), val[5].strip("'")) for val in vals]
-	#	cur.executemany("INSERT INTO species VALUES (?,?,?,?)", rows)
-		
+
 	#elif table == 'gene_product_synonym':
 	#	rows = [(val[1].strip("'"), int(val[0])) for val in vals]
-	#	cur.executemany("UPDATE gene_product SET synonym=? WHERE id=?", rows)
 
 	elif table == 'evidence':
-		rows = [(evidence_codes[val[1].strip("'")], int(val[2])) for val in vals]
-		cur.executemany("UPDATE association SET evidence=? WHERE id=?", rows)
+		rows = []
+		for val in vals:
+			evidence = evidence_codes[val[1].strip("'")]
+			rows.append((evidence, evidence_ranks[evidence], int(val[2])))
 
-	#else:
-	#	pass
+	else:
+		rows = []
 
-	#print "INSERT INTO %s %s rows" % (table, len(rows))
+	return table, rows
 
-fp.close()
+def iter_insert_lines(dump_file):
+	'''
+	read INSERT INTO statements of the needed tables from GO sql dump
+	@para dump_file str, go_monthly-assocdb-data.gz file
+	@return generator, INSERT INTO line
+	'''
+	fp = gzip.open(dump_file, 'rb')
+	for line in fp:
+		if not line.startswith("INSERT INTO"): continue
+		if get_table_name(line) in table_statements:
+			yield line
+	fp.close()
 
-print "STEP 2"
 
-#Parse uniprot idmapping file
-ID_types = set(['GI', 'NCBI_TaxID', 'GeneID', 'UniRef100', 'UniRef90', 'UniRef50', 'Gene_ORFName', 'UniProtKB-ID'])
-rows = []
-fp = gzip.open(options.u, 'rb')
-for line in fp:
-	cols = line.strip().split()
-	
-	if cols[1] in ID_types:
-		continue
-
-	rows.append((cols[2], cols[0]))
-
-	if len(rows) == 10000:
-		cur.executemany("INSERT INTO acc2uniprot VALUES (?,?)", rows)
-		rows = []
-else:
-	if rows:
-		cur.executemany("INSERT INTO acc2uniprot VALUeS (?,?)", rows)
-fp.close()
+class TableWriter(threading.Thread):
+	'''
+	Single writer thread receives parsed rows from a bounded queue and
+	writes them in large executemany batches, rows of the same table are
+	merged into one batch until the table changes or batch is full, so
+	the statement order is the same with serial parsing
+	@para conn, apsw database connection
+	@para batch_size int, maximum rows in one executemany
+	@para queue_size int, maximum parsed statements waiting in queue
+	'''
+	def __init__(self, conn, batch_size=100000, queue_size=16):
+		threading.Thread.__init__(self)
+		self.conn = conn
+		self.batch_size = batch_size
+		self.queue = Queue.Queue(queue_size)
+		self.error = None
+		self.daemon = True
+
+	def put(self, table, rows):
+		if self.error is not None:
+			raise self.error
+		self.queue.put((table, rows))
+
+	def close(self):
+		self.queue.put(None)
+		self.join()
+		if self.error is not None:
+			raise self.error
+
+	def run(self):
+		cur = self.conn.cursor()
+		table = None
+		batch = []
+
+		while True:
+			item = self.queue.get()
+			if item is None:
+				break
+
+			#discard the remaining rows after failure and wait to close
+			if self.error is not None:
+				continue
 
+			try:
+				if item[0] != table or len(batch) >= self.batch_size:
+					if batch:
+						cur.executemany(table_statements[table], batch)
+					table = item[0]
+					batch = []
 
-#Create go annotation database index
-sql = '''
-CREATE INDEX a1 ON association (gene_product_id);
-CREATE INDEX a2 ON association (id, gene_product_id);
+				batch.extend(item[1])
 
-CREATE INDEX g1 ON gene_product (dbxref_id);
-CREATE INDEX g2 ON gene_product (id, dbxref_id);
+			except Exception as e:
+				self.error = e
 
-CREATE INDEX d1 ON dbxref (xref_key);
-CREATE INDEX d2 ON dbxref (id, xref_key);
+		if batch and self.error is None:
+			try:
+				cur.executemany(table_statements[table], batch)
+			except Exception as e:
+				self.error = e
 
-CREATE INDEX u1 ON acc2uniprot (acc);
-'''
-cur.execute(sql)
+		cur.close()
+
+def load_go_associations(conn, dump_file, jobs=1, batch_size=100000):
+	'''
+	parse GO association sql dump file to sqlite database, when jobs > 1
+	use the pipelined mode: decompressing in main process, parsing values
+	in process pool and writing rows in a single writer thread
+	@para conn, apsw database connection
+	@para dump_file str, go_monthly-assocdb-data.gz file
+	@para jobs int, number of parsing processes
+	@para batch_size int, rows of each executemany in pipelined mode
+	'''
+	if jobs == 1:
+		cur = conn.cursor()
+		for line in iter_insert_lines(dump_file):
+			table, rows = parse_insert(line)
+			cur.executemany(table_statements[table], rows)
+		cur.close()
+		return
+
+	writer = TableWriter(conn, batch_size, jobs*4)
+	writer.start()
+	try:
+		for table, rows in parallel_map(parse_insert, iter_insert_lines(dump_file), jobs, jobs*4):
+			writer.put(table, rows)
+	finally:
+		writer.close()
+
+
+#columns of PIR idmapping.tb file contain accessions of other databases
+pir_columns = [2, 3, 5, 6, 8, 9, 13, 16, 17, 18, 20, 21]
+
+def iter_pir_accessions(pir_file):
+	'''
+	read accession and uniprot pairs from PIR idmapping file in file order
+	@para pir_file str, idmapping.tb.gz file
+	@return generator, tuple of accession and uniprot accession
+	'''
+	fp = gzip.open(pir_file, 'rb')
+	for line in fp:
+		cols = line.strip().split("\t")
 
+		if len(cols) != 22:
+			continue
 
-print "STEP 3"
+		for idx in pir_columns:
+			yield (cols[idx], cols[0])
+	fp.close()
 
 #Check PIR idmapping file
-def has_acc(acc):
+def has_acc(cur, acc):
 	'''
 	Check the accession is exists in database or not
 	@para acc, accession from PIR idmapping.tb file
@@ -292,29 +457,484 @@ def has_acc(acc):
 	cur.execute("SELECT 1 FROM acc2uniprot WHERE acc=?", (acc,))
 	return cur.fetchone()
 
-rows = []
-fp = gzip.open(options.p, 'rb')
-for line in fp:
-	cols = line.strip().split("\t")
-	
-	if len(cols) != 22:
-		continue
+def probe_pir_idmapping(cur, pir_file):
+	'''
+	merge PIR accessions into acc2uniprot by checking each accession
+	@para cur, apsw database cursor
+	@para pir_file str, idmapping.tb.gz file
+	'''
+	rows = []
+	for acc, uniprot in iter_pir_accessions(pir_file):
+		if not has_acc(cur, acc):
+			rows.append((acc, uniprot))
+
+		if len(rows) >= 10000:
+			cur.executemany("INSERT INTO acc2uniprot VALUES (?,?)", rows)
+			rows = []
+	else:
+		if rows:
+			cur.executemany("INSERT INTO acc2uniprot VALUES (?,?)", rows)
+
+def bulk_merge_pir_idmapping(cur, pir_file, batch_size=100000):
+	'''
+	merge PIR accessions into acc2uniprot with set based sql, all pairs are
+	loaded to a staging table, the first pair of each accession is kept and
+	accessions already in acc2uniprot are removed by an anti-join
+	@para cur, apsw database cursor
+	@para pir_file str, idmapping.tb.gz file
+	@para batch_size int, rows of each executemany
+	'''
+	cur.execute("CREATE TEMP TABLE pir_stage (acc TEXT COLLATE NOCASE, uniprot TEXT)")
+
+	rows = []
+	for row in iter_pir_accessions(pir_file):
+		rows.append(row)
+
+		if len(rows) >= batch_size:
+			cur.executemany("INSERT INTO pir_stage VALUES (?,?)", rows)
+			rows = []
+	else:
+		if rows:
+			cur.executemany("INSERT INTO pir_stage VALUES (?,?)", rows)
+
+	sql = (
+		"INSERT INTO acc2uniprot (acc, uniprot)"
+		" SELECT s.acc, s.uniprot FROM pir_stage AS s"
+		" WHERE s.rowid IN (SELECT MIN(rowid) FROM pir_stage GROUP BY acc)"
+		" AND s.acc NOT IN (SELECT acc FROM acc2uniprot)"
+		" ORDER BY s.rowid"
+	)
+	cur.execute(sql)
+	cur.execute("DROP TABLE pir_stage")
 
-	for idx in [2, 3, 5, 6, 8, 9, 13, 16, 17, 18, 20, 21]:
-		if not has_acc(cols[idx]):
-			rows.append((cols[idx], cols[0]))
 
-	if len(rows) >= 10000:
-		cur.executemany("INSERT INTO acc2uniprot VALUES (?,?)", rows)
-		rows = []
-else:
-	if rows:
-		cur.executemany("INSERT INTO acc2uniprot VALUES (?,?)", rows)
-fp.close()
+#uniprot idmapping types are not used for accession conversion
+ID_types = set(['GI', 'NCBI_TaxID', 'GeneID', 'UniRef100', 'UniRef90', 'UniRef50', 'Gene_ORFName', 'UniProtKB-ID'])
+
+def load_uniprot_idmapping(cur, idmapping_file):
+	'''
+	parse uniprot idmapping file to acc2uniprot table
+	@para cur, apsw database cursor
+	@para idmapping_file str, idmapping.dat.gz file
+	'''
+	rows = []
+	fp = gzip.open(idmapping_file, 'rb')
+	for line in fp:
+		cols = line.strip().split()
+
+		if cols[1] in ID_types:
+			continue
+
+		rows.append((cols[2], cols[0]))
+
+		if len(rows) == 10000:
+			cur.executemany("INSERT INTO acc2uniprot VALUES (?,?)", rows)
+			rows = []
+	else:
+		if rows:
+			cur.executemany("INSERT INTO acc2uniprot VALUES (?,?)", rows)
+	fp.close()
+
+#go annotation database index, the rowid is stored in each index entry, so
+#(xref_key) and (dbxref_id) also cover d.id and g.id, association index
+#covers rank, term_id and evidence for GOTermMapper join without table
+#lookup, and evidence rank filter is a range scan of each gene product
+index_sql = [
+	('a1', "CREATE INDEX a1 ON association (gene_product_id, rank, term_id, evidence)"),
+	('g1', "CREATE INDEX g1 ON gene_product (dbxref_id)"),
+	('d1', "CREATE INDEX d1 ON dbxref (xref_key)"),
+	('u1', "CREATE INDEX u1 ON acc2uniprot (acc, uniprot)")
+]
+
+def build_indexes(cur):
+	'''
+	create go annotation database index and report the time of each index
+	@para cur, apsw database cursor
+	'''
+	for name, sql in index_sql:
+		start = time.time()
+		cur.execute(sql)
+		print "CREATE INDEX %s: %.2fs" % (name, time.time() - start)
+
+def build_acc2go(cur):
+	'''
+	create the denormalized accession to GO term lookup table, GO terms of
+	dbxref keys are stored directly and accessions from NCBI, PIR etc. are
+	resolved to the GO terms of their uniprot accession, the table has no
+	rowid and is clustered on accession and evidence rank, so that the
+	minimum rank filter is a range scan
+	@para cur, apsw database cursor
+	'''
+	sql = '''
+	CREATE TABLE acc2go (
+		acc TEXT COLLATE NOCASE,
+		rank INTEGER,
+		term_id INTEGER,
+		evidence INTEGER,
+		PRIMARY KEY (acc, rank, term_id, evidence)
+	) WITHOUT ROWID;
+	INSERT OR IGNORE INTO acc2go
+		SELECT d.xref_key, a.rank, a.term_id, a.evidence FROM dbxref AS d
+		INNER JOIN gene_product AS g ON (g.dbxref_id=d.id)
+		INNER JOIN association AS a ON (a.gene_product_id=g.id)
+		ORDER BY d.xref_key;
+	INSERT OR IGNORE INTO acc2go
+		SELECT u.acc, x.rank, x.term_id, x.evidence
+		FROM (SELECT acc, MIN(uniprot) AS uniprot FROM acc2uniprot GROUP BY acc) AS u
+		INNER JOIN acc2go AS x ON (x.acc=u.uniprot)
+		WHERE u.acc NOT IN (SELECT acc FROM acc2go)
+		ORDER BY u.acc;
+	'''
+	start = time.time()
+	cur.execute(sql)
+	print "CREATE TABLE acc2go: %.2fs" % (time.time() - start)
+
+#tables with integer id are compared by chunks of rows, the source of each
+#table is the input files it is made from
+HASH_CHUNK = 4096
+hash_tables = ['term', 'association', 'gene_product', 'dbxref']
+table_sources = [('term', 'go'), ('association', 'go'), ('gene_product', 'go'),
+	('dbxref', 'go'), ('acc2uniprot', 'idmapping')]
+
+def input_digests(options):
+	'''
+	@para options, command line options with input files
+	@return dict, source name as key and (file names, digest) as value
+	'''
+	return dict(
+		go = (os.path.basename(options.g), file_digest(options.g)),
+		idmapping = ("%s %s" % (os.path.basename(options.u), os.path.basename(options.p)),
+			checkpoint_key(file_digest(options.u), file_digest(options.p)))
+	)
+
+def row_digest(row):
+	'''
+	@para row tuple, table row
+	@return int, signed 64-bit digest of row values
+	'''
+	return struct.unpack('<q', hashlib.md5(repr(row)).digest()[:8])[0]
+
+def table_digests(conn, table):
+	'''
+	calculate the digest of each chunk of rows by id, the chunk digest is the
+	sum of row digests, so that rows can be compared chunk by chunk
+	@para conn, apsw database connection
+	@para table str, table name with id column, may be prefixed by schema
+	@return tuple, dict of chunk digests and number of rows
+	'''
+	cur = conn.cursor()
+	digests = {}
+	rows = 0
+	chunk = None
+	for row in cur.execute("SELECT * FROM %s ORDER BY id" % table):
+		if row[0] // HASH_CHUNK != chunk:
+			chunk = row[0] // HASH_CHUNK
+			digests[chunk] = 0
+		digests[chunk] = (digests[chunk] + row_digest(row)) % (1 << 63)
+		rows += 1
+	cur.close()
+	return digests, rows
+
+def save_row_hashes(conn, cur):
+	'''
+	save the chunk digests of all tables with id after full build
+	@para conn, apsw database connection
+	@para cur, apsw database cursor
+	@return dict, table name as key and (inserted, deleted, changed) as value
+	'''
+	counts = {}
+	for table in hash_tables:
+		digests, rows = table_digests(conn, table)
+		cur.executemany("INSERT INTO row_hash VALUES (?,?,?)",
+			[(table, chunk, digest) for chunk, digest in digests.iteritems()])
+		counts[table] = (rows, 0, 0)
+	return counts
+
+def get_provenance(cur):
+	'''
+	@para cur, apsw database cursor
+	@return dict, table name as key and input digest of last version as value
+	'''
+	sql = "SELECT 1 FROM sqlite_master WHERE type='table' AND name='provenance'"
+	if not list(cur.execute(sql)):
+		return {}
+
+	sql = "SELECT name, digest FROM provenance ORDER BY version"
+	return {name: digest for name, digest in cur.execute(sql)}
+
+def write_provenance(cur, mode, digests, counts):
+	'''
+	add a new version and the input files and row changes of each table
+	@para cur, apsw database cursor
+	@para mode str, full or update
+	@para digests dict, made by input_digests
+	@para counts dict, table name as key and (inserted, deleted, changed) as value
+	'''
+	cur.execute("INSERT INTO version (created, mode) VALUES (?,?)",
+		(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), mode))
+	version = list(cur.execute("SELECT MAX(version) FROM version"))[0][0]
+
+	for name, source in table_sources:
+		inserted, deleted, changed = counts.get(name, (0, 0, 0))
+		cur.execute("INSERT INTO provenance VALUES (?,?,?,?,?,?,?)",
+			(version, name, digests[source][0], digests[source][1], inserted, deleted, changed))
+
+def update_table(conn, cur, table):
+	'''
+	compare the chunk digests of table in stage database with the digests of
+	previous build, only the rows in changed chunks are compared and written
+	@para conn, apsw database connection with attached stage database
+	@para cur, apsw database cursor
+	@para table str, table name with id column
+	@return tuple, number of inserted, deleted and changed rows
+	'''
+	sql = "SELECT chunk, digest FROM row_hash WHERE name=?"
+	old = {chunk: digest for chunk, digest in cur.execute(sql, (table,))}
+
+	#database made before row_hash is added, all digests are saved
+	scanned = not old
+	if scanned:
+		old, _ = table_digests(conn, "main.%s" % table)
+
+	new, _ = table_digests(conn, "stage.%s" % table)
+
+	inserted = deleted = changed = 0
+	sql = "SELECT * FROM %s.%s WHERE id BETWEEN ? AND ?"
+	for chunk in sorted(set(old) | set(new)):
+		if old.get(chunk) == new.get(chunk):
+			if scanned:
+				cur.execute("INSERT INTO row_hash VALUES (?,?,?)", (table, chunk, new[chunk]))
+			continue
+
+		bounds = (chunk * HASH_CHUNK, (chunk + 1) * HASH_CHUNK - 1)
+		old_rows = {row[0]: row for row in cur.execute(sql % ('main', table), bounds)}
+		new_rows = {row[0]: row for row in cur.execute(sql % ('stage', table), bounds)}
+
+		deletes = [(i,) for i in old_rows if i not in new_rows]
+		writes = [row for i, row in new_rows.iteritems() if old_rows.get(i) != row]
+		if deletes:
+			cur.executemany("DELETE FROM main.%s WHERE id=?" % table, deletes)
+		if writes:
+			cur.executemany("INSERT OR REPLACE INTO main.%s VALUES (%s)" % (table,
+				','.join('?'*len(writes[0]))), writes)
+
+		inserted += sum(1 for row in writes if row[0] not in old_rows)
+		changed += sum(1 for row in writes if row[0] in old_rows)
+		deleted += len(deletes)
+
+		if chunk in new:
+			cur.execute("INSERT OR REPLACE INTO row_hash VALUES (?,?,?)", (table, chunk, new[chunk]))
+		else:
+			cur.execute("DELETE FROM row_hash WHERE name=? AND chunk=?", (table, chunk))
+
+	return inserted, deleted, changed
+
+def update_acc2uniprot(cur):
+	'''
+	apply the difference of accession and uniprot pairs between stage and
+	previous database, the pairs have no id and are compared as set
+	@para cur, apsw database cursor
+	@return tuple, number of inserted, deleted and changed rows
+	'''
+	deletes = list(cur.execute("SELECT acc, uniprot FROM main.acc2uniprot"
+		" EXCEPT SELECT acc, uniprot FROM stage.acc2uniprot"))
+	inserts = list(cur.execute("SELECT acc, uniprot FROM stage.acc2uniprot"
+		" EXCEPT SELECT acc, uniprot FROM main.acc2uniprot"))
+
+	if deletes:
+		cur.executemany("DELETE FROM main.acc2uniprot WHERE acc=? AND uniprot=?", deletes)
+	if inserts:
+		cur.executemany("INSERT INTO main.acc2uniprot VALUES (?,?)", inserts)
+
+	return len(inserts), len(deletes), 0
+
+def update_database(options):
+	'''
+	update previous database with new input files, the changed inputs are
+	loaded to a stage database without index, then the changed rows are
+	found by chunk digests and written to a copy of previous database in
+	one transaction, the unchanged inputs are not parsed again
+	@para options, command line options
+	'''
+	if apsw is None:
+		raise Exception("** apsw is required for making GO association database **")
+
+	same = os.path.abspath(options.o) == os.path.abspath(options.update)
+	work_file = options.o if same else "%s.tmp" % options.o
+	stage_file = "%s.stage" % options.o
+	if os.path.exists(stage_file):
+		os.remove(stage_file)
+
+	if not same:
+		shutil.copyfile(options.update, work_file)
+
+	conn = apsw.Connection(work_file)
+	cur = conn.cursor()
+
+	#the only copy of database is updated in place, it is kept synchronous
+	#so that a crash during commit can not corrupt it
+	if same:
+		cur.execute("PRAGMA synchronous=FULL")
+	else:
+		optimize_database(cur, 'standard')
+
+	columns = [row[1] for row in cur.execute("PRAGMA table_info(association)")]
+	if 'rank' not in columns:
+		raise Exception("** No evidence rank in %s, please rebuild database **" % options.update)
+
+	previous = get_provenance(cur)
+	digests = input_digests(options)
+	go_changed = previous.get('term') != digests['go'][1]
+	map_changed = previous.get('acc2uniprot') != digests['idmapping'][1]
+
+	#load changed inputs to stage database like bulk profile
+	stage = apsw.Connection(stage_file)
+	stage_cur = stage.cursor()
+	optimize_database(stage_cur, 'bulk', options.cache_size, options.mmap_size, options.jobs)
+	stage_cur.execute("BEGIN;")
+	stage_cur.execute(table_sql)
+
+	if go_changed:
+		load_go_associations(stage, options.g, options.jobs, options.batch_size)
+
+	if map_changed:
+		load_uniprot_idmapping(stage_cur, options.u)
+		bulk_merge_pir_idmapping(stage_cur, options.p, options.batch_size)
+
+	stage_cur.execute("COMMIT;")
+	stage_cur.close()
+	stage.close()
+
+	cur.execute("ATTACH DATABASE ? AS stage", (stage_file,))
+	cur.execute("BEGIN;")
+	cur.execute(meta_sql)
+
+	counts = {}
+	if go_changed:
+		for table in hash_tables:
+			start = time.time()
+			counts[table] = update_table(conn, cur, table)
+			print "UPDATE %s: %s inserted, %s deleted, %s changed, %.2fs" % ((table,) + counts[table] + (time.time() - start,))
+
+	if map_changed:
+		start = time.time()
+		counts['acc2uniprot'] = update_acc2uniprot(cur)
+		print "UPDATE acc2uniprot: %s inserted, %s deleted, %.2fs" % (counts['acc2uniprot'][:2] + (time.time() - start,))
+
+	#acc2go is derived from all tables and made again if any row is changed
+	sql = "SELECT 1 FROM main.sqlite_master WHERE type='table' AND name='acc2go'"
+	has_acc2go = bool(list(cur.execute(sql)))
+	if any(any(count) for count in counts.itervalues()) or (options.acc2go and not has_acc2go):
+		if has_acc2go:
+			cur.execute("DROP TABLE main.acc2go")
+
+		if has_acc2go or options.acc2go:
+			build_acc2go(cur)
+
+	write_provenance(cur, 'update', digests, counts)
+	cur.execute("COMMIT;")
+	cur.execute("DETACH DATABASE stage")
+	cur.close()
+	conn.close()
+
+	os.remove(stage_file)
+	if not same:
+		os.rename(work_file, options.o)
+
+def optimize_database(cur, profile, cache_size=2048, mmap_size=4096, threads=1):
+	'''
+	use pragma command to optimize the sqlite3 database for loading
+	@para cur, apsw database cursor
+	@para profile str, standard or bulk
+	@para cache_size int, page cache size in MB for bulk profile
+	@para mmap_size int, memory map size in MB for bulk profile
+	@para threads int, auxiliary threads for sorting when create index
+	'''
+	cur.execute("PRAGMA synchronous=OFF")
+
+	if profile == 'bulk':
+		cur.execute("PRAGMA cache_size=-%d" % (cache_size*1024))
+		cur.execute("PRAGMA mmap_size=%d" % (mmap_size*1024*1024))
+		cur.execute("PRAGMA journal_mode=OFF")
+		cur.execute("PRAGMA temp_store=MEMORY")
+		cur.execute("PRAGMA threads=%d" % threads)
+
+
+def build_database(options):
+	'''
+	make a new GO association database from input files
+	@para options, command line options
+	'''
+	if apsw is None:
+		raise Exception("** apsw is required for making GO association database **")
+
+	#connect to sqlite3 database
+	conn = apsw.Connection(options.o)
+	cur = conn.cursor()
+
+	#optimize sqlite3 database speed
+	optimize_database(cur, options.profile, options.cache_size, options.mmap_size, options.jobs)
+
+	#open transaction mode
+	cur.execute("BEGIN;")
+
+	cur.execute(table_sql)
+	cur.execute(meta_sql)
+
+	#Parse GO association file to sqlite database
+	load_go_associations(conn, options.g, options.jobs, options.batch_size)
+
+	print "STEP 2"
+
+	#Parse uniprot idmapping file
+	load_uniprot_idmapping(cur, options.u)
+
+	#bulk profile defers all indexes to the end of loading
+	if options.profile == 'standard':
+		build_indexes(cur)
+
+	print "STEP 3"
+
+	#Merge PIR idmapping file
+	if options.merge == 'bulk':
+		bulk_merge_pir_idmapping(cur, options.p, options.batch_size)
+	else:
+		probe_pir_idmapping(cur, options.p)
+
+	#the deferred index build sorts acc2uniprot by itself, rewriting the
+	#table in accession order first only copies all rows once more
+	if options.profile == 'standard':
+		cur.execute("REINDEX acc2uniprot")
+
+	else:
+		build_indexes(cur)
+
+	if options.acc2go:
+		build_acc2go(cur)
+
+	#version, input files and optional row digests for incremental update,
+	#without digests the first update scans the tables of this database
+	if options.row_hashes:
+		counts = save_row_hashes(conn, cur)
+	else:
+		counts = {table: (list(cur.execute("SELECT COUNT(*) FROM %s" % table))[0][0], 0, 0)
+			for table in hash_tables}
+	counts['acc2uniprot'] = (list(cur.execute("SELECT COUNT(*) FROM acc2uniprot"))[0][0], 0, 0)
+	write_provenance(cur, 'full', input_digests(options), counts)
+
+	#complete and submit
+	cur.execute("COMMIT;")
+	cur.close()
+	conn.close()
+
+
+if __name__ == '__main__':
+	options = command_arguments()
 
-cur.execute("REINDEX acc2uniprot")
+	if options.update:
+		update_database(options)
+	else:
+		build_database(options)
 
-#complete and submit
-cur.execute("COMMIT;")
-cur.close()
-conn.close()
+	if options.columnar:
+		export_go_tables(options.o, columnar_dir(options), options.columnar, options.batch_size)
@@ -4,38 +4,169 @@ import attr
 import config
 #from db import SQLiteConnection
 from db import GODatabase
+from cache import format_stats, make_cache, merge_counters
+from utils import EvidencePolicy
+from goindex import GOIndex, is_go_index
+from goarrow import GOArrow, is_go_arrow
+
+#tables joined to search GO terms by dbxref key
+xref_tables = (
+	"association AS a"
+	" INNER JOIN gene_product AS g ON (g.id=a.gene_product_id)"
+	" INNER JOIN dbxref AS d ON (d.id=g.dbxref_id)"
+)
 
 @attr.s
-class GOTermMapper:
+class GOTermMapper(object):
 	'''
 	Get go terms and annotation evidence for a gene by using dbxref key in
 	go association database, or using NCBI, Ensembl etc. accession number
+	@para cache_size, maximum number of accessions cached, 0 to disable
+	@para cache_policy, cache eviction policy lru or arc
+	@para dbfile, GO association sqlite database, memory mapped GO index or
+	directory of parquet or arrow GO tables
+	@para readonly, open sqlite database for query only
+	@para evidence_policy, EvidencePolicy applied in sql or GO index lookup
+	@para term_ids, return integer term ids of database instead of GO term
+	accessions, the accession of id is terms[id]
 	'''
+	cache_size = attr.ib(default=100000)
+	cache_policy = attr.ib(default='lru')
+	dbfile = attr.ib(default=attr.Factory(lambda: config.GO_DB))
+	readonly = attr.ib(default=False)
+	evidence_policy = attr.ib(default=attr.Factory(EvidencePolicy))
+	term_ids = attr.ib(default=False)
+	index = attr.ib(init=False)
+	arrow = attr.ib(init=False)
 	db = attr.ib(init=False)
 	terms = attr.ib(init=False)
+	has_acc2go = attr.ib(init=False)
+	acc_cache = attr.ib(init=False)
+	uniprot_cache = attr.ib(init=False)
+
+	@index.default
+	def open_go_index(self):
+		if is_go_index(self.dbfile):
+			return GOIndex(self.dbfile)
+
+	@arrow.default
+	def load_go_arrow(self):
+		if is_go_arrow(self.dbfile):
+			return GOArrow(self.dbfile)
 
 	@db.default
 	def connect_to_db(self):
-		return GODatabase(config.GO_DB)
+		if self.index is None and self.arrow is None:
+			return GODatabase(self.dbfile, self.readonly)
 
 	@terms.default
 	def get_go_terms_id(self):
+		if self.index is not None:
+			return self.index.terms
+
+		if self.arrow is not None:
+			return self.arrow.terms
+
 		return {tid: acc for tid, acc in self.db.iter("SELECT * FROM term")}
 
+	@has_acc2go.default
+	def check_acc2go_table(self):
+		'''
+		the denormalized acc2go table is optionally built by makedb
+		'''
+		if self.db is None:
+			return False
+
+		sql = "SELECT 1 FROM sqlite_master WHERE type='table' AND name='acc2go'"
+		return self.db.get(sql) is not None
+
+	@evidence_policy.validator
+	def check_evidence_rank(self, attribute, value):
+		'''
+		evidence rank column is made by makedb since evidence policy added
+		'''
+		if not value.is_active() or is_go_index(self.dbfile) or is_go_arrow(self.dbfile):
+			return
+
+		db = GODatabase(self.dbfile, True)
+		columns = [row[1] for row in db.iter("PRAGMA table_info(association)")]
+		if 'rank' not in columns:
+			raise Exception("** No evidence rank in %s, please remake database with makedb **" % self.dbfile)
+
+	def make_sql(self, columns, tables, where, group, prefix=''):
+		'''
+		make GO term lookup sql with evidence policy conditions, only the
+		row with maximum rank of each group is selected for best evidence
+		@para columns list, selected key, term id and evidence columns
+		@para tables str, tables and joins
+		@para where str, lookup condition
+		@para group list, columns to group rows of the same GO term
+		@para prefix str, alias of association table with dot like a.
+		@return tuple, sql and bound args of evidence policy
+		'''
+		clause, args = self.evidence_policy.where(prefix)
+		if not self.evidence_policy.best:
+			sql = "SELECT DISTINCT %s FROM %s WHERE %s%s" % (', '.join(columns), tables, where, clause)
+			return sql, args
+
+		#sqlite returns the bare columns of the row with max value, the
+		#smaller evidence id is selected when ranks are the same
+		aliases = ['c%d' % i for i in xrange(len(columns))]
+		inner = "SELECT %s, MAX(%srank*256-%sevidence) FROM %s WHERE %s%s GROUP BY %s" % (
+			', '.join("%s AS %s" % c for c in zip(columns, aliases)), prefix, prefix,
+			tables, where, clause, ', '.join(group))
+		return "SELECT %s FROM (%s)" % (', '.join(aliases), inner), args
+
+	def make_terms(self, rows):
+		'''
+		@para rows, iterable (term_id, evidence) rows
+		@return list, (GO term, evidence) tuples
+		'''
+		if self.term_ids:
+			return list(rows)
+		return [(self.terms[i], e) for i, e in rows]
+
+	@acc_cache.default
+	def create_acc_cache(self):
+		return make_cache(self.cache_policy, self.cache_size)
+
+	@uniprot_cache.default
+	def create_uniprot_cache(self):
+		return make_cache(self.cache_policy, self.cache_size)
+
+	def cache_stats(self):
+		'''
+		@return str, hits, misses and evictions of the lookup caches
+		'''
+		return "GO term cache: %s\nUniprot cache: %s" % (
+			self.acc_cache.stats(), self.uniprot_cache.stats())
+
+	def cache_counters(self):
+		'''
+		@return tuple, cache name and counters of GO term and uniprot caches
+		'''
+		return (self.acc_cache.__class__.__name__, self.acc_cache.counters(),
+			self.uniprot_cache.counters())
+
 	def get_go_terms_by_xrefkey(self, xref_key):
 		'''
 		Get go terms by using dbxref key in go association database
 		@para xref_key, maybe uniprot or ncbi accession
 		@return list, contains many rows
 		'''
-		sql = (
-			"SELECT DISTINCT a.term_id, a.evidence FROM association AS a"
-			" INNER JOIN gene_product AS g ON (g.id=a.gene_product_id)"
-			" INNER JOIN dbxref AS d ON (d.id=g.dbxref_id)"
-			" WHERE d.xref_key=?"
-		)
+		sql, args = self.make_sql(['a.term_id', 'a.evidence'], xref_tables,
+			"d.xref_key=?", ['a.term_id'], 'a.')
+		return self.make_terms(self.db.iter(sql, [xref_key] + args))
 
-		return [(self.terms[i], e) for i, e in self.db.iter(sql, xref_key)]
+	def get_go_terms_by_acc2go(self, acc):
+		'''
+		Get go terms from acc2go table with one index range scan, the NCBI,
+		PIR etc. accessions have been resolved to uniprot when making db
+		@para acc str, NCBI, Ensembl or Uniprot etc. accession number
+		@return list, contains many rows
+		'''
+		sql, args = self.make_sql(['term_id', 'evidence'], "acc2go", "acc=?", ['term_id'])
+		return self.make_terms(self.db.iter(sql, [acc] + args))
 
 	def covert_acc_to_uniprot(self, acc):
 		'''
@@ -43,9 +174,17 @@ class GOTermMapper:
 		@para acc str, NCBI NR etc. accession
 		@return str if accession is exists in database or None
 		'''
-		sql = "SELECT uniprot FROM acc2uniprot WHERE acc=? LIMIT 1"
-		return self.db.get(sql, acc)
+		if self.db is None:
+			raise Exception("** Accession conversion is not supported by GO index **")
+
+		found, uniprot = self.uniprot_cache.lookup(acc)
+		if found: return uniprot
 
+		#the minimum uniprot accession like batch conversion
+		sql = "SELECT MIN(uniprot) FROM acc2uniprot WHERE acc=?"
+		uniprot = self.db.get(sql, (acc,))
+		self.uniprot_cache.store(acc, uniprot)
+		return uniprot
 
 	def get_go_terms_by_acc(self, acc):
 		'''
@@ -53,7 +192,29 @@ class GOTermMapper:
 		@para acc str, NCBI, Ensembl or Uniprot etc. accession number
 		@return list, contains many rows
 		'''
-		#first, directly search accession in dbxref database 
+		found, terms = self.acc_cache.lookup(acc)
+		if found: return terms
+
+		terms = self.search_go_terms(acc)
+		self.acc_cache.store(acc, terms)
+		return terms
+
+	def search_go_terms(self, acc):
+		'''
+		Search go terms for any accession number in database without cache
+		@para acc str, NCBI, Ensembl or Uniprot etc. accession number
+		@return list, contains many rows
+		'''
+		if self.index is not None:
+			return self.make_terms(self.index.get(acc, self.evidence_policy))
+
+		if self.arrow is not None:
+			return self.arrow.get(acc, self.evidence_policy, not self.term_ids)
+
+		if self.has_acc2go:
+			return self.get_go_terms_by_acc2go(acc)
+
+		#first, directly search accession in dbxref database
 		terms = self.get_go_terms_by_xrefkey(acc)
 		if terms: return terms
 
@@ -64,7 +225,144 @@ class GOTermMapper:
 		#use the uniprot accession to search dbxref database
 		return self.get_go_terms_by_xrefkey(uniprot)
 
+	def iter_chunks(self, sql, keys, args=(), size=500):
+		'''
+		execute sql with IN (...) clause for keys chunk by chunk to keep the
+		number of bound variables under sqlite limit
+		@para sql str, sql statement with %s for IN placeholders
+		@para keys list, values to be bound to IN clause
+		@para args list, values bound after IN clause
+		@para size int, number of keys in each chunk
+		@return generator, rows of all chunks
+		'''
+		keys = list(keys)
+		for i in xrange(0, len(keys), size):
+			chunk = keys[i:i+size]
+			for row in self.db.iter(sql % ','.join('?'*len(chunk)), chunk + list(args)):
+				yield row
+
+	def group_terms(self, rows):
+		'''
+		group (key, term_id, evidence) rows by case insensitive key like the
+		NOCASE accession column, repeated term and evidence are removed
+		@para rows, iterable rows with key, term_id and evidence
+		@return dict, lower case key and list of go terms
+		'''
+		groups = {}
+		seen = {}
+		for key, tid, evidence in rows:
+			key = key.lower()
+			term = (tid if self.term_ids else self.terms[tid], evidence)
+			if key not in groups:
+				groups[key] = []
+				seen[key] = set()
+			if term not in seen[key]:
+				seen[key].add(term)
+				groups[key].append(term)
+		return groups
+
+	def get_go_terms_for_many(self, accs):
+		'''
+		Get go terms for many accession numbers, the accessions not in cache
+		are searched in database by batch
+		@para accs list, NCBI, Ensembl or Uniprot etc. accession numbers
+		@return dict, accession as key and list of go terms as value
+		'''
+		results = {}
+		misses = []
+		for acc in set(accs):
+			found, terms = self.acc_cache.lookup(acc)
+			if found:
+				results[acc] = terms
+			else:
+				misses.append(acc)
+
+		if misses:
+			found = self.search_go_terms_for_many(misses)
+			for acc in misses:
+				self.acc_cache.store(acc, found[acc])
+			results.update(found)
+
+		return results
+
+	def covert_many_to_uniprot(self, accs):
+		'''
+		Convert many accessions to uniprot accessions by batch
+		@para accs list, NCBI NR etc. accessions
+		@return dict, accession as key and uniprot accession or None as value
+		'''
+		results = {}
+		misses = []
+		for acc in accs:
+			found, uniprot = self.uniprot_cache.lookup(acc)
+			if found:
+				results[acc] = uniprot
+			else:
+				misses.append(acc)
+
+		sql = "SELECT acc, MIN(uniprot) FROM acc2uniprot WHERE acc IN (%s) GROUP BY acc"
+		found = {acc.lower(): uniprot for acc, uniprot in self.iter_chunks(sql, misses)}
+		for acc in misses:
+			results[acc] = found.get(acc.lower())
+			self.uniprot_cache.store(acc, results[acc])
+
+		return results
+
+	def search_go_terms_for_many(self, accs):
+		'''
+		Search go terms for many accession numbers in database by chunked IN
+		queries, the accessions not in dbxref are converted to uniprot in batch
+		@para accs list, NCBI, Ensembl or Uniprot etc. accession numbers
+		@return dict, accession as key and list of go terms as value
+		'''
+		accs = set(accs)
+
+		if self.index is not None:
+			return {acc: self.search_go_terms(acc) for acc in accs}
+
+		if self.arrow is not None:
+			return self.arrow.get_many(accs, self.evidence_policy, not self.term_ids)
+
+		if self.has_acc2go:
+			sql, args = self.make_sql(['acc', 'term_id', 'evidence'], "acc2go",
+				"acc IN (%s)", ['acc', 'term_id'])
+			found = self.group_terms(self.iter_chunks(sql, accs, args))
+			return {acc: found.get(acc.lower(), []) for acc in accs}
+
+		sql, args = self.make_sql(['d.xref_key', 'a.term_id', 'a.evidence'], xref_tables,
+			"d.xref_key IN (%s)", ['d.xref_key', 'a.term_id'], 'a.')
+
+		#first, directly search accessions in dbxref database
+		found = self.group_terms(self.iter_chunks(sql, accs, args))
+		results = {acc: found.get(acc.lower(), []) for acc in accs}
+
+		#second, convert the accessions not in dbxref to uniprot
+		missing = [acc for acc in accs if not results[acc]]
+		uniprots = self.covert_many_to_uniprot(missing)
+		uniprots = {acc: uniprot for acc, uniprot in uniprots.items() if uniprot}
+		if not uniprots: return results
+
+		#use the uniprot accessions to search dbxref database
+		found = self.group_terms(self.iter_chunks(sql, set(uniprots.values()), args))
+		for acc, uniprot in uniprots.items():
+			results[acc] = found.get(uniprot.lower(), [])
+
+		return results
+
+
+def merge_cache_stats(counters):
+	'''
+	report the lookup caches of worker processes summed together
+	@para counters list, GOTermMapper.cache_counters of each worker
+	@return str, hits, misses and evictions of the lookup caches
+	'''
+	name = "%s of %d workers" % (counters[0][0], len(counters))
+	acc_counters = merge_counters([c[1] for c in counters])
+	uniprot_counters = merge_counters([c[2] for c in counters])
+	return "GO term cache: %s\nUniprot cache: %s" % (
+		format_stats(name, *acc_counters), format_stats(name, *uniprot_counters))
+
 
 if __name__ == '__main__':
-	mapper = GOTermAssignment()
-	print mapper.getGoTerms('XP_011216275.1')
\ No newline at end of file
+	mapper = GOTermMapper()
+	print mapper.get_go_terms_by_acc('XP_011216275.1')
@@ -1,7 +1,44 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import mmap
 import attr
+import struct
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from utils import atomic_open
+
+#ontology cache header: magic, version, id width, number of terms and
+#alt ids, size and modified time of obo file, number of edges, ancestors,
+#name and relation type bytes, followed by the offsets of array sections,
+#all in little endian
+CACHE_MAGIC = 'TOPAZOBO'
+CACHE_VERSION = 2
+CACHE_SECTIONS = [
+	#(name, dtype, length)
+	('ids', None, 'terms'),
+	('name_offsets', '<i8', 'terms+1'),
+	('name_blob', 'S1', 'name_blob'),
+	('namespaces', 'i1', 'terms'),
+	('obsoletes', 'u1', 'terms'),
+	('alt_ids', None, 'alts'),
+	('alt_targets', '<i4', 'alts'),
+	('parent_ptr', '<i8', 'terms+1'),
+	('parent_idx', '<i4', 'parents'),
+	('parent_type', 'i1', 'parents'),
+	('relation_blob', 'S1', 'relation_blob'),
+	('ancestor_ptr', '<i8', 'terms+1'),
+	('ancestor_idx', '<i4', 'ancestors'),
+	('levels', '<i4', 'terms'),
+	('depths', '<i4', 'terms'),
+	('order', '<i4', 'terms')
+]
+CACHE_HEADER = struct.Struct('<8sIIQQQdQQQQ%dQ' % len(CACHE_SECTIONS))
+NAMESPACES = [None, 'BP', 'CC', 'MF']
 
 @attr.s
 class Term(object):
@@ -18,6 +55,9 @@ class Term(object):
 	obsolete = attr.ib(default=False, init=False)
 	alters = attr.ib(default=attr.Factory(set), init=False)
 	parents = attr.ib(default=attr.Factory(set), init=False)
+
+	#(relation type, parent) of relationship lines like part_of, regulates
+	relationships = attr.ib(default=attr.Factory(set), init=False)
 	
 	#level, shortest distance from root node
 	level = attr.ib(default=None, init=False)
@@ -27,10 +67,41 @@ class Term(object):
 
 @attr.s
 class DAG(object):
+	'''
+	GO directed acyclic graph, terms are numbered by integer ids after
+	build, typed parent edges are kept in CSR arrays (parent_ptr,
+	parent_idx, parent_type) that the parents of term i are
+	parent_idx[parent_ptr[i]:parent_ptr[i+1]], and the ancestors of each
+	term are precomputed in the same layout
+	'''
 	terms = attr.ib(default=attr.Factory(dict), init=False)
 
+	#GO term id of each integer id and the reverse map with alt_id
+	ids = attr.ib(default=None, init=False)
+	index = attr.ib(default=None, init=False)
+
+	#terms in topological order, parents are ahead of children
+	order = attr.ib(default=None, init=False)
+
+	#relation type names, parent_type is the index of name for each edge
+	relations = attr.ib(default=None, init=False)
+	parent_ptr = attr.ib(default=None, init=False)
+	parent_idx = attr.ib(default=None, init=False)
+	parent_type = attr.ib(default=None, init=False)
+
+	#ancestor closures of relation types used by get_closure
+	closures = attr.ib(default=None, init=False)
+	ancestor_ptr = attr.ib(default=None, init=False)
+	ancestor_idx = attr.ib(default=None, init=False)
+	levels = attr.ib(default=None, init=False)
+	depths = attr.ib(default=None, init=False)
+
+	#memory map of cache file when DAG is loaded from cache
+	mm = attr.ib(default=None, init=False)
+
 	def add_term(self, term):
 		self.terms[term.ID] = term
+		self.ids = None
 
 	def get_term(self, term_id):
 		return self.terms[term_id]
@@ -45,20 +116,226 @@ class DAG(object):
 	def __contains__(self, item):
 		return item in self.terms
 
+	def build(self):
+		'''
+		Number terms and relation types, store typed parent edges in CSR
+		arrays and compute topological order, level, depth and ancestor
+		closure by is_a edges in one pass without recursion
+		'''
+		if np is None:
+			raise Exception("** numpy is required for building GO DAG **")
+
+		self.ids = sorted(self.terms)
+		self.index = {term_id: i for i, term_id in enumerate(self.ids)}
+		for term in self:
+			for alter in term.alters:
+				self.index.setdefault(alter, self.index[term.ID])
+
+		types = set(relation for term in self for relation, _ in term.relationships)
+		types.discard('is_a')
+		self.relations = ['is_a'] + sorted(types)
+		type_ids = {relation: i for i, relation in enumerate(self.relations)}
+
+		#edges of each term ordered by (parent, type), parents that are not
+		#in ontology are ignored
+		edges = []
+		for term_id in self.ids:
+			term = self.terms[term_id]
+			pairs = set((self.index[p], 0) for p in term.parents if p in self.index)
+			pairs.update((self.index[p], type_ids[r]) for r, p in term.relationships if p in self.index)
+			edges.append(sorted(pairs))
+
+		n = len(self.ids)
+		self.parent_ptr = np.zeros(n+1, dtype=np.int64)
+		np.cumsum([len(e) for e in edges], out=self.parent_ptr[1:])
+		total = int(self.parent_ptr[-1])
+		self.parent_idx = np.fromiter((p for e in edges for p, _ in e), dtype=np.int32, count=total)
+		self.parent_type = np.fromiter((r for e in edges for _, r in e), dtype=np.int8, count=total)
+
+		self.closures = {}
+		self.order, self.levels, self.depths, self.ancestor_ptr, self.ancestor_idx = self.traverse(['is_a'])
+		self.closures[('is_a',)] = (self.ancestor_ptr, self.ancestor_idx)
+
+	def select_edges(self, relations=None):
+		'''
+		Get parent CSR arrays restricted to relation types
+		@para relations list, relation types, None for is_a only
+		@return tuple, (ptr, idx) of parents
+		'''
+		if relations is None:
+			relations = ['is_a']
+
+		type_ids = [i for i, relation in enumerate(self.relations) if relation in relations]
+		n = len(self.ids)
+		children = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.parent_ptr))
+		selected = np.flatnonzero(np.in1d(self.parent_type, type_ids))
+
+		#edges are ordered by parent in each term, a parent linked by several
+		#relation types is kept once
+		keys = children[selected] * n + self.parent_idx[selected]
+		selected = selected[np.concatenate([[True], keys[1:] != keys[:-1]])[:len(keys)]]
+
+		ptr = np.zeros(n+1, dtype=np.int64)
+		np.cumsum(np.bincount(children[selected], minlength=n), out=ptr[1:])
+		return ptr, self.parent_idx[selected]
+
+	def traverse(self, relations=None):
+		'''
+		Walk DAG by Kahn algorithm generations through the edges of relation
+		types, all parents of a term are in earlier generations, so the
+		generation number is the longest distance from root
+		@para relations list, relation types, None for is_a only
+		@return tuple, order, levels, depths and ancestor (ptr, idx)
+		'''
+		parent_ptr, parent_idx = self.select_edges(relations)
+		n = len(self.ids)
+		counts = np.diff(parent_ptr)
+		children = np.repeat(np.arange(n, dtype=np.int32), counts)
+
+		levels = np.zeros(n, dtype=np.int32)
+		depths = np.zeros(n, dtype=np.int32)
+		ancestors = [None] * n
+		empty = np.empty(0, dtype=np.int32)
+		generations = []
+
+		remain = counts.copy()
+		current = np.flatnonzero(remain == 0).astype(np.int32)
+		levels[current] = 1
+		depths[current] = 1
+		for i in current:
+			ancestors[i] = empty
+
+		#sort edges by parent to find children of a generation
+		by_parent = np.argsort(parent_idx, kind='mergesort')
+		child_ptr = np.zeros(n+1, dtype=np.int64)
+		np.cumsum(np.bincount(parent_idx, minlength=n), out=child_ptr[1:])
+		child_idx = children[by_parent]
+
+		depth = 1
+		while len(current):
+			generations.append(current)
+			starts = child_ptr[current]
+			lengths = child_ptr[current+1] - starts
+			edges = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+			nodes, hits = np.unique(child_idx[edges], return_counts=True)
+			remain[nodes] -= hits
+			current = nodes[remain[nodes] == 0].astype(np.int32)
+			if not len(current):
+				break
+
+			depth += 1
+			depths[current] = depth
+
+			#level is the minimum parent level plus one
+			starts = parent_ptr[current]
+			lengths = counts[current]
+			edges = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+			offsets = np.cumsum(lengths) - lengths
+			levels[current] = np.minimum.reduceat(levels[parent_idx[edges]], offsets) + 1
+
+			#ancestors are the union of parents and ancestors of parents
+			parent_of = parent_idx[edges]
+			child_of = np.repeat(current, lengths).astype(np.int64)
+			sizes = np.array([len(ancestors[p]) for p in parent_of], dtype=np.int64)
+			pairs = np.concatenate([
+				child_of * n + parent_of,
+				np.repeat(child_of, sizes) * n + np.concatenate([ancestors[p] for p in parent_of] + [empty])
+			])
+			pairs = np.unique(pairs)
+			owners = pairs // n
+			bounds = np.searchsorted(owners, current.astype(np.int64), side='right')
+			values = (pairs % n).astype(np.int32)
+			prev = 0
+			for i, bound in zip(current, bounds):
+				ancestors[i] = values[prev:bound]
+				prev = bound
+
+		if any(a is None for a in ancestors):
+			raise Exception("** GO DAG contains cycle, the ontology file is broken **")
+
+		ancestor_ptr = np.zeros(n+1, dtype=np.int64)
+		np.cumsum([len(a) for a in ancestors], out=ancestor_ptr[1:])
+		ancestor_idx = np.concatenate(ancestors + [empty])
+		return np.concatenate(generations + [empty]), levels, depths, ancestor_ptr, ancestor_idx
+
+	def get_closure(self, relations=None):
+		'''
+		Get ancestor closure through the edges of relation types, closures
+		of relation types other than is_a are computed at first use
+		@para relations list, relation types, None for is_a only
+		@return tuple, (ptr, idx) of sorted ancestors
+		'''
+		if self.ids is None:
+			self.build()
+
+		key = tuple(sorted(set(relations or ['is_a']) & set(self.relations)))
+		if key not in self.closures:
+			self.closures[key] = self.traverse(key)[3:]
+		return self.closures[key]
+
+	def get_id(self, term_id):
+		'''
+		@para term_id str, GO term id or alternative id
+		@return int, integer id of term
+		'''
+		if self.ids is None:
+			self.build()
+		return self.index[term_id]
+
+	def get_parents(self, term_id, relations=None):
+		'''
+		@para term_id str, GO term id
+		@para relations list, relation types, None for is_a only
+		@return list, GO term ids of parents
+		'''
+		i = self.get_id(term_id)
+		start, end = self.parent_ptr[i], self.parent_ptr[i+1]
+		types = [self.relations[r] for r in self.parent_type[start:end]]
+		parents = [self.ids[j] for j, r in zip(self.parent_idx[start:end], types) if r in (relations or ['is_a'])]
+		return sorted(set(parents))
+
+	def get_relationships(self, term_id):
+		'''
+		@para term_id str, GO term id
+		@return list, (relation type, parent GO term id) tuples
+		'''
+		i = self.get_id(term_id)
+		start, end = self.parent_ptr[i], self.parent_ptr[i+1]
+		return [(self.relations[r], self.ids[j]) for j, r in zip(self.parent_idx[start:end], self.parent_type[start:end])]
+
+	def get_ancestors(self, term_id, relations=None):
+		'''
+		Get all ancestors of term in O(k) from the closure
+		@para term_id str, GO term id
+		@para relations list, relation types, None for is_a only
+		@return list, GO term ids of ancestors
+		'''
+		i = self.get_id(term_id)
+		ptr, idx = self.get_closure(relations)
+		return [self.ids[j] for j in idx[ptr[i]:ptr[i+1]]]
+
+	def is_ancestor(self, ancestor, term_id, relations=None):
+		'''
+		Check ancestor by binary search in sorted ancestor ids of term
+		@para ancestor str, GO term id of ancestor
+		@para term_id str, GO term id
+		@para relations list, relation types, None for is_a only
+		@return bool
+		'''
+		a = self.get_id(ancestor)
+		i = self.get_id(term_id)
+		ptr, idx = self.get_closure(relations)
+		row = idx[ptr[i]:ptr[i+1]]
+		k = np.searchsorted(row, a)
+		return k < len(row) and row[k] == a
+
 	def calc_term_level(self, term_id):
 		'''
 		Calculate the shortest distance from root in GO hierarchy
 		@para term_id, a term id
 		@return int, term level
 		'''
-		term = self.get_term(term_id)
-		if term.level is None:
-			if not term.parents:
-				term.level = 1
-			else:
-				term.level = min(self.calc_term_level(parent) for parent in term.parents) + 1
-
-		return term.level
+		return int(self.levels[self.get_id(term_id)])
 
 	def calc_term_depth(self, term_id):
 		'''
@@ -66,21 +343,202 @@ class DAG(object):
 		@para term_id, a term id
 		@return int, term depth
 		'''
+		return int(self.depths[self.get_id(term_id)])
 
-		term = self.get_term(term_id)
+	def calc_layers(self):
+		if self.ids is None:
+			self.build()
 
-		if term.depth is None:
-			if not term.parents:
-				term.depth = 1
-			else:
-				term.depth = max(self.calc_term_depth(parent) for parent in term.parents) + 1
+		#terms loaded from cache already have level and depth
+		if self.mm is not None:
+			return
 
-		return term.depth
+		for i, term_id in enumerate(self.ids):
+			term = self.terms[term_id]
+			term.level = int(self.levels[i])
+			term.depth = int(self.depths[i])
 
-	def calc_layers(self):
-		for term_id in self.terms:
-			self.calc_term_depth(term_id)
-			self.calc_term_level(term_id)
+	def save(self, cache_file, obo_file):
+		'''
+		Serialize terms, alt ids, parents, levels and ancestor closure to
+		binary cache, the size and modified time of obo file are recorded
+		to check whether the cache is out of date
+		@para cache_file str, output cache file
+		@para obo_file str, obo file that DAG is parsed from
+		'''
+		if self.ids is None:
+			self.build()
+
+		width = max(len(term_id) for term_id in self.index) if self.index else 1
+		n = len(self.ids)
+		names = [self.terms[term_id].name or '' for term_id in self.ids]
+		name_offsets = np.zeros(n+1, dtype='<i8')
+		np.cumsum([len(name) for name in names], out=name_offsets[1:])
+		alters = sorted((alter, i) for alter, i in self.index.iteritems() if alter not in self.terms)
+
+		arrays = dict(
+			ids = np.array(self.ids, dtype='S%d' % width),
+			name_offsets = name_offsets,
+			name_blob = np.frombuffer(''.join(names) or '\0', dtype='S1'),
+			namespaces = np.array([NAMESPACES.index(self.terms[term_id].namespace) for term_id in self.ids], dtype='i1'),
+			obsoletes = np.array([self.terms[term_id].obsolete for term_id in self.ids], dtype='u1'),
+			alt_ids = np.array([alter for alter, _ in alters], dtype='S%d' % width),
+			alt_targets = np.array([i for _, i in alters], dtype='<i4'),
+			parent_ptr = self.parent_ptr,
+			parent_idx = self.parent_idx,
+			parent_type = self.parent_type,
+			relation_blob = np.frombuffer('\n'.join(self.relations), dtype='S1'),
+			ancestor_ptr = self.ancestor_ptr,
+			ancestor_idx = self.ancestor_idx,
+			levels = self.levels,
+			depths = self.depths,
+			order = self.order
+		)
+
+		stat = os.stat(obo_file)
+		with atomic_open(cache_file, 'wb') as fh:
+			fh.write('\0' * CACHE_HEADER.size)
+			offsets = []
+			for name, dtype, _ in CACHE_SECTIONS:
+				array = arrays[name]
+				if dtype is not None:
+					array = array.astype(dtype, copy=False)
+				fh.write('\0' * (-fh.tell() % 8))
+				offsets.append(fh.tell())
+				fh.write(np.ascontiguousarray(array).tostring())
+
+			fh.seek(0)
+			fh.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, width, n,
+				len(alters), stat.st_size, stat.st_mtime, len(self.parent_idx),
+				len(self.ancestor_idx), len(arrays['name_blob']), len(arrays['relation_blob']),
+				*offsets))
+
+	@classmethod
+	def load(cls, cache_file, obo_file=None):
+		'''
+		Load DAG from binary cache through mmap, arrays are used in place
+		and terms are created when they are accessed
+		@para cache_file str, cache file made by save
+		@para obo_file str, return None if the cache is older than obo file
+		@return DAG object or None
+		'''
+		if np is None:
+			raise Exception("** numpy is required for loading GO DAG cache **")
+
+		with open(cache_file, 'rb') as fh:
+			header = CACHE_HEADER.unpack(fh.read(CACHE_HEADER.size))
+			if header[0] != CACHE_MAGIC or header[1] != CACHE_VERSION:
+				return None
+
+			width, n, num_alts, size, mtime, num_parents, num_ancestors, name_size, relation_size = header[2:11]
+			if obo_file is not None:
+				stat = os.stat(obo_file)
+				if stat.st_size != size or stat.st_mtime != mtime:
+					return None
+
+			mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+		lengths = {
+			'terms': n,
+			'terms+1': n+1,
+			'alts': num_alts,
+			'parents': num_parents,
+			'ancestors': num_ancestors,
+			'name_blob': name_size,
+			'relation_blob': relation_size
+		}
+		arrays = {}
+		for (name, dtype, length), offset in zip(CACHE_SECTIONS, header[11:]):
+			arrays[name] = np.frombuffer(mm, dtype=dtype or 'S%d' % width,
+				count=lengths[length], offset=offset)
+
+		dag = cls()
+		dag.mm = mm
+		dag.ids = arrays['ids'].tolist()
+		dag.index = dict(zip(arrays['alt_ids'].tolist(), arrays['alt_targets'].tolist()))
+		dag.index.update(zip(dag.ids, xrange(n)))
+		for name in ['parent_ptr', 'parent_idx', 'parent_type', 'ancestor_ptr', 'ancestor_idx', 'levels', 'depths', 'order']:
+			setattr(dag, name, arrays[name])
+		dag.relations = arrays['relation_blob'].tostring().split('\n')
+		dag.closures = {('is_a',): (dag.ancestor_ptr, dag.ancestor_idx)}
+		dag.terms = CachedTerms(dag, arrays)
+		return dag
+
+
+class CachedTerms(object):
+	'''
+	Read only mapping of GO term id to Term for DAG loaded from cache,
+	Term object is made from cache arrays when it is accessed
+	@para dag, DAG object loaded from cache
+	@para arrays dict, cache sections
+	'''
+	def __init__(self, dag, arrays):
+		self.dag = dag
+		self.arrays = arrays
+		self.alters = None
+
+	def __len__(self):
+		return len(self.dag.ids)
+
+	def __iter__(self):
+		return iter(self.dag.ids)
+
+	def __contains__(self, term_id):
+		i = self.dag.index.get(term_id)
+		return i is not None and self.dag.ids[i] == term_id
+
+	def __getitem__(self, term_id):
+		if term_id not in self:
+			raise KeyError(term_id)
+
+		i = self.dag.index[term_id]
+		if self.alters is None:
+			self.alters = {}
+			for alter, j in zip(self.arrays['alt_ids'].tolist(), self.arrays['alt_targets'].tolist()):
+				self.alters.setdefault(j, set()).add(alter)
+
+		offsets = self.arrays['name_offsets']
+		term = Term()
+		term.ID = term_id
+		term.name = self.arrays['name_blob'][offsets[i]:offsets[i+1]].tostring()
+		term.namespace = NAMESPACES[self.arrays['namespaces'][i]]
+		term.obsolete = bool(self.arrays['obsoletes'][i])
+		term.alters = self.alters.get(i, set())
+		term.parents = set(self.dag.get_parents(term_id))
+		term.relationships = set(r for r in self.dag.get_relationships(term_id) if r[0] != 'is_a')
+		term.level = int(self.dag.levels[i])
+		term.depth = int(self.dag.depths[i])
+		return term
+
+
+def load_ontology(obo_file, cache_file=None):
+	'''
+	Load GO DAG from binary cache next to obo file, the cache is made
+	again when obo file is changed
+	@para obo_file str, go-basic.obo file
+	@para cache_file str, cache file, default is obo file with .cache
+	@return DAG object with levels and ancestors
+	'''
+	if cache_file is None:
+		cache_file = "%s.cache" % obo_file
+
+	if os.path.isfile(cache_file):
+		dag = DAG.load(cache_file, obo_file)
+		if dag is not None:
+			return dag
+
+	dag = DAG()
+	for term in OBOParser(obo_file):
+		dag.add_term(term)
+	dag.calc_layers()
+
+	#obo file may be in a read only or shared directory, the DAG is used
+	#without cache if the cache can not be written
+	try:
+		dag.save(cache_file, obo_file)
+	except (IOError, OSError) as e:
+		print "** ontology cache %s can not be saved: %s **" % (cache_file, e)
+	return dag
 
 
 @attr.s
@@ -151,7 +609,12 @@ class OBOParser(object):
 				term.namespace = self.get_category(line[11:])
 
 			elif line[0:5] == 'is_a:':
-				term.parents.add(line[6:16])
+				term.parents.add(line[6:].split()[0])
+
+			#relationship: part_of GO:0005634 ! nucleus
+			elif line[0:13] == 'relationship:':
+				cols = line[14:].split()
+				term.relationships.add((cols[0], cols[1]))
 
 			elif line[0:12] == 'is_obsolete:':
 				term.obsolete = True
@@ -164,11 +627,7 @@ class OBOParser(object):
 
 if __name__ == '__main__':
 	obofile = r'D:\research\topaz\go-basic.obo'
-	dag = DAG()
-	for term in OBOParser(obofile):
-		dag.add_term(term)
-	
-	dag.calc_layers()
+	dag = load_ontology(obofile)
 
 	for term in dag:
 		if term.level == 2 and not term.obsolete:
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import zlib
+import time
+import Queue
+import threading
+import contextlib
+
+try:
+	import zstandard as zstd
+except ImportError:
+	zstd = None
+
+from utils import evidence_names
+
+#annotation output formats and file suffix, wide is the original output
+#file with all GO terms of query in one line
+output_formats = [
+	#(format, suffix)
+	('wide', 'txt'),
+	('long', 'long.txt'),
+	('gaf', 'gaf'),
+	('wego', 'wego.txt')
+]
+compression_suffixes = {'gzip': 'gz', 'zstd': 'zst'}
+
+#GAF aspect of GO namespace
+aspects = {'BP': 'P', 'MF': 'F', 'CC': 'C'}
+
+def output_paths(annotate_out, formats, compression=None):
+	'''
+	make output file of each format from the wide output file name, the
+	.txt extension of wide file is replaced by format suffix
+	@para annotate_out str, wide output file like query.go.txt
+	@para formats list, output formats
+	@para compression str, gzip or zstd, None for plain text
+	@return dict, format as key and output file as value
+	'''
+	suffixes = dict(output_formats)
+	root = annotate_out[:-4] if annotate_out.endswith('.txt') else annotate_out
+	paths = {}
+	for fmt in formats:
+		if fmt not in suffixes:
+			raise Exception("** output format %s is not supported **" % fmt)
+
+		paths[fmt] = annotate_out if fmt == 'wide' else "%s.%s" % (root, suffixes[fmt])
+		if compression is not None:
+			paths[fmt] = "%s.%s" % (paths[fmt], compression_suffixes[compression])
+	return paths
+
+def get_compressor(compression, level=None):
+	'''
+	@para compression str, gzip or zstd
+	@para level int, compression level, None for default level
+	@return object, compressor with compress and flush methods
+	'''
+	if compression == 'gzip':
+		#wbits 31 writes gzip header and trailer
+		return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+
+	elif compression == 'zstd':
+		if zstd is None:
+			raise Exception("** zstandard module is required for zstd output **")
+		return zstd.ZstdCompressor(level=3 if level is None else level).compressobj()
+
+	raise Exception("** compression %s is not supported **" % compression)
+
+
+class OutputWriter(object):
+	'''
+	Buffered output file, written to a temporary file and renamed to path
+	when closed. Small writes are joined to blocks of buffer size, and the
+	blocks are compressed and written by a background thread, zlib and
+	zstd release GIL when compressing so that compression runs in parallel
+	with annotation
+	@para path str, output file
+	@para compression str, gzip or zstd, None for plain text
+	@para buffer_size int, bytes of block
+	@para level int, compression level
+	'''
+	def __init__(self, path, compression=None, buffer_size=4*1024*1024, level=None):
+		self.path = path
+		self.tmp_file = "%s.tmp" % path
+		self.buffer_size = buffer_size
+		self.blocks = []
+		self.size = 0
+		self.error = None
+		self.compressor = None if compression is None else get_compressor(compression, level)
+		self.fh = open(self.tmp_file, 'wb')
+
+		#the queue is bounded so that blocks are not piled in memory
+		self.queue = Queue.Queue(4)
+		self.thread = threading.Thread(target=self.consume)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def consume(self):
+		'''
+		compress and write blocks in background thread, the blocks after
+		error are drained and dropped so that writer is not blocked
+		'''
+		while True:
+			block = self.queue.get()
+			if block is None:
+				break
+
+			if self.error is not None:
+				continue
+
+			try:
+				if self.compressor is not None:
+					block = self.compressor.compress(block)
+				self.fh.write(block)
+			except Exception as e:
+				self.error = e
+
+	def write(self, data):
+		'''
+		@para data str, text to be written, unicode is encoded by utf-8
+		'''
+		if isinstance(data, unicode):
+			data = data.encode('utf-8')
+
+		self.blocks.append(data)
+		self.size += len(data)
+		if self.size >= self.buffer_size:
+			self.flush()
+
+	def flush(self):
+		if self.error is not None:
+			raise self.error
+
+		if self.blocks:
+			self.queue.put("".join(self.blocks))
+			self.blocks = []
+			self.size = 0
+
+	def stop(self):
+		if self.thread is not None:
+			self.queue.put(None)
+			self.thread.join()
+			self.thread = None
+
+	def close(self):
+		'''
+		write remaining blocks and rename temporary file to output file
+		'''
+		self.flush()
+		self.stop()
+		if self.error is None and self.compressor is not None:
+			self.fh.write(self.compressor.flush())
+		self.fh.close()
+
+		if self.error is not None:
+			os.remove(self.tmp_file)
+			raise self.error
+
+		os.rename(self.tmp_file, self.path)
+
+	def abort(self):
+		'''
+		stop writing and remove the incomplete file
+		'''
+		self.blocks = []
+		self.stop()
+		self.fh.close()
+		if os.path.isfile(self.tmp_file):
+			os.remove(self.tmp_file)
+
+@contextlib.contextmanager
+def open_writers(paths, compression=None, buffer_size=4*1024*1024):
+	'''
+	open OutputWriter of each output file, all files are completed only
+	if no error occurs, otherwise the incomplete files are removed
+	@para paths dict, name as key and output file as value
+	@para compression str, gzip or zstd, None for plain text
+	@para buffer_size int, bytes of block of each writer
+	@return dict, name as key and OutputWriter as value
+	'''
+	writers = {}
+	try:
+		for name, path in paths.items():
+			writers[name] = OutputWriter(path, compression, buffer_size)
+		yield writers
+	except:
+		for writer in writers.values():
+			writer.abort()
+		raise
+	else:
+		for writer in writers.values():
+			writer.close()
+
+
+class AnnotationFormatter(object):
+	'''
+	Format annotations of a batch of queries to text of all output formats,
+	every format is made from the same annotations in one pass
+	wide: query and all GO terms in one line like the original output
+	long: one query, term, evidence code and score row of each GO term
+	gaf: GAF 2.1 rows, GO terms not in ontology are ignored
+	wego: WEGO native format, queries without GO terms are ignored
+	@para formats list, output formats
+	@para dag, obo.DAG object to get GO aspects of gaf format
+	@para db str, GAF DB column, the database of query identifiers
+	@para taxon int, NCBI taxonomy id of queries
+	@para object_type str, GAF DB object type like protein or transcript
+	@para reference str, GAF DB:Reference column
+	@para assigned_by str, GAF assigned by column
+	'''
+	def __init__(self, formats=('wide',), dag=None, db='topaz', taxon=1,
+		object_type='protein', reference=None, assigned_by='topaz'):
+		self.formats = list(formats)
+		for fmt in self.formats:
+			if not hasattr(self, "format_%s" % fmt):
+				raise Exception("** output format %s is not supported **" % fmt)
+
+		if 'gaf' in self.formats and dag is None:
+			raise Exception("** ontology is required for gaf output format **")
+
+		self.dag = dag
+		self.db = db
+		self.taxon = taxon
+		self.object_type = object_type
+		self.reference = reference or "%s:similarity" % db
+		self.assigned_by = assigned_by
+		self.date = time.strftime('%Y%m%d')
+
+		#the columns after DB object symbol are the same for each GO term
+		self.gaf_columns = {}
+
+	@property
+	def detailed(self):
+		'''
+		evidences and scores of GO terms are only required by long format
+		'''
+		return 'long' in self.formats
+
+	def header(self, fmt):
+		'''
+		@para fmt str, output format
+		@return str, header lines of output file
+		'''
+		if fmt == 'long':
+			return "query\tterm\tevidence\tscore\n"
+		elif fmt == 'gaf':
+			return "!gaf-version: 2.1\n!generated-by: topaz\n!date-generated: %s-%s-%s\n" % (
+				self.date[:4], self.date[4:6], self.date[6:])
+		return ""
+
+	def get_gaf_columns(self, term):
+		'''
+		@para term str, GO term id
+		@return str, GAF columns from qualifier to the end of row, None if
+		term is not in ontology
+		'''
+		if term not in self.gaf_columns:
+			columns = None
+			if term in self.dag.index:
+				aspect = aspects.get(self.dag.terms[self.dag.ids[self.dag.index[term]]].namespace)
+
+				#annotations transferred from hits are inferred from electronic annotation
+				columns = "\t%s\t%s\tIEA\t\t%s\t\t\t%s\ttaxon:%s\t%s\t%s\t\t\n" % (term,
+					self.reference, aspect, self.object_type, self.taxon, self.date, self.assigned_by)
+			self.gaf_columns[term] = columns
+		return self.gaf_columns[term]
+
+	def format(self, records):
+		'''
+		@para records list, (query, terms, evidences, scores) of each query,
+		evidences and scores are dicts of GO term or None if not available
+		@return dict, format as key and text as value
+		'''
+		return {fmt: getattr(self, "format_%s" % fmt)(records) for fmt in self.formats}
+
+	def format_wide(self, records):
+		return "".join("%s\t%s\n" % (query, "\t".join(terms))
+			for query, terms, evidences, scores in records)
+
+	def format_long(self, records):
+		lines = []
+		for query, terms, evidences, scores in records:
+			#propagated terms have no evidence and unscored terms have no score
+			codes = {term: evidence_names.get(evidence, evidence)
+				for term, evidence in (evidences or {}).iteritems()}
+			values = {term: "%.4g" % score for term, score in (scores or {}).iteritems()}
+			lines.extend("%s\t%s\t%s\t%s\n" % (query, term, codes.get(term, ''), values.get(term, ''))
+				for term in terms)
+		return "".join(lines)
+
+	def format_gaf(self, records):
+		lines = []
+		gaf_columns = self.gaf_columns
+		for query, terms, evidences, scores in records:
+			head = "%s\t%s\t%s\t" % (self.db, query, query)
+			for term in terms:
+				columns = gaf_columns.get(term, False)
+				if columns is False:
+					columns = self.get_gaf_columns(term)
+				if columns is not None:
+					lines.append(head + columns)
+		return "".join(lines)
+
+	def format_wego(self, records):
+		return "".join("%s\t%s\n" % (query, "\t".join(terms))
+			for query, terms, evidences, scores in records if terms)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+def gather_rows(ptr, idx, rows):
+	'''
+	concatenate the rows of CSR arrays without python loop
+	@para ptr, idx, CSR arrays
+	@para rows array, row numbers
+	@return tuple, length of each row and concatenated values
+	'''
+	starts = ptr[rows]
+	lengths = ptr[rows+1] - starts
+	positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+	return lengths, idx[positions]
+
+def group_keys(keys):
+	'''
+	sort keys and find the groups of equal keys
+	@para keys array, unsorted keys
+	@return tuple, sort order, unique keys, start and size of each group
+	'''
+	order = np.argsort(keys)
+	keys = keys[order]
+	starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])[:len(keys)])
+	counts = np.diff(np.append(starts, len(keys)))
+	return order, keys[starts], starts, counts
+
+def split_keys(keys, n, size):
+	'''
+	convert sorted unique query * n + term keys to CSR arrays
+	@para keys array, sorted keys
+	@para n int, number of terms
+	@para size int, number of queries
+	@return tuple, (ptr, idx) of term ids of each query
+	'''
+	ptr = np.zeros(size+1, dtype=np.int64)
+	np.cumsum(np.bincount(keys // n, minlength=size), out=ptr[1:])
+	return ptr, (keys % n).astype(np.int32)
+
+
+class TermPropagator(object):
+	'''
+	Batched true path propagation and redundancy reduction of GO term sets,
+	the term sets of all queries in a batch are kept as CSR arrays and
+	expanded by the precomputed ancestor closure of DAG in numpy
+	@para dag, obo.DAG object
+	@para relations list, relation types to propagate through, None for is_a
+	'''
+	def __init__(self, dag, relations=None):
+		if np is None:
+			raise Exception("** numpy is required for GO term propagation **")
+
+		self.dag = dag
+		self.n = len(dag)
+		self.names = np.array(dag.ids, dtype=object)
+		self.ancestor_ptr, self.ancestor_idx = dag.get_closure(relations)
+		self.parent_ptr, self.parent_idx = dag.select_edges(relations)
+
+	def encode(self, term_sets, index=None):
+		'''
+		convert GO term sets to integer ids, alternative ids are resolved
+		and terms not in ontology are ignored
+		@para term_sets list, GO term ids of each query
+		@para index dict, term handle like database term id as key and DAG
+		term id as value, None for GO term accessions
+		@return tuple, (ptr, idx) of sorted unique term ids of each query
+		'''
+		if index is None:
+			index = self.dag.index
+		keys = [q * self.n + index[term] for q, terms in enumerate(term_sets)
+			for term in terms if term in index]
+		keys = np.unique(np.array(keys, dtype=np.int64))
+		return split_keys(keys, self.n, len(term_sets))
+
+	def decode(self, ptr, idx):
+		'''
+		@para ptr, idx, CSR arrays of term ids
+		@return list, GO term ids of each query
+		'''
+		values = self.names[idx].tolist()
+		bounds = ptr.tolist()
+		return [values[bounds[q]:bounds[q+1]] for q in xrange(len(bounds)-1)]
+
+	def ancestor_keys(self, ptr, idx, parents=False):
+		'''
+		@para parents bool, only use the parents of terms
+		@return array, query * n + ancestor keys of all terms of queries
+		'''
+		queries = np.repeat(np.arange(len(ptr)-1, dtype=np.int64), np.diff(ptr))
+		if parents:
+			lengths, ancestors = gather_rows(self.parent_ptr, self.parent_idx, idx)
+		else:
+			lengths, ancestors = gather_rows(self.ancestor_ptr, self.ancestor_idx, idx)
+		return np.repeat(queries, lengths) * self.n + ancestors
+
+	def propagate_ids(self, ptr, idx):
+		'''
+		true path propagation, add all ancestors of terms up to the roots
+		@para ptr, idx, CSR arrays of term ids
+		@return tuple, CSR arrays of propagated term ids
+		'''
+		queries = np.repeat(np.arange(len(ptr)-1, dtype=np.int64), np.diff(ptr))
+		keys = np.concatenate([queries * self.n + idx, self.ancestor_keys(ptr, idx)])
+		return split_keys(np.unique(keys), self.n, len(ptr)-1)
+
+	def reduce_ids(self, ptr, idx, closed=False):
+		'''
+		remove terms that are ancestors of other terms in the same query,
+		only the most specific terms are kept
+		@para ptr, idx, CSR arrays of term ids
+		@para closed bool, the term sets contain all ancestors of their
+		terms, so that a term is redundant if one of its children is in set
+		and only the parents of terms are searched
+		@return tuple, CSR arrays of reduced term ids
+		'''
+		queries = np.repeat(np.arange(len(ptr)-1, dtype=np.int64), np.diff(ptr))
+		keys = queries * self.n + idx
+		if not len(keys):
+			return ptr, idx
+
+		#keys are sorted, the ancestors are searched in keys without sorting
+		#the much larger ancestor array
+		ancestors = self.ancestor_keys(ptr, idx, closed)
+		found = np.minimum(np.searchsorted(keys, ancestors), len(keys)-1)
+		redundant = np.zeros(len(keys), dtype=bool)
+		redundant[found[keys[found] == ancestors]] = True
+		return split_keys(keys[~redundant], self.n, len(ptr)-1)
+
+	def propagate(self, term_sets, index=None):
+		'''
+		@para term_sets list, GO term ids of each query
+		@para index dict, term handle to DAG term id, see encode
+		@return list, propagated GO term ids of each query
+		'''
+		return self.decode(*self.propagate_ids(*self.encode(term_sets, index)))
+
+	def reduce(self, term_sets, index=None):
+		'''
+		@para term_sets list, GO term ids of each query
+		@para index dict, term handle to DAG term id, see encode
+		@return list, most specific GO term ids of each query
+		'''
+		return self.decode(*self.reduce_ids(*self.encode(term_sets, index)))
@@ -1 +1,823 @@
 #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import gzip
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import unittest
+import StringIO
+import collections
+
+import config
+from utils import EvidencePolicy, SymbolTable
+from output import AnnotationFormatter, open_writers, output_paths
+from obo import DAG, OBOParser, load_ontology
+from mapping import GOTermMapper
+from checkpoint import Checkpoint, checkpoint_key
+from propagation import TermPropagator
+from goindex import build_go_index
+from goarrow import export_go_tables
+
+#makedb requires apsw
+try:
+	import apsw
+	import makedb
+except ImportError:
+	makedb = None
+
+#alignment tools are resolved by sh when command module is imported, the
+#synthetic data generators import alignment and annotation
+try:
+	import alignment
+	import annotation
+	import benchmark
+except (ImportError, AttributeError):
+	alignment = annotation = benchmark = None
+
+#tiny ontology, GO:0000005 is part of GO:0000003 and GO:0000099 is the
+#alternative id of GO:0000004
+#
+#  GO:0000001 (BP root)             GO:0000010 (MF root)
+#   |-- GO:0000002                   |-- GO:0000011
+#   |    |-- GO:0000003
+#   |    |-- GO:0000004
+#   |-- GO:0000005 (part_of GO:0000003)
+OBO = '''format-version: 1.2
+ontology: go
+
+[Term]
+id: GO:0000001
+name: biological_process
+namespace: biological_process
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! biological_process
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000002 ! a
+
+[Term]
+id: GO:0000004
+name: c
+namespace: biological_process
+alt_id: GO:0000099
+is_a: GO:0000002 ! a
+
+[Term]
+id: GO:0000005
+name: d
+namespace: biological_process
+is_a: GO:0000001 ! biological_process
+relationship: part_of GO:0000003 ! b
+
+[Term]
+id: GO:0000010
+name: molecular_function
+namespace: molecular_function
+
+[Term]
+id: GO:0000011
+name: e
+namespace: molecular_function
+is_a: GO:0000010 ! molecular_function
+
+[Typedef]
+id: part_of
+name: part of
+'''
+
+#tiny GO association database, evidence ids are EXP 1, ISS 7, ND 20 and
+#IEA 21 with rank 5, 3, 1 and 1, XP_000001.1 is converted to the minimum
+#uniprot accession P11111 of its case insensitive rows
+GO_DB_SQL = '''
+CREATE TABLE term (id INTEGER PRIMARY KEY, acc TEXT);
+CREATE TABLE association (id INTEGER PRIMARY KEY, term_id INTEGER,
+	gene_product_id INTEGER, evidence INTEGER, rank INTEGER);
+CREATE TABLE gene_product (id INTEGER PRIMARY KEY, dbxref_id INTEGER);
+CREATE TABLE dbxref (id INTEGER PRIMARY KEY, xref_key TEXT COLLATE NOCASE);
+CREATE TABLE acc2uniprot (acc TEXT COLLATE NOCASE, uniprot TEXT);
+INSERT INTO term VALUES (1,'GO:0000003'),(2,'GO:0000004'),(3,'GO:0000005'),(4,'GO:0000011');
+INSERT INTO dbxref VALUES (1,'P11111'),(2,'Q22222');
+INSERT INTO gene_product VALUES (10,1),(20,2);
+INSERT INTO association VALUES (1,1,10,1,5),(2,1,10,21,1),(3,2,10,21,1),(4,3,20,7,3),(5,4,20,20,1);
+INSERT INTO acc2uniprot VALUES ('xp_000001.1','Q22222'),('XP_000001.1','P11111'),('NP_000002.1','Q22222');
+'''
+
+def make_options(**kwargs):
+	'''
+	@para kwargs, makedb command line options to be changed
+	@return argparse.Namespace, makedb options with default values
+	'''
+	options = dict(g=None, u=None, p=None, o=None, jobs=1, batch_size=1000,
+		merge='bulk', profile='standard', cache_size=64, mmap_size=64,
+		acc2go=True, columnar=None, update=None, row_hashes=False)
+	options.update(kwargs)
+	return argparse.Namespace(**options)
+
+def dump_tables(db_file):
+	'''
+	@para db_file str, GO association database
+	@return dict, table name as key and sorted rows as value
+	'''
+	conn = sqlite3.connect(db_file)
+	tables = {}
+	for table in ['term', 'association', 'gene_product', 'dbxref', 'acc2go']:
+		tables[table] = sorted(conn.execute("SELECT * FROM %s" % table))
+	tables['acc2uniprot'] = sorted(set(conn.execute("SELECT acc, uniprot FROM acc2uniprot")))
+	conn.close()
+	return tables
+
+def make_go_db(db_file):
+	'''
+	@para db_file str, tiny GO association database to be made
+	'''
+	conn = sqlite3.connect(db_file)
+	conn.executescript(GO_DB_SQL)
+	conn.commit()
+	conn.close()
+
+def read_file(path):
+	opener = gzip.open if path.endswith('.gz') else open
+	with opener(path, 'rb') as fh:
+		return fh.read()
+
+def write_file(path, text):
+	with open(path, 'w') as fh:
+		fh.write(text)
+
+#alignment of hand checked annotator cases
+Hit = collections.namedtuple('Hit', ['query', 'subject', 'identity', 'evalue'])
+
+def make_hit(query, subject, identity=90.0, evalue=1e-30, score=200.0):
+	'''
+	@return str, line of tabular alignment output
+	'''
+	return "%s\t%s\t%s\t100\t0\t0\t1\t100\t1\t100\t%s\t%s\n" % (query, subject,
+		identity, evalue, score)
+
+
+@unittest.skipIf(alignment is None, "alignment tools are not installed")
+class AlignmentParserTest(unittest.TestCase):
+	'''
+	hits are grouped by query and filtered before records are made
+	'''
+	def parse(self, lines, **kwargs):
+		return list(alignment.AlignmentParaser(StringIO.StringIO(''.join(lines)), **kwargs))
+
+	def test_group_by_query(self):
+		lines = ['# comment\n', make_hit('q1', 's1'), make_hit('q1', 's2'), '\n',
+			'# comment\n', make_hit('q2', 's3'), '\n', '\n']
+		groups = self.parse(lines)
+		self.assertEqual([[(a.query, a.subject) for a in g] for g in groups],
+			[[('q1', 's1'), ('q1', 's2')], [('q2', 's3')]])
+		self.assertEqual(groups[0][0].identity, 90.0)
+		self.assertEqual(groups[0][0].evalue, 1e-30)
+
+	def test_trailing_blank_line_with_max_hits(self):
+		lines = [make_hit('q1', 's1', score=100), make_hit('q1', 's2', score=300),
+			make_hit('q1', 's2', score=50), make_hit('q2', 's3'), '\n']
+		groups = self.parse(lines, max_hits=1)
+		self.assertEqual([[a.subject for a in g] for g in groups], [['s2', 's2'], ['s3']])
+
+	def test_filters(self):
+		lines = [make_hit('q1', 's1', evalue=1e-3), make_hit('q1', 's2', identity=20),
+			make_hit('q2', 's3', score=100), make_hit('q2', 's4', score=60),
+			make_hit('q3', 's5', evalue=1)]
+		groups = self.parse(lines, max_evalue=1e-5, min_identity=30, score_dropoff=0.2)
+		self.assertEqual([[a.subject for a in g] for g in groups], [['s3']])
+
+	def test_filters_before_ranking(self):
+		#dropoff and max hits only rank the alignments passed row filters
+		lines = [make_hit('q1', 's1', evalue=1, score=900), make_hit('q1', 's2', score=100),
+			make_hit('q1', 's3', score=85), make_hit('q1', 's4', score=40),
+			make_hit('q2', 's5', score=40)]
+		groups = self.parse(lines, max_evalue=1e-5, min_score=50, score_dropoff=0.2, max_hits=1)
+		self.assertEqual([[a.subject for a in g] for g in groups], [['s2']])
+
+	def test_symbols(self):
+		symbols = SymbolTable()
+		lines = [make_hit('q1', 's1'), make_hit('q2', 's2'), make_hit('q2', 's1')]
+		groups = self.parse(lines, columns=['subject', 'evalue'], symbols=symbols)
+		self.assertEqual([[a.subject for a in g] for g in groups], [[0], [1, 0]])
+		self.assertEqual(symbols.names, ['s1', 's2'])
+
+
+class OntologyTest(unittest.TestCase):
+	'''
+	obo parsing, DAG closure and binary cache of ontology
+	'''
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.obo_file = os.path.join(self.tmpdir, 'go-basic.obo')
+		write_file(self.obo_file, OBO)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def check_dag(self, dag):
+		self.assertEqual(len(dag), 7)
+		self.assertEqual(dag.get_id('GO:0000099'), dag.get_id('GO:0000004'))
+		self.assertEqual(dag.get_parents('GO:0000005'), ['GO:0000001'])
+		self.assertEqual(sorted(dag.get_ancestors('GO:0000004')), ['GO:0000001', 'GO:0000002'])
+		self.assertEqual(dag.get_parents('GO:0000005', ['part_of']), ['GO:0000003'])
+		self.assertEqual(sorted(dag.get_ancestors('GO:0000005', ['is_a', 'part_of'])),
+			['GO:0000001', 'GO:0000002', 'GO:0000003'])
+
+		term = dag.terms['GO:0000003']
+		self.assertEqual((term.name, term.namespace, term.level, term.depth), ('b', 'BP', 3, 3))
+		self.assertEqual(dag.terms['GO:0000011'].namespace, 'MF')
+		self.assertEqual(dag.terms['GO:0000004'].alters, set(['GO:0000099']))
+
+	def parse(self):
+		dag = DAG()
+		for term in OBOParser(self.obo_file):
+			dag.add_term(term)
+		dag.calc_layers()
+		return dag
+
+	def test_parse(self):
+		self.check_dag(self.parse())
+
+	def test_cache(self):
+		dag = load_ontology(self.obo_file)
+		self.assertTrue(dag.mm is None)
+		self.check_dag(dag)
+
+		dag = DAG.load("%s.cache" % self.obo_file, self.obo_file)
+		self.assertTrue(dag is not None)
+		self.check_dag(dag)
+
+		#changed obo file makes the cache out of date
+		write_file(self.obo_file, OBO.replace('name: e\n', 'name: f\n'))
+		stat = os.stat(self.obo_file)
+		os.utime(self.obo_file, (stat.st_atime, stat.st_mtime + 10))
+		self.assertTrue(DAG.load("%s.cache" % self.obo_file, self.obo_file) is None)
+
+		dag = load_ontology(self.obo_file)
+		self.assertEqual(dag.terms['GO:0000011'].name, 'f')
+		self.assertTrue(load_ontology(self.obo_file).mm is not None)
+
+	def test_unwritable_cache(self):
+		cache_file = os.path.join(self.tmpdir, 'missing', 'go.cache')
+		self.check_dag(load_ontology(self.obo_file, cache_file))
+		self.assertFalse(os.path.exists(cache_file))
+
+
+class PropagationTest(unittest.TestCase):
+	'''
+	batched true path propagation and reduction of term sets
+	'''
+	@classmethod
+	def setUpClass(cls):
+		cls.tmpdir = tempfile.mkdtemp()
+		obo_file = os.path.join(cls.tmpdir, 'go-basic.obo')
+		write_file(obo_file, OBO)
+		cls.dag = load_ontology(obo_file)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.tmpdir)
+
+	def test_propagate(self):
+		propagator = TermPropagator(self.dag)
+		self.assertEqual(propagator.propagate([['GO:0000099'], ['GO:0000005', 'GO:0000011'], ['GO:9999999'], []]), [
+			['GO:0000001', 'GO:0000002', 'GO:0000004'],
+			['GO:0000001', 'GO:0000005', 'GO:0000010', 'GO:0000011'],
+			[], []
+		])
+
+	def test_propagate_relations(self):
+		propagator = TermPropagator(self.dag, ['is_a', 'part_of'])
+		self.assertEqual(propagator.propagate([['GO:0000005']]),
+			[['GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000005']])
+
+	def test_reduce(self):
+		propagator = TermPropagator(self.dag)
+		self.assertEqual(propagator.reduce([['GO:0000001', 'GO:0000002', 'GO:0000004', 'GO:0000011'],
+			['GO:0000003', 'GO:0000005']]), [['GO:0000004', 'GO:0000011'], ['GO:0000003', 'GO:0000005']])
+
+		propagator = TermPropagator(self.dag, ['is_a', 'part_of'])
+		self.assertEqual(propagator.reduce([['GO:0000003', 'GO:0000005']]), [['GO:0000005']])
+
+	def test_index(self):
+		propagator = TermPropagator(self.dag)
+		index = {7: self.dag.index['GO:0000003']}
+		self.assertEqual(propagator.propagate([[7, 8]], index), [['GO:0000001', 'GO:0000002', 'GO:0000003']])
+
+
+class MapperBackendTest(unittest.TestCase):
+	'''
+	every GO term lookup backend returns the same terms under evidence
+	policies, single and batch lookups are the same
+	'''
+	accs = ['P11111', 'p11111', 'XP_000001.1', 'NP_000002.1', 'UNKNOWN']
+
+	@classmethod
+	def setUpClass(cls):
+		cls.tmpdir = tempfile.mkdtemp()
+		cls.backends = {}
+
+		db_file = cls.backends['sqlite'] = os.path.join(cls.tmpdir, 'go.db')
+		make_go_db(db_file)
+		for fmt in ['parquet', 'arrow']:
+			cls.backends[fmt] = os.path.join(cls.tmpdir, 'go.%s' % fmt)
+			export_go_tables(db_file, cls.backends[fmt], fmt)
+
+		#acc2go table is made by makedb
+		if makedb is not None:
+			acc2go_file = cls.backends['acc2go'] = os.path.join(cls.tmpdir, 'acc2go.db')
+			make_go_db(acc2go_file)
+			conn = makedb.apsw.Connection(acc2go_file)
+			cur = conn.cursor()
+			makedb.build_acc2go(cur)
+			cur.close()
+			conn.close()
+
+			cls.backends['index'] = os.path.join(cls.tmpdir, 'go.index')
+			build_go_index(acc2go_file, cls.backends['index'])
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.tmpdir)
+
+	def check_backends(self, expected, **kwargs):
+		for name, path in sorted(self.backends.items()):
+			mapper = GOTermMapper(cache_size=0, dbfile=path, **kwargs)
+			found = mapper.get_go_terms_for_many(self.accs)
+			for acc in self.accs:
+				self.assertEqual(sorted(found[acc]), expected[acc], "%s %s" % (name, acc))
+				self.assertEqual(sorted(mapper.get_go_terms_by_acc(acc)), expected[acc], "%s %s" % (name, acc))
+
+	def make_expected(self, p11111, q22222):
+		'''
+		@para p11111 list, GO terms of P11111
+		@para q22222 list, GO terms of Q22222
+		@return dict, expected GO terms of accessions
+		'''
+		return {'P11111': p11111, 'p11111': p11111, 'XP_000001.1': p11111,
+			'NP_000002.1': q22222, 'UNKNOWN': []}
+
+	def test_all_evidences(self):
+		self.check_backends(self.make_expected(
+			[('GO:0000003', 1), ('GO:0000003', 21), ('GO:0000004', 21)],
+			[('GO:0000005', 7), ('GO:0000011', 20)]))
+
+	def test_exclude(self):
+		self.check_backends(self.make_expected([('GO:0000003', 1)], [('GO:0000005', 7), ('GO:0000011', 20)]),
+			evidence_policy=EvidencePolicy(exclude=['IEA']))
+
+	def test_min_rank(self):
+		self.check_backends(self.make_expected([('GO:0000003', 1)], [('GO:0000005', 7)]),
+			evidence_policy=EvidencePolicy(min_rank=3))
+
+	def test_best(self):
+		self.check_backends(self.make_expected([('GO:0000003', 1), ('GO:0000004', 21)],
+			[('GO:0000005', 7), ('GO:0000011', 20)]), evidence_policy=EvidencePolicy(best=True))
+
+	def test_term_ids(self):
+		mapper = GOTermMapper(cache_size=0, dbfile=self.backends['sqlite'], term_ids=True)
+		self.assertEqual(sorted(mapper.get_go_terms_by_acc('NP_000002.1')), [(3, 7), (4, 20)])
+		self.assertEqual(mapper.terms[3], 'GO:0000005')
+
+	def test_repeated_rows(self):
+		#repeated accessions of batch and repeated association rows
+		conn = sqlite3.connect(self.backends['sqlite'])
+		conn.execute("INSERT INTO association VALUES (6,1,10,1,5)")
+		conn.commit()
+		try:
+			mapper = GOTermMapper(cache_size=0, dbfile=self.backends['sqlite'])
+			found = mapper.get_go_terms_for_many(['P11111', 'P11111', 'p11111'])
+			self.assertEqual(found['P11111'], [('GO:0000003', 1), ('GO:0000003', 21), ('GO:0000004', 21)])
+			self.assertEqual(found['p11111'], found['P11111'])
+		finally:
+			conn.execute("DELETE FROM association WHERE id=6")
+			conn.commit()
+			conn.close()
+
+
+@unittest.skipIf(annotation is None, "alignment tools are not installed")
+class AnnotatorTest(unittest.TestCase):
+	'''
+	annotator scores of tiny cases checked by hand
+	'''
+	@classmethod
+	def setUpClass(cls):
+		cls.tmpdir = tempfile.mkdtemp()
+		cls.obo_file = os.path.join(cls.tmpdir, 'go-basic.obo')
+		write_file(cls.obo_file, OBO)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.tmpdir)
+
+	def assertAnnotated(self, annotated, expected):
+		self.assertEqual(len(annotated), len(expected))
+		for terms, expected_terms in zip(annotated, expected):
+			self.assertEqual([term for term, score in terms], [term for term, score in expected_terms])
+			for (_, score), (_, expected_score) in zip(terms, expected_terms):
+				self.assertAlmostEqual(score, expected_score)
+
+	def test_blast2go(self):
+		annotator = annotation.Blast2goAnnotator(go_mapper=None, obo_file=self.obo_file)
+		acc_terms = {
+			's1': [('GO:0000003', 1)],
+			's2': [('GO:0000004', 21)],
+			's3': [('GO:0000003', 1), ('GO:0000004', 1)],
+			's4': [('GO:0000004', 1), ('GO:0000011', 1)],
+			's5': []
+		}
+		groups = [
+			[Hit('q1', 's1', 80, 0), Hit('q1', 's2', 60, 0)],
+			[Hit('q2', 's3', 50, 0), Hit('q2', 's4', 30, 0)],
+			[Hit('q3', 's5', 100, 0)]
+		]
+
+		#q1: direct scores GO:0000003 80*1.0 and GO:0000004 60*0.2, AR of
+		#GO:0000002 and root is 80+5 but the lowest passed term is GO:0000003
+		#q2: direct scores of both children are 50, only GO:0000002 and root
+		#with AR 50+5 pass threshold 55, MF terms score 30
+		self.assertAnnotated(annotator.annotate_groups(groups, acc_terms), [
+			[('GO:0000003', 80)],
+			[('GO:0000002', 55)],
+			[]
+		])
+
+	def test_gotcha(self):
+		acc_terms = {
+			's1': [('GO:0000003', 1)],
+			's2': [('GO:0000004', 21)],
+			's3': [('GO:0000004', 21)],
+			's6': [('GO:0000005', 1)]
+		}
+		groups = [
+			[Hit('q1', 's1', 0, 1e-12), Hit('q1', 's2', 0, 1e-7), Hit('q1', 's3', 0, 1)],
+			[Hit('q2', 's1', 0, 1e-12), Hit('q2', 's6', 0, 1e-7)]
+		]
+
+		#hit scores are 10, 5 and 0, q1: R-scores of GO:0000003, GO:0000004
+		#and root are 10, 5 and 15, C-score of GO:0000003 is 10/15
+		#q2: GO:0000005 only reaches GO:0000003 by part_of, C-score of
+		#GO:0000003 is 10/15 by is_a and 15/15 by is_a and part_of
+		annotator = annotation.GotchaAnnotator(go_mapper=None, obo_file=self.obo_file)
+		self.assertAnnotated(annotator.annotate_groups(groups, acc_terms), [
+			[('GO:0000003', 10/15.0)],
+			[('GO:0000003', 10/15.0)]
+		])
+
+		annotator = annotation.GotchaAnnotator(go_mapper=None, obo_file=self.obo_file, relations=['part_of'])
+		self.assertAnnotated(annotator.annotate_groups(groups, acc_terms), [
+			[('GO:0000003', 10/15.0)],
+			[('GO:0000003', 1.0)]
+		])
+
+
+class OutputFormatTest(unittest.TestCase):
+	'''
+	all output formats made from the same annotations
+	'''
+	@classmethod
+	def setUpClass(cls):
+		cls.tmpdir = tempfile.mkdtemp()
+		obo_file = os.path.join(cls.tmpdir, 'go-basic.obo')
+		write_file(obo_file, OBO)
+		cls.dag = load_ontology(obo_file)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.tmpdir)
+
+	def test_formats(self):
+		formatter = AnnotationFormatter(['wide', 'long', 'gaf', 'wego'], self.dag, taxon=9606)
+		records = [
+			('q1', ['GO:0000003', 'GO:0000011', 'GO:9999999'], {'GO:0000003': 1}, {'GO:0000003': 2/3.0}),
+			('q2', [], None, None)
+		]
+		texts = formatter.format(records)
+		self.assertEqual(texts['wide'], "q1\tGO:0000003\tGO:0000011\tGO:9999999\nq2\t\n")
+		self.assertEqual(texts['wego'], "q1\tGO:0000003\tGO:0000011\tGO:9999999\n")
+		self.assertEqual(texts['long'], "q1\tGO:0000003\tEXP\t0.6667\n"
+			"q1\tGO:0000011\t\t\nq1\tGO:9999999\t\t\n")
+
+		#terms not in ontology are not written to gaf
+		columns = "\ttopaz:similarity\tIEA\t\t%s\t\t\tprotein\ttaxon:9606\t%s\ttopaz\t\t\n"
+		self.assertEqual(texts['gaf'],
+			"topaz\tq1\tq1\t\tGO:0000003" + columns % ('P', formatter.date) +
+			"topaz\tq1\tq1\t\tGO:0000011" + columns % ('F', formatter.date))
+		self.assertTrue(formatter.header('gaf').startswith("!gaf-version: 2.1\n"))
+		self.assertEqual(formatter.header('long'), "query\tterm\tevidence\tscore\n")
+
+	def test_output_paths(self):
+		self.assertEqual(output_paths('q.go.txt', ['wide', 'long', 'gaf', 'wego']), {
+			'wide': 'q.go.txt', 'long': 'q.go.long.txt', 'gaf': 'q.go.gaf', 'wego': 'q.go.wego.txt'})
+		self.assertEqual(output_paths('q.go.txt', ['wide', 'gaf'], 'gzip'),
+			{'wide': 'q.go.txt.gz', 'gaf': 'q.go.gaf.gz'})
+
+	def test_writers(self):
+		paths = output_paths(os.path.join(self.tmpdir, 'q.go.txt'), ['wide', 'wego'], 'gzip')
+		with open_writers(paths, 'gzip', buffer_size=8) as writers:
+			for i in xrange(100):
+				writers['wide'].write("q%d\tGO:0000003\n" % i)
+			writers['wego'].write(u"q\tGO:0000003\n")
+		self.assertEqual(read_file(paths['wide']), ''.join("q%d\tGO:0000003\n" % i for i in xrange(100)))
+		self.assertEqual(read_file(paths['wego']), "q\tGO:0000003\n")
+
+		#incomplete files are removed when writing fails
+		paths = output_paths(os.path.join(self.tmpdir, 'failed.txt'), ['wide'])
+		with self.assertRaises(ValueError):
+			with open_writers(paths) as writers:
+				writers['wide'].write("q1\n")
+				raise ValueError()
+		self.assertFalse(os.path.exists(paths['wide']))
+		self.assertFalse(os.path.exists("%s.tmp" % paths['wide']))
+
+
+@unittest.skipIf(annotation is None, "alignment tools are not installed")
+class CheckpointTest(unittest.TestCase):
+	'''
+	checkpointed annotation writes the same outputs, completed batches are
+	skipped by resume and changed inputs are annotated again
+	'''
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.go_db = config.GO_DB
+		config.GO_DB = os.path.join(self.tmpdir, 'go.db')
+		make_go_db(config.GO_DB)
+
+		self.align_file = os.path.join(self.tmpdir, 'query.diamond.txt')
+		write_file(self.align_file, ''.join([make_hit('q1', 'P11111'), make_hit('q2', 'NP_000002.1'),
+			make_hit('q2', 'XP_000001.1'), make_hit('q3', 'UNKNOWN'), make_hit('q4', 'p11111')]))
+
+	def tearDown(self):
+		config.GO_DB = self.go_db
+		shutil.rmtree(self.tmpdir)
+
+	def annotate(self, name, **kwargs):
+		out_file = os.path.join(self.tmpdir, name)
+		annotation.GoAnnotation(self.align_file, out_file, batch_size=2, **kwargs)
+		return out_file
+
+	def test_checkpoint(self):
+		expected = read_file(self.annotate('plain.txt'))
+		self.assertEqual(len(expected.splitlines()), 4)
+		self.assertEqual(expected.splitlines()[2], 'q3\t')
+
+		out_file = self.annotate('query.go.txt', checkpoint_key='k1')
+		self.assertEqual(read_file(out_file), expected)
+		self.assertFalse(os.path.exists("%s.parts" % out_file))
+		self.assertTrue(Checkpoint(self.tmpdir, 'k1').is_done('query.go.txt'))
+		self.assertFalse(Checkpoint(self.tmpdir, 'k2').is_done('query.go.txt'))
+
+		#completed output is not annotated again with the same key
+		write_file(out_file, 'done\n')
+		self.annotate('query.go.txt', checkpoint_key='k1')
+		self.assertEqual(read_file(out_file), 'done\n')
+
+		#changed key or disabled resume annotates again
+		self.annotate('query.go.txt', checkpoint_key='k2')
+		self.assertEqual(read_file(out_file), expected)
+		write_file(out_file, 'done\n')
+		self.annotate('query.go.txt', checkpoint_key='k2', resume=False)
+		self.assertEqual(read_file(out_file), expected)
+
+	def test_resume_parts(self):
+		expected = read_file(self.annotate('plain.txt')).splitlines(True)
+
+		#interrupted run completed the first batch of two queries
+		out_file = os.path.join(self.tmpdir, 'query.go.txt')
+		part_dir = "%s.parts" % out_file
+		os.makedirs(part_dir)
+		checkpoint = Checkpoint(part_dir, checkpoint_key('k1', 2, ['wide']))
+		write_file(os.path.join(part_dir, 'part_000000.wide'), 'q1\tresumed\nq2\tresumed\n')
+		checkpoint.mark_done('part_000000')
+
+		#the second batch is not completed and annotated
+		write_file(os.path.join(part_dir, 'part_000001.wide'), 'incomplete\n')
+
+		#only the subjects of annotated batch are looked up
+		lookups = []
+		get_go_terms_for_many = GOTermMapper.get_go_terms_for_many
+		def record_lookup(mapper, accs):
+			lookups.append(list(accs))
+			return get_go_terms_for_many(mapper, accs)
+
+		GOTermMapper.get_go_terms_for_many = record_lookup
+		try:
+			self.annotate('query.go.txt', checkpoint_key='k1')
+		finally:
+			GOTermMapper.get_go_terms_for_many = get_go_terms_for_many
+
+		self.assertEqual(lookups, [['UNKNOWN', 'p11111']])
+		self.assertEqual(read_file(out_file), 'q1\tresumed\nq2\tresumed\n' + ''.join(expected[2:]))
+		self.assertFalse(os.path.exists(part_dir))
+
+	def test_formats(self):
+		obo_file = os.path.join(self.tmpdir, 'go-basic.obo')
+		write_file(obo_file, OBO)
+		kwargs = dict(term_mode='propagated', obo_file=obo_file, formats=['wide', 'long'], compression='gzip')
+		plain = self.annotate('plain.txt', **kwargs)
+		out_file = self.annotate('query.go.txt', checkpoint_key='k1', **kwargs)
+		for fmt, path in output_paths(out_file, ['wide', 'long'], 'gzip').items():
+			self.assertEqual(read_file(path), read_file(output_paths(plain, [fmt], 'gzip')[fmt]))
+
+		lines = read_file("%s.gz" % out_file).splitlines()
+		self.assertEqual(lines[0].split('\t'), ['q1', 'GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000004'])
+		self.assertEqual(lines[2], 'q3\t')
+
+
+@unittest.skipIf(makedb is None or benchmark is None, "apsw or alignment tools are not installed")
+class SyntheticDataTest(unittest.TestCase):
+	'''
+	synthetic input files of benchmark are read by makedb
+	'''
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_pir_idmapping(self):
+		pir_file = os.path.join(self.tmpdir, 'idmapping.tb.gz')
+		benchmark.make_pir_idmapping(pir_file, products=1000)
+		pairs = list(makedb.iter_pir_accessions(pir_file))
+		self.assertEqual(len(pairs), 1000 * len(makedb.pir_columns))
+		self.assertIn(('NP_0000001', 'P0000001'), pairs)
+		self.assertIn(('XP_0000002', 'P0000002'), pairs)
+
+
+@unittest.skipIf(makedb is None or benchmark is None, "apsw or alignment tools are not installed")
+class UpdateDatabaseTest(unittest.TestCase):
+	'''
+	incremental update of makedb must make the same tables as a full build
+	of the new input files
+	'''
+	@classmethod
+	def setUpClass(cls):
+		cls.tmpdir = tempfile.mkdtemp()
+		cls.files = {}
+		for name in ['go1', 'go2', 'up1', 'up2', 'pir1', 'pir2']:
+			cls.files[name] = os.path.join(cls.tmpdir, "%s.gz" % name)
+
+		benchmark.make_go_dump(cls.files['go1'], terms=300, products=3000, seed=1)
+		benchmark.make_idmapping(cls.files['up1'], products=3000, seed=1)
+		benchmark.make_idmapping(cls.files['up2'], products=3200, seed=2)
+
+		#the first pair of repeated accession is kept case insensitively,
+		#XP_0000004 is in uniprot idmapping and is not merged from PIR
+		benchmark.make_pir_idmapping(cls.files['pir1'], products=3000, seed=1)
+		cls.append_pir(cls.files['pir1'], [('P0009999', 3, 'XP_0000004'), ('P0009998', 3, 'np_0000001')])
+
+		#new PIR release removes products, changes Ensembl accessions and
+		#the first uniprot of GeneID 5
+		benchmark.make_pir_idmapping(cls.files['pir2'], products=2900, seed=2)
+		cls.append_pir(cls.files['pir2'], [('P0009997', 2, '5')], first=True)
+
+		#new release deletes a block of associations, changes evidences and
+		#adds terms
+		fp = gzip.open(cls.files['go1'], 'rb')
+		lines = fp.readlines()
+		fp.close()
+
+		associations = [i for i, line in enumerate(lines) if line.startswith("INSERT INTO `association`")]
+		evidences = [i for i, line in enumerate(lines) if line.startswith("INSERT INTO `evidence`")]
+		lines[evidences[0]] = lines[evidences[0]].replace("'IEA'", "'EXP'")
+		del lines[associations[2]]
+		lines.append("INSERT INTO `term` VALUES (300,'new','biological_process','GO:0000300',0,0),"
+			"(301,'new','molecular_function','GO:0000301',0,0);\n")
+
+		fp = gzip.open(cls.files['go2'], 'wb')
+		fp.writelines(lines)
+		fp.close()
+
+		cls.old = cls.build('old.db', 'go1', 'up1')
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.tmpdir)
+
+	@classmethod
+	def append_pir(cls, pir_file, pairs, first=False):
+		'''
+		add PIR idmapping lines with one accession
+		@para pir_file str, PIR idmapping file made by benchmark
+		@para pairs list, uniprot, column index and accession of each line
+		@para first bool, add lines ahead of other lines
+		'''
+		fp = gzip.open(pir_file, 'rb')
+		lines = fp.readlines()
+		fp.close()
+
+		added = []
+		for uniprot, idx, acc in pairs:
+			cols = [uniprot] + [''] * 20 + ['1']
+			cols[idx] = acc
+			added.append("%s\n" % "\t".join(cols))
+		lines = added + lines if first else lines + added
+
+		fp = gzip.open(pir_file, 'wb')
+		fp.writelines(lines)
+		fp.close()
+
+	@classmethod
+	def build(cls, name, go, up, pir='pir1', **kwargs):
+		db_file = os.path.join(cls.tmpdir, name)
+		if not os.path.exists(db_file):
+			makedb.build_database(make_options(g=cls.files[go], u=cls.files[up],
+				p=cls.files[pir], o=db_file, **kwargs))
+		return db_file
+
+	def update(self, name, go, up, previous=None, pir='pir1'):
+		db_file = os.path.join(self.tmpdir, name)
+		if previous is None:
+			previous = db_file
+			shutil.copyfile(self.old, db_file)
+
+		makedb.update_database(make_options(g=self.files[go], u=self.files[up],
+			p=self.files[pir], o=db_file, update=previous))
+		return db_file
+
+	def get_uniprots(self, db_file, acc):
+		conn = sqlite3.connect(db_file)
+		uniprots = sorted(row[0] for row in conn.execute("SELECT uniprot FROM acc2uniprot WHERE acc=?", (acc,)))
+		conn.close()
+		return uniprots
+
+	def assertSameTables(self, db_file, expected_file):
+		tables = dump_tables(db_file)
+		expected = dump_tables(expected_file)
+		for table in expected:
+			self.assertEqual(len(tables[table]), len(expected[table]), table)
+			self.assertTrue(tables[table] == expected[table], "%s is not the same" % table)
+
+	def get_counts(self, db_file):
+		conn = sqlite3.connect(db_file)
+		sql = ("SELECT name, inserted, deleted, changed FROM provenance"
+			" WHERE version=(SELECT MAX(version) FROM version)")
+		counts = {row[0]: tuple(row[1:]) for row in conn.execute(sql)}
+		conn.close()
+		return counts
+
+	def test_update_all_inputs(self):
+		db_file = self.update('all.db', 'go2', 'up2', self.old)
+		self.assertSameTables(db_file, self.build('new.db', 'go2', 'up2'))
+
+		counts = self.get_counts(db_file)
+		self.assertEqual(counts['term'], (2, 0, 0))
+		self.assertEqual(counts['association'][1], 1000)
+		self.assertTrue(counts['association'][2] > 0)
+
+	def test_update_idmapping_only(self):
+		db_file = self.update('idmapping.db', 'go1', 'up2', self.old)
+		self.assertSameTables(db_file, self.build('idmapping_full.db', 'go1', 'up2'))
+
+		counts = self.get_counts(db_file)
+		self.assertEqual(counts['association'], (0, 0, 0))
+		self.assertTrue(counts['acc2uniprot'][0] > 0)
+
+	def test_merge_pir(self):
+		#PIR only accessions, repeated accessions and accessions of uniprot
+		#idmapping of full build
+		self.assertEqual(self.get_uniprots(self.old, 'NP_0000001'), ['P0000001'])
+		self.assertEqual(self.get_uniprots(self.old, 'ENSP00000000000'), ['P0000000'])
+		self.assertEqual(self.get_uniprots(self.old, '5'), ['P0000008'])
+		self.assertEqual(self.get_uniprots(self.old, 'XP_0000004'), ['P0000004'])
+
+	def test_update_pir_only(self):
+		db_file = self.update('pir.db', 'go1', 'up1', self.old, pir='pir2')
+		self.assertSameTables(db_file, self.build('pir_full.db', 'go1', 'up1', pir='pir2'))
+		self.assertEqual(self.get_uniprots(db_file, '5'), ['P0009997'])
+		self.assertEqual(self.get_uniprots(db_file, 'NP_0002999'), [])
+
+		counts = self.get_counts(db_file)
+		self.assertEqual(counts['association'], (0, 0, 0))
+		self.assertTrue(counts['acc2uniprot'][0] > 0)
+		self.assertTrue(counts['acc2uniprot'][1] > 0)
+
+	def test_update_in_place(self):
+		db_file = self.update('inplace.db', 'go2', 'up2')
+		self.assertSameTables(db_file, self.build('new.db', 'go2', 'up2'))
+
+	def test_update_with_row_hashes(self):
+		previous = self.build('hashed.db', 'go1', 'up1', row_hashes=True)
+		db_file = self.update('hashed_update.db', 'go2', 'up1', previous)
+		self.assertSameTables(db_file, self.build('go2_full.db', 'go2', 'up1'))
+
+		#digests saved by update are the same as digests of a full build
+		conn = sqlite3.connect(db_file)
+		digests = sorted(conn.execute("SELECT * FROM row_hash"))
+		conn.close()
+		full = self.build('go2_hashed.db', 'go2', 'up1', row_hashes=True)
+		conn = sqlite3.connect(full)
+		self.assertEqual(digests, sorted(conn.execute("SELECT * FROM row_hash")))
+		conn.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -4,8 +4,108 @@ import os
 import sys
 import argparse
 
+import config
+from goindex import build_go_index
+from goarrow import export_go_tables
+from alignment import Alignment
+from annotation import GoAnnotation, Blast2goAnnotator, GotchaAnnotator
+from utils import EvidencePolicy
+from checkpoint import checkpoint_key, file_digest, path_identity
+
 def annotate(args):
-	print args
+	if not os.path.isdir(args.outdir):
+		os.makedirs(args.outdir)
+
+	aligner = Alignment(
+		aligner = args.aligner,
+		query = args.query,
+		db = args.db,
+		outdir = args.outdir,
+		cpus = args.threads,
+		evalue = args.evalue,
+		seqtype = args.type,
+		mode = 'sensitive' if args.sensitive else 'fast',
+		shards = args.shards,
+		shard_by = args.shard_by,
+		workers = args.shard_workers,
+		resume = not args.no_resume
+	).run_alignment()
+
+	#annotate the alignments from pipe while aligner is running
+	if args.stream:
+		alignments = aligner.stream(args.keep_alignment)
+	else:
+		aligner.run()
+		alignments = aligner.outfile
+
+	filters = dict(
+		max_hits = args.max_hits,
+		max_evalue = args.evalue,
+		min_score = args.min_score,
+		min_identity = args.min_identity,
+		score_dropoff = args.score_dropoff
+	)
+
+	#ontology is used by propagation, scoring methods and gaf aspects
+	obo_digest = None
+	if args.go_terms != 'raw' or args.method != 'raw' or 'gaf' in args.output_formats:
+		obo_digest = file_digest(args.obo)
+
+	#annotation is resumed only when inputs and options are not changed, GO
+	#database may be updated in place and is identified by size and mtime
+	key = checkpoint_key(file_digest(args.query), args.aligner, args.db,
+		args.type, args.evalue, args.sensitive, sorted(filters.items()),
+		config.GO_DB, path_identity(config.GO_DB), obo_digest, args.go_terms,
+		args.relations, args.method, args.b2g_threshold, args.b2g_go_weight, args.gotcha_cutoff,
+		sorted(args.exclude_evidence), args.min_evidence_rank, args.best_evidence,
+		sorted(args.output_formats), args.compress, args.gaf_db, args.gaf_taxon)
+
+	evidence_policy = EvidencePolicy(
+		exclude = args.exclude_evidence,
+		min_rank = args.min_evidence_rank,
+		best = args.best_evidence
+	)
+
+	#subjects are mapped to GO terms by GoAnnotation, annotator only scores
+	annotator = None
+	if args.method == 'blast2go':
+		annotator = Blast2goAnnotator(
+			go_mapper = None,
+			obo_file = args.obo,
+			relations = args.relations,
+			threshold = args.b2g_threshold,
+			go_weight = args.b2g_go_weight
+		)
+
+	elif args.method == 'gotcha':
+		annotator = GotchaAnnotator(
+			go_mapper = None,
+			obo_file = args.obo,
+			relations = args.relations,
+			cutoff = args.gotcha_cutoff
+		)
+
+	annotate_out = os.path.join(args.outdir, "%s.go.txt" % os.path.basename(args.query))
+	GoAnnotation(alignments, annotate_out,
+		cache_size = args.cache_size,
+		cache_policy = args.cache_policy,
+		filters = filters,
+		checkpoint_key = key,
+		resume = not args.no_resume,
+		term_mode = args.go_terms,
+		obo_file = args.obo,
+		relations = args.relations,
+		annotator = annotator,
+		workers = args.annotate_workers,
+		evidence_policy = evidence_policy,
+		formats = args.output_formats,
+		compression = args.compress,
+		gaf_info = dict(
+			db = args.gaf_db,
+			taxon = args.gaf_taxon,
+			object_type = 'protein' if args.type == 'protein' else 'transcript'
+		)
+	)
 
 def make_blast_db(args):
 	print args
@@ -13,6 +113,15 @@ def make_blast_db(args):
 def make_diamond_db(args):
 	pass
 
+def make_go_db(args):
+	if not os.path.isfile(args.input):
+		raise Exception("** GO association database %s is not exists **" % args.input)
+
+	if args.format == 'mmap':
+		build_go_index(args.input, args.out)
+	else:
+		export_go_tables(args.input, args.out, args.format)
+
 def command_arguments():
 	'''
 	command line arguments
@@ -75,6 +184,153 @@ def command_arguments():
 		action = 'store_true',
 		help = 'use sensitive mode for diamond'
 	)
+	annotate_parser.add_argument('--shards',
+		help = 'split query into number of shards and align them in parallel (default: 1)',
+		type = int,
+		default = 1,
+		metavar = 'shards'
+	)
+	annotate_parser.add_argument('--shard-by',
+		help = 'split query by sequence count or residue count (default: count)',
+		choices = ['count', 'residues'],
+		default = 'count',
+		metavar = 'method'
+	)
+	annotate_parser.add_argument('--shard-workers',
+		help = 'number of shards aligned at the same time, threads are divided among them (default: shards)',
+		type = int,
+		metavar = 'workers'
+	)
+	annotate_parser.add_argument('--stream',
+		action = 'store_true',
+		help = 'annotate alignments from aligner output pipe while aligning, not for rapsearch and shards'
+	)
+	annotate_parser.add_argument('--keep-alignment',
+		action = 'store_true',
+		help = 'also write alignment output file in stream mode'
+	)
+	annotate_parser.add_argument('--no-resume',
+		action = 'store_true',
+		help = 'rerun all alignment and annotation work completed by previous run'
+	)
+	annotate_parser.add_argument('--max-hits',
+		help = 'number of best subjects used for annotation of each query (default: all)',
+		type = int,
+		metavar = 'hits'
+	)
+	annotate_parser.add_argument('--min-identity',
+		help = 'minimum identity percent of used alignments (default: 0)',
+		type = float,
+		metavar = 'identity'
+	)
+	annotate_parser.add_argument('--min-score',
+		help = 'minimum bit score of used alignments (default: 0)',
+		type = float,
+		metavar = 'score'
+	)
+	annotate_parser.add_argument('--score-dropoff',
+		help = 'only use alignments with bit score >= best score * (1 - dropoff) (default: none)',
+		type = float,
+		metavar = 'dropoff'
+	)
+	annotate_parser.add_argument('--annotate-workers',
+		help = 'number of processes to map alignments to GO terms, each opens GO database read only (default: 1)',
+		type = int,
+		default = 1,
+		metavar = 'workers'
+	)
+	annotate_parser.add_argument('--cache-size',
+		help = 'maximum number of subject accessions in GO lookup cache, 0 to disable (default: 100000)',
+		type = int,
+		default = 100000,
+		metavar = 'size'
+	)
+	annotate_parser.add_argument('--cache-policy',
+		help = 'GO lookup cache eviction policy, lru or arc (default: lru)',
+		choices = ['lru', 'arc'],
+		default = 'lru',
+		metavar = 'policy'
+	)
+	annotate_parser.add_argument('--method',
+		help = 'GO annotation method, raw assigns all GO terms of hits (default: raw)',
+		choices = ['raw', 'blast2go', 'gotcha'],
+		default = 'raw',
+		metavar = 'method'
+	)
+	annotate_parser.add_argument('--b2g-threshold',
+		help = 'annotation rule cutoff of blast2go method (default: 55)',
+		type = float,
+		default = 55,
+		metavar = 'threshold'
+	)
+	annotate_parser.add_argument('--b2g-go-weight',
+		help = 'weight of each additional GO term merged to parent in blast2go method (default: 5)',
+		type = float,
+		default = 5,
+		metavar = 'weight'
+	)
+	annotate_parser.add_argument('--gotcha-cutoff',
+		help = 'minimum C-score of GO terms in gotcha method (default: 0.5)',
+		type = float,
+		default = 0.5,
+		metavar = 'cscore'
+	)
+	annotate_parser.add_argument('--go-terms',
+		help = 'output mapped GO terms, propagated terms with all ancestors or reduced most specific terms (default: raw)',
+		choices = ['raw', 'propagated', 'reduced'],
+		default = 'raw',
+		metavar = 'mode'
+	)
+	annotate_parser.add_argument('--obo',
+		help = 'go-basic.obo file for propagated and reduced GO terms (default: go-basic.obo in database directory)',
+		default = config.GO_OBO,
+		metavar = 'obo'
+	)
+	annotate_parser.add_argument('--relations',
+		help = 'relation types used to propagate GO terms (default: is_a)',
+		nargs = '+',
+		default = ['is_a'],
+		metavar = 'relation'
+	)
+	annotate_parser.add_argument('--exclude-evidence',
+		help = 'evidence codes excluded from GO term lookup, e.g. IEA ND NR (default: none)',
+		nargs = '+',
+		default = [],
+		metavar = 'code'
+	)
+	annotate_parser.add_argument('--min-evidence-rank',
+		help = 'minimum evidence code rank from 0 to 5 of GO terms, e.g. 2 excludes IEA, ND and NR (default: 0)',
+		type = int,
+		default = 0,
+		metavar = 'rank'
+	)
+	annotate_parser.add_argument('--best-evidence',
+		action = 'store_true',
+		help = 'only keep the best ranked evidence of each GO term of subject'
+	)
+	annotate_parser.add_argument('--output-formats',
+		help = 'annotation output formats made in one pass, wide, long, gaf or wego (default: wide)',
+		nargs = '+',
+		choices = ['wide', 'long', 'gaf', 'wego'],
+		default = ['wide'],
+		metavar = 'format'
+	)
+	annotate_parser.add_argument('--compress',
+		help = 'compress annotation output files by gzip or zstd (default: none)',
+		choices = ['gzip', 'zstd'],
+		metavar = 'method'
+	)
+	annotate_parser.add_argument('--gaf-db',
+		help = 'database name of query identifiers in gaf output (default: topaz)',
+		default = 'topaz',
+		metavar = 'db'
+	)
+	annotate_parser.add_argument('--gaf-taxon',
+		help = 'NCBI taxonomy id of query organism in gaf output (default: 1)',
+		type = int,
+		default = 1,
+		metavar = 'taxon'
+	)
 
 	#make blast database
 	makedb_parser = subparsers.add_parser('makedb',
@@ -94,19 +350,29 @@ def command_arguments():
 		metavar = 'dbname'
 	)
 
-	#make diamond database
+	#make GO annotation database
 	makego_parser = subparsers.add_parser('makego',
 		help = "Make GO annotation database"
 	)
-	makego_parser.set_defaults(func=make_diamond_db)
+	makego_parser.set_defaults(func=make_go_db)
 	makego_parser.add_argument('-i', '--in',
-		help = 'Input protein fasta file',
-		metavar = 'fasta'
+		help = 'Input GO association database made by makedb.py, mmap format requires --acc2go',
+		dest = 'input',
+		required = True,
+		metavar = 'go.db'
 	)
 	makego_parser.add_argument('-o', '--out',
-		help = 'Name of Diamond database to be created',
+		help = 'Name of GO annotation database to be created',
+		required = True,
 		metavar = 'dbname'
 	)
+	makego_parser.add_argument('-f', '--format',
+		help = 'output format, mmap is a memory mapped GO index, parquet or arrow '
+				'is a directory of columnar GO tables (default: mmap)',
+		choices = ['mmap', 'parquet', 'arrow'],
+		default = 'mmap',
+		metavar = 'format'
+	)
 
 	return parser.parse_args()
 
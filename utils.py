@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-
+import os
+import attr
+import contextlib
+import collections
+import multiprocessing
 
 #GO annotation evidence code and the custom ID
 evidence_codes = [
@@ -40,9 +44,158 @@ evidence_codes = [
 	('NR', 22, 0)		#Not Recorded
 ]
 
+#evidence code rank, weight and code by custom ID, rank is scaled to 0-1 weight
+evidence_ranks = {eid: rank for code, eid, rank in evidence_codes}
+evidence_weights = {eid: rank / 5.0 for code, eid, rank in evidence_codes}
+evidence_names = {eid: code for code, eid, rank in evidence_codes}
+
 class EvidenceCode(dict):
+	'''
+	evidence code as key and custom ID as value, code can be accessed
+	as attribute like EvidenceCode().IEA
+	'''
 	def __init__(self):
-
+		dict.__init__(self, ((code, eid) for code, eid, rank in evidence_codes))
 
 	def __getattr__(self, attr):
 		return self[attr]
+
+
+@attr.s
+class EvidencePolicy(object):
+	'''
+	Evidence filter applied by GO term lookup in database or GO index
+	@para exclude list, evidence codes to be excluded like IEA, ND and NR
+	@para min_rank int, minimum rank of evidence code
+	@para best bool, only keep the best ranked evidence of each GO term
+	'''
+	exclude = attr.ib(default=attr.Factory(list))
+	min_rank = attr.ib(default=0)
+	best = attr.ib(default=False)
+	exclude_ids = attr.ib(init=False)
+
+	@exclude_ids.default
+	def get_exclude_ids(self):
+		codes = EvidenceCode()
+		for code in self.exclude:
+			if code not in codes:
+				raise Exception("** Unknown evidence code %s **" % code)
+		return sorted(codes[code] for code in self.exclude)
+
+	def is_active(self):
+		return bool(self.exclude_ids or self.min_rank > 0 or self.best)
+
+	def where(self, prefix=''):
+		'''
+		make sql conditions of the policy
+		@para prefix str, table alias with dot like a.
+		@return tuple, conditions joined with AND and bound args
+		'''
+		conds = []
+		args = []
+		if self.min_rank > 0:
+			conds.append("%srank>=?" % prefix)
+			args.append(self.min_rank)
+
+		if self.exclude_ids:
+			conds.append("%sevidence NOT IN (%s)" % (prefix, ','.join('?'*len(self.exclude_ids))))
+			args.extend(self.exclude_ids)
+
+		return ''.join(" AND %s" % cond for cond in conds), args
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='w'):
+	'''
+	write to a temporary file and rename it to path when completed, the
+	incomplete file is removed if any error occurs
+	@para path str, output file path
+	@para mode str, file open mode
+	'''
+	tmp_file = "%s.tmp" % path
+	fh = open(tmp_file, mode)
+	try:
+		yield fh
+	except:
+		fh.close()
+		os.remove(tmp_file)
+		raise
+	else:
+		fh.close()
+		os.rename(tmp_file, path)
+
+
+class SymbolTable(object):
+	'''
+	Intern strings like subject accessions as integer handles, the same
+	string always gets the same handle, so that hits are grouped and joined
+	by integers and strings are only needed again at output time
+	@para names list, strings to be interned first
+	'''
+	def __init__(self, names=()):
+		self.ids = {}
+		self.names = []
+		for name in names:
+			self.get_id(name)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __contains__(self, name):
+		return name in self.ids
+
+	def get_id(self, name):
+		'''
+		@para name str, string to be interned
+		@return int, handle of string
+		'''
+		handle = self.ids.get(name)
+		if handle is None:
+			handle = self.ids[name] = len(self.names)
+			self.names.append(intern(name) if type(name) is str else name)
+		return handle
+
+	def get_name(self, handle):
+		return self.names[handle]
+
+	def clear(self):
+		'''
+		forget all strings and give handles from 0 again, so that a table
+		shared with parser is scoped to a batch of records
+		'''
+		self.ids.clear()
+		del self.names[:]
+
+
+def parallel_map(func, items, jobs, window, initializer=None, initargs=()):
+	'''
+	ordered map over a process pool, at most window items are being
+	processed or waiting to be consumed to keep the memory flat
+	@para func, function can be pickled to subprocess
+	@para items, iterable input items
+	@para jobs int, number of processes
+	@para window int, maximum number of pending items
+	@para initializer, function called by each process when it starts
+	@para initargs tuple, arguments of initializer
+	@return generator, results in the same order with items
+	'''
+	pool = multiprocessing.Pool(jobs, initializer, initargs)
+	pending = collections.deque()
+	try:
+		for item in items:
+			pending.append(pool.apply_async(func, (item,)))
+			if len(pending) >= window:
+				yield pending.popleft().get()
+
+		while pending:
+			yield pending.popleft().get()
+
+	except:
+		pool.terminate()
+		raise
+
+	else:
+		pool.close()
+
+	finally:
+		pool.join()